@@ -0,0 +1,17 @@
+"""Settings for Celery workers and the relay/sweeper commands.
+
+Delivery only needs the send_notifications models and tasks. Leaving out the
+admin, auth, sessions, DRF and drf-spectacular (and using an empty URLconf,
+which Celery's startup checks would otherwise import) keeps the web stack out
+of worker processes. Everything else comes from settings.py.
+
+Use with DJANGO_SETTINGS_MODULE=notifications.settings_worker.
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'send_notifications',
+]
+MIDDLEWARE = []
+TEMPLATES = []
+ROOT_URLCONF = 'notifications.urls_worker'
@@ -1,10 +1,30 @@
+from functools import lru_cache
+
 from django.contrib import admin
 from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
+
+from send_notifications.views import metrics_view
+
+
+@lru_cache(maxsize=None)
+def _spectacular(name, **initkwargs):
+    # drf-spectacular pulls in its whole schema generator; load it with the first docs request
+    from drf_spectacular import views
+    return getattr(views, name).as_view(**initkwargs)
+
+
+def schema_view(request, *args, **kwargs):
+    return _spectacular('SpectacularAPIView')(request, *args, **kwargs)
+
+
+def swagger_view(request, *args, **kwargs):
+    return _spectacular('SpectacularSwaggerView', url_name='schema')(request, *args, **kwargs)
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('send_notifications.urls')),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+    path('api/schema/', schema_view, name='schema'),
+    path('api/docs/', swagger_view, name='swagger-ui'),
+    path('metrics', metrics_view, name='metrics'),
 ]
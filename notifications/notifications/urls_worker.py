@@ -0,0 +1,2 @@
+# Workers serve no HTTP; metrics are exported by the worker's own metrics server
+urlpatterns = []
@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import User, Notification, DeliveryAttempt
+from .models import User, Notification, DeliveryAttempt, NotificationTemplate
 
 admin.site.register(User)
+admin.site.register(NotificationTemplate)
 # admin.site.register(Notification)
 # admin.site.register(DeliveryAttempt)
 
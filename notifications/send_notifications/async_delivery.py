@@ -0,0 +1,218 @@
+import asyncio
+import importlib
+import json
+from typing import Dict, List, Optional, Tuple, Union
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from . import metrics, telegram, templating
+from .breaker import ProviderError, circuit_breaker
+from .models import ChannelChoices, Notification
+from .ratelimit import RateLimited, rate_limiter
+from .backends import EmailBackend, TelegramBackend, backends, build_email
+from .tasks import Outcomes, _get_channel_order
+
+SMTP_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+
+
+def _require(module_name: str):
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as exc:
+        raise ImproperlyConfigured(
+            f"NOTIFICATION_ASYNC_DELIVERY requires the '{module_name}' package"
+        ) from exc
+
+
+class _AsyncSMTPPool:
+    # The channel semaphore bounds concurrent senders, so the pool never holds
+    # more connections than that limit and acquiring never has to wait
+    def __init__(self):
+        self._aiosmtplib = _require("aiosmtplib")
+        self._idle = []
+
+    async def _connect(self):
+        client = self._aiosmtplib.SMTP(
+            hostname=settings.EMAIL_HOST,
+            port=settings.EMAIL_PORT,
+            use_tls=settings.EMAIL_USE_SSL,
+            start_tls=settings.EMAIL_USE_TLS,
+            timeout=settings.EMAIL_TIMEOUT or 30,
+        )
+        await client.connect()
+        if settings.EMAIL_HOST_USER:
+            try:
+                await client.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
+            except Exception:
+                client.close()
+                raise
+        return client
+
+    async def _acquire(self):
+        # An idle connection the server has closed is replaced before the message is
+        # handed over. A disconnect during the send is not retried: the server may
+        # already have accepted the message.
+        while self._idle:
+            client = self._idle.pop()
+            if client.is_connected:
+                return client
+            client.close()
+        return await self._connect()
+
+    async def send(self, message, sender: str, recipients: List[str]) -> None:
+        client = await self._acquire()
+        try:
+            await client.send_message(message, sender=sender, recipients=recipients)
+        except self._aiosmtplib.SMTPResponseException:
+            # The server rejected this message but the session is still usable
+            self._idle.append(client)
+            raise
+        except Exception:
+            client.close()
+            raise
+        self._idle.append(client)
+
+    async def close(self) -> None:
+        while self._idle:
+            client = self._idle.pop()
+            try:
+                await client.quit()
+            except Exception:  # noqa: BLE001 – best effort on shutdown
+                client.close()
+
+
+class AsyncDeliveryEngine:
+    """Runs channel fallback for many notifications concurrently on one event loop.
+
+    Concurrency is bounded per channel by the backend's ``concurrency`` hint.
+    The built-in Telegram backend goes over one pooled ``aiohttp.ClientSession``,
+    SMTP email over a small ``aiosmtplib`` connection pool; other backends run
+    their sync ``send`` in a thread.
+    """
+
+    def __init__(self):
+        self._semaphores = {}
+        self._http = None
+        self._http_errors = ()
+        self._smtp = None
+
+    async def __aenter__(self):
+        aiohttp = _require("aiohttp")
+        # Not all of these are OSErrors (e.g. ServerDisconnectedError), so they are counted
+        # as provider failures explicitly
+        self._http_errors = (aiohttp.ClientError,)
+        self._http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=backends[ChannelChoices.TELEGRAM].concurrency),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=settings.TELEGRAM_CONNECT_TIMEOUT,
+                sock_read=settings.TELEGRAM_READ_TIMEOUT,
+            ),
+        )
+        if settings.EMAIL_BACKEND == SMTP_BACKEND:
+            self._smtp = _AsyncSMTPPool()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._http.close()
+        if self._smtp is not None:
+            await self._smtp.close()
+
+    @staticmethod
+    async def _render(notification: Notification, channel: str) -> templating.Rendered:
+        # Templates are loaded before the loop starts (deliver_concurrently); one evicted
+        # since then is read in a thread, as the ORM cannot be called from the event loop
+        if notification.template_id is None or templating.template_cache.is_cached(notification.template_id):
+            return templating.render(notification, channel)
+        return await asyncio.to_thread(templating.render, notification, channel)
+
+    async def _send_telegram(self, notification: Notification) -> None:
+        content = await self._render(notification, ChannelChoices.TELEGRAM)
+        try:
+            async with self._http.post(
+                telegram.send_url(),
+                json=telegram.payload(notification.user.telegram_id, content.body, content.parse_mode),
+            ) as resp:
+                text = await resp.text()
+        except self._http_errors as exc:
+            raise ProviderError(str(exc) or exc.__class__.__name__) from exc
+        data = json.loads(text) if resp.content_type == "application/json" else {}
+        telegram.raise_for_result(resp.status, data, text)
+
+    async def _send_email(self, notification: Notification) -> None:
+        if self._smtp is None:
+            await asyncio.to_thread(backends[ChannelChoices.EMAIL].send, notification)
+            return
+        email = build_email(notification, await self._render(notification, ChannelChoices.EMAIL))
+        await self._smtp.send(email.message(), email.from_email, email.recipients())
+
+    def _semaphore(self, channel: str) -> asyncio.Semaphore:
+        if channel not in self._semaphores:
+            self._semaphores[channel] = asyncio.Semaphore(backends[channel].concurrency)
+        return self._semaphores[channel]
+
+    @staticmethod
+    async def _throttle(channel: str, notification: Notification) -> None:
+        recipient = backends[channel].recipient(notification.user)
+        while (delay := rate_limiter.reserve(channel, recipient)) > 0:
+            if delay > settings.NOTIFICATION_RATE_LIMIT_MAX_WAIT:
+                raise RateLimited(delay)
+            await asyncio.sleep(delay)
+
+    async def _send(self, channel: str, notification: Notification) -> Union[None, str, RateLimited]:
+        try:
+            await self._throttle(channel, notification)
+        except RateLimited as exc:
+            return exc
+        backend = backends[channel]
+        async with self._semaphore(channel):
+            try:
+                with circuit_breaker.track(channel), metrics.time_send(channel):
+                    if isinstance(backend, TelegramBackend):
+                        await self._send_telegram(notification)
+                    elif isinstance(backend, EmailBackend):
+                        await self._send_email(notification)
+                    else:
+                        await asyncio.to_thread(backend.send, notification)
+            except RateLimited as exc:
+                return exc
+            except Exception as exc:  # noqa: BLE001 – recorded as failure attempt
+                return str(exc) or exc.__class__.__name__
+        return None
+
+    async def deliver(self, notification: Notification) -> Tuple[List[Tuple[str, Optional[str]]], Optional[float]]:
+        outcome = []
+        retry_after = None
+        for channel in _get_channel_order(notification.user.preferred_channels or []):
+            wait = circuit_breaker.allow(channel)
+            if wait:
+                retry_after = wait if retry_after is None else min(retry_after, wait)
+                continue
+            error = await self._send(channel, notification)
+            if isinstance(error, RateLimited):
+                return outcome, error.retry_after
+            outcome.append((channel, error))
+            if error is None:
+                return outcome, None
+        # Set only when an open breaker was skipped: defer rather than fail
+        return outcome, retry_after
+
+    async def deliver_all(self, notifications: List[Notification]) -> Tuple[Outcomes, Dict[int, float]]:
+        results = await asyncio.gather(*(self.deliver(n) for n in notifications))
+        outcomes = {}
+        deferred = {}
+        for notification, (outcome, retry_after) in zip(notifications, results):
+            outcomes[notification.pk] = outcome
+            if retry_after is not None:
+                deferred[notification.pk] = retry_after
+        return outcomes, deferred
+
+
+async def _deliver_all(notifications: List[Notification]) -> Tuple[Outcomes, Dict[int, float]]:
+    async with AsyncDeliveryEngine() as engine:
+        return await engine.deliver_all(notifications)
+
+
+def deliver_concurrently(notifications: List[Notification]) -> Tuple[Outcomes, Dict[int, float]]:
+    templating.template_cache.warm(notification.template_id for notification in notifications)
+    return asyncio.run(_deliver_all(notifications))
@@ -0,0 +1,182 @@
+"""Channel backends: how a notification actually leaves the service.
+
+Each channel is served by the backend configured in ``NOTIFICATION_CHANNEL_BACKENDS``
+(dotted path plus options, like Django's ``CACHES``). Backends are imported and
+built on first use, so a worker only loads the transports it sends through.
+
+``send`` delivers one notification and raises on failure. ``send_batch`` returns
+one result per notification: None, or the exception raised or an error message.
+Exceptions let the circuit breaker tell a provider outage from a bad recipient.
+Backends that set
+``batch = True`` get whole batches from the batch task, which the provider can
+take in one submission. Others are called once per notification.
+"""
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.utils.module_loading import import_string
+
+from . import templating
+from .models import ChannelChoices, Notification
+
+logger = logging.getLogger(__name__)
+
+RECIPIENT_FIELDS = {
+    ChannelChoices.EMAIL: "email",
+    ChannelChoices.SMS: "phone_number",
+    ChannelChoices.TELEGRAM: "telegram_id",
+}
+
+
+class ChannelBackend:
+    # Whether send_batch submits a batch in one go rather than looping over send
+    batch = False
+
+    def __init__(self, channel: str, concurrency: Optional[int] = None, **options):
+        self.channel = channel
+        # Hint for how many sends to run at once, used by the async delivery engine
+        self.concurrency = concurrency or settings.NOTIFICATION_ASYNC_CONCURRENCY.get(channel, 10)
+        self.options = options
+
+    def recipient(self, user) -> str:
+        """Address the rate limiter keys per-recipient limits on."""
+        return getattr(user, RECIPIENT_FIELDS[self.channel])
+
+    def send(self, notification: Notification) -> None:
+        raise NotImplementedError
+
+    def send_batch(self, notifications: List[Notification]) -> List[Union[None, str, Exception]]:
+        errors = []
+        for notification in notifications:
+            try:
+                self.send(notification)
+            except Exception as exc:  # noqa: BLE001 – returned as this notification's error
+                errors.append(exc)
+            else:
+                errors.append(None)
+        return errors
+
+
+def build_email(notification: Notification, content: Optional[templating.Rendered] = None) -> EmailMessage:
+    content = content or templating.render(notification, ChannelChoices.EMAIL)
+    return EmailMessage(
+        content.subject,
+        content.body,
+        settings.DEFAULT_FROM_EMAIL,
+        [notification.user.email],
+    )
+
+
+class EmailBackend(ChannelBackend):
+    """Django's EMAIL_BACKEND over pooled connections; a batch goes out on one connection."""
+    batch = True
+
+    def __init__(self, channel: str, **options):
+        super().__init__(channel, **options)
+        from .mail import smtp_pool
+        self.pool = smtp_pool
+
+    def send(self, notification: Notification) -> None:
+        self.pool.send(build_email(notification))
+
+    def send_batch(self, notifications: List[Notification]) -> List[Optional[Exception]]:
+        return self.pool.send_messages([build_email(notification) for notification in notifications])
+
+
+class TelegramBackend(ChannelBackend):
+    """Bot API sendMessage over the pooled keep-alive session."""
+
+    def __init__(self, channel: str, **options):
+        super().__init__(channel, **options)
+        from . import telegram
+        self.telegram = telegram
+
+    def send(self, notification: Notification) -> None:
+        content = templating.render(notification, ChannelChoices.TELEGRAM)
+        self.telegram.send_message(notification.user.telegram_id, content.body, content.parse_mode)
+
+
+class StubSMSBackend(ChannelBackend):
+    """Placeholder until an SMS provider is integrated: renders the text and reports success."""
+
+    def send(self, notification: Notification) -> None:
+        if not notification.user.phone_number:
+            raise RuntimeError("Phone number not set for user")
+        # Rendered (and truncated to NOTIFICATION_SMS_MAX_LENGTH) as it would be for the provider call
+        templating.render(notification, ChannelChoices.SMS)
+
+
+class FakeBackend(ChannelBackend):
+    """In-memory backend for tests and benchmarks; nothing leaves the process.
+
+    Delivered ``(channel, recipient, body)`` tuples collect in ``FakeBackend.outbox``.
+    Options: ``latency`` seconds per call (per batch when ``batch`` is on) and a
+    ``failure_rate`` between 0 and 1.
+    """
+    outbox = []
+    _lock = threading.Lock()
+
+    def __init__(self, channel: str, latency: float = 0.0, failure_rate: float = 0.0, batch: bool = True, **options):
+        super().__init__(channel, **options)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.batch = batch
+
+    def _deliver(self, notification: Notification) -> Optional[str]:
+        if self.failure_rate and random.random() < self.failure_rate:
+            return "Simulated failure"
+        body = templating.render(notification, self.channel).body
+        with self._lock:
+            self.outbox.append((self.channel, self.recipient(notification.user), body))
+        return None
+
+    def send(self, notification: Notification) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        error = self._deliver(notification)
+        if error:
+            raise RuntimeError(error)
+
+    def send_batch(self, notifications: List[Notification]) -> List[Optional[str]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._deliver(notification) for notification in notifications]
+
+
+class _Registry:
+    def __init__(self):
+        self._backends: Dict[str, ChannelBackend] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, channel: str) -> ChannelBackend:
+        backend = self._backends.get(channel)
+        if backend is None:
+            with self._lock:
+                backend = self._backends.get(channel) or self._build(channel)
+                self._backends[channel] = backend
+        return backend
+
+    @staticmethod
+    def _build(channel: str) -> ChannelBackend:
+        try:
+            config = settings.NOTIFICATION_CHANNEL_BACKENDS[channel]
+        except KeyError:
+            raise ImproperlyConfigured(f"No backend configured for channel {channel!r}")
+        try:
+            backend_class = import_string(config["BACKEND"])
+        except ImportError as exc:
+            raise ImproperlyConfigured(f"Cannot import backend for channel {channel!r}: {exc}") from exc
+        return backend_class(channel, **config.get("OPTIONS", {}))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._backends.clear()
+
+
+backends = _Registry()
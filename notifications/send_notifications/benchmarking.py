@@ -0,0 +1,114 @@
+"""Helpers shared by the ``benchmark_*`` management commands.
+
+Kept free of model imports so benchmark worker processes can import it before
+``django.setup()``.
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import django
+from django.db import connection
+
+COMPARED = ("per_second", "p50_ms", "p95_ms", "p99_ms", "queries_per_item", "wall_ms", "import_ms")
+
+
+@contextmanager
+def benchmark_database(options: Optional[dict] = None):
+    """Create a throwaway test database for the default alias and drop it afterwards.
+
+    SQLite gets a file-backed database, unlike the test runner's in-memory one, so
+    several threads or processes can each open their own connection. ``options``
+    temporarily replaces the connection OPTIONS. Yields the test database settings.
+    """
+    settings_dict = connection.settings_dict
+    old_name = settings_dict["NAME"]
+    saved_options = settings_dict.get("OPTIONS", {})
+    test_settings = settings_dict.setdefault("TEST", {})
+    saved_test_name = test_settings.get("NAME")
+    tmpdir = None
+    if options is not None:
+        connection.close()
+        settings_dict["OPTIONS"] = options
+    if connection.vendor == "sqlite" and not saved_test_name:
+        tmpdir = tempfile.TemporaryDirectory()
+        test_settings["NAME"] = os.path.join(tmpdir.name, "benchmark.sqlite3")
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield dict(settings_dict)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        settings_dict["OPTIONS"] = saved_options
+        test_settings["NAME"] = saved_test_name
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+
+def summarize(count: int, elapsed: float, latencies: Optional[List[float]] = None,
+              queries: Optional[int] = None) -> Dict[str, Optional[float]]:
+    result = {
+        "count": count,
+        "seconds": round(elapsed, 3),
+        "per_second": round(count / elapsed, 1) if elapsed else None,
+    }
+    if queries is not None:
+        result["queries_per_item"] = round(queries / count, 2) if count else None
+    if latencies:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+        result.update(
+            p50_ms=round(cuts[49] * 1000, 2),
+            p95_ms=round(cuts[94] * 1000, 2),
+            p99_ms=round(cuts[98] * 1000, 2),
+        )
+    return result
+
+
+def compare(summary: dict, previous: Optional[dict]) -> Optional[str]:
+    if not previous:
+        return None
+    changes = []
+    for key in COMPARED:
+        old, new = previous.get(key), summary.get(key)
+        if old and new is not None:
+            changes.append(f"{key} {(new - old) / old:+.1%}")
+    return ", ".join(changes)
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def results_document(name: str, options: dict, **sections) -> dict:
+    return {
+        "benchmark": name,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "environment": {
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+        },
+        "options": options,
+        **sections,
+    }
+
+
+def save_results(results: dict, output: Optional[str]) -> str:
+    if not output:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join("benchmarks", f"{results['benchmark']}-{stamp}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as fh:
+        json.dump(results, fh, indent=2)
+    return output
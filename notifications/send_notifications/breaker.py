@@ -0,0 +1,337 @@
+import logging
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Tuple
+
+from django.conf import settings
+
+from .models import ChannelChoices
+from .ratelimit import REDIS_RETRY_INTERVAL, RateLimited
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# How long workers reuse the breaker states they last read before asking Redis again
+SNAPSHOT_TTL = 1.0
+
+# Adds a batch of results to the channel's window and opens the breaker when the
+# failure rate crosses the threshold. While half-open (open_until has passed) the
+# next result decides: success closes the breaker, failure opens it again.
+# Returns open_until, 0 when closed.
+_RECORD_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local calls = tonumber(ARGV[1])
+local failures = tonumber(ARGV[2])
+local window = tonumber(ARGV[5])
+local open_seconds = tonumber(ARGV[6])
+local ttl = math.ceil(window + 2 * open_seconds)
+local state = redis.call('HMGET', KEYS[1], 'open_until', 'window_start')
+local open_until = tonumber(state[1]) or 0
+if open_until > now then
+    return tostring(open_until)
+end
+if open_until > 0 then
+    redis.call('DEL', KEYS[1])
+    if failures == 0 then
+        return '0'
+    end
+    redis.call('HSET', KEYS[1], 'open_until', now + open_seconds)
+    redis.call('EXPIRE', KEYS[1], ttl)
+    return tostring(now + open_seconds)
+end
+if now - (tonumber(state[2]) or 0) > window then
+    redis.call('HSET', KEYS[1], 'window_start', now, 'calls', 0, 'failures', 0)
+end
+local total = redis.call('HINCRBY', KEYS[1], 'calls', calls)
+local failed = redis.call('HINCRBY', KEYS[1], 'failures', failures)
+if total >= tonumber(ARGV[4]) and failed >= tonumber(ARGV[3]) * total then
+    open_until = now + open_seconds
+    redis.call('DEL', KEYS[1])
+    redis.call('HSET', KEYS[1], 'open_until', open_until)
+end
+redis.call('EXPIRE', KEYS[1], ttl)
+return tostring(open_until)
+"""
+
+# Lets exactly one caller through a half-open breaker per probe interval.
+# Returns 0 when the caller may send, otherwise seconds until it is worth asking again.
+_PROBE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'open_until', 'probe_until')
+local open_until = tonumber(state[1]) or 0
+if open_until == 0 then
+    return '0'
+end
+if open_until > now then
+    return tostring(open_until - now)
+end
+local probe_until = tonumber(state[2]) or 0
+if probe_until > now then
+    return tostring(probe_until - now)
+end
+redis.call('HSET', KEYS[1], 'probe_until', now + tonumber(ARGV[1]))
+return '0'
+"""
+
+FIELDS = ("open_until", "probe_until", "calls", "failures", "window_start")
+
+
+class CircuitOpen(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Circuit open, retry after {retry_after:.2f}s")
+
+
+class ProviderError(RuntimeError):
+    """The provider failed to take the message (e.g. an HTTP 5xx), as opposed to rejecting the recipient."""
+
+
+# Only these say the channel itself is unhealthy: network errors (requests, smtplib and
+# aiosmtplib connection errors are OSErrors), timeouts and provider-side errors. Anything
+# else, like a user without a phone number or a chat the bot cannot reach, is about one
+# recipient and does not count toward the breaker.
+PROVIDER_ERRORS = (OSError, TimeoutError, ProviderError)
+RECIPIENT_ERRORS = (smtplib.SMTPRecipientsRefused,)
+
+
+def is_provider_failure(exc: BaseException) -> bool:
+    return isinstance(exc, PROVIDER_ERRORS) and not isinstance(exc, RECIPIENT_ERRORS)
+
+
+class _LocalBreakers:
+    # Same state machine as the Lua scripts, for when Redis is not configured or unreachable
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def fetch(self, channels: Iterable[str]) -> Dict[str, dict]:
+        with self._lock:
+            return {channel: dict(self._states.get(channel, {})) for channel in channels}
+
+    def probe(self, channel: str, seconds: float) -> float:
+        now = time.time()
+        with self._lock:
+            state = self._states.setdefault(channel, {})
+            open_until = state.get("open_until", 0.0)
+            if not open_until:
+                return 0.0
+            if open_until > now:
+                return open_until - now
+            if state.get("probe_until", 0.0) > now:
+                return state["probe_until"] - now
+            state["probe_until"] = now + seconds
+            return 0.0
+
+    def record(self, channel: str, calls: int, failures: int, config: dict) -> float:
+        now = time.time()
+        with self._lock:
+            state = self._states.setdefault(channel, {})
+            open_until = state.get("open_until", 0.0)
+            if open_until > now:
+                return open_until
+            if open_until:
+                state.clear()
+                if failures:
+                    state["open_until"] = now + config["open_seconds"]
+                return state.get("open_until", 0.0)
+            if now - state.get("window_start", 0.0) > config["window"]:
+                state.update(window_start=now, calls=0, failures=0)
+            state["calls"] += calls
+            state["failures"] += failures
+            if state["calls"] >= config["min_calls"] and state["failures"] >= config["failure_rate"] * state["calls"]:
+                state.clear()
+                state["open_until"] = now + config["open_seconds"]
+            return state.get("open_until", 0.0)
+
+
+class CircuitBreaker:
+    """Per-channel circuit breakers over a rolling window of send results.
+
+    Thresholds come from ``NOTIFICATION_CIRCUIT_BREAKER``; slow sends count as
+    failures. State lives in Redis when ``NOTIFICATION_CIRCUIT_BREAKER_REDIS_URL`` is
+    set, so one worker tripping a breaker stops the others too, and falls back to
+    process-local state otherwise. Reads go through a short-lived snapshot, so a
+    closed breaker costs no round trip.
+    """
+
+    def __init__(self):
+        self._local = _LocalBreakers()
+        self._scripts = None
+        self._redis_down_until = 0.0
+        self._snapshot = {}
+        self._snapshot_at = 0.0
+
+    @property
+    def config(self) -> dict:
+        return settings.NOTIFICATION_CIRCUIT_BREAKER
+
+    def _redis_scripts(self):
+        if time.monotonic() < self._redis_down_until:
+            return None
+        if self._scripts is None and settings.NOTIFICATION_CIRCUIT_BREAKER_REDIS_URL:
+            import redis
+            client = redis.Redis.from_url(
+                settings.NOTIFICATION_CIRCUIT_BREAKER_REDIS_URL,
+                socket_timeout=0.5,
+                socket_connect_timeout=0.5,
+            )
+            self._scripts = (
+                client,
+                client.register_script(_RECORD_SCRIPT),
+                client.register_script(_PROBE_SCRIPT),
+            )
+        return self._scripts
+
+    def _redis_failed(self) -> None:
+        logger.warning(
+            "Circuit breaker Redis unavailable, using local state for %ss", REDIS_RETRY_INTERVAL, exc_info=True
+        )
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_INTERVAL
+
+    def _fetch(self) -> Dict[str, dict]:
+        channels = ChannelChoices.values
+        scripts = self._redis_scripts()
+        if scripts is not None:
+            try:
+                pipe = scripts[0].pipeline(transaction=False)
+                for channel in channels:
+                    pipe.hmget(f"breaker:{channel}", *FIELDS)
+                return {
+                    channel: {field: float(value) for field, value in zip(FIELDS, values) if value is not None}
+                    for channel, values in zip(channels, pipe.execute())
+                }
+            except Exception:  # noqa: BLE001 – Redis outage must not stop delivery
+                self._redis_failed()
+        return self._local.fetch(channels)
+
+    def states(self) -> Dict[str, dict]:
+        if time.monotonic() - self._snapshot_at > SNAPSHOT_TTL:
+            self._snapshot = self._fetch()
+            self._snapshot_at = time.monotonic()
+        return self._snapshot
+
+    def state(self, channel: str) -> str:
+        open_until = self.states().get(channel, {}).get("open_until", 0.0)
+        if not open_until:
+            return CLOSED
+        return OPEN if open_until > time.time() else HALF_OPEN
+
+    def _degraded(self, channel: str) -> bool:
+        # Failing at half the tripping rate: still used, but after healthy channels
+        state = self.states().get(channel, {})
+        calls = state.get("calls", 0)
+        return (
+            calls >= max(1, self.config["min_calls"] // 2)
+            and state.get("failures", 0) >= self.config["failure_rate"] / 2 * calls
+        )
+
+    def order(self, channels: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Move degraded, then open channels behind the rest, otherwise keeping preference order.
+
+        Half-open channels keep their place so the next send through them is the probe.
+        """
+        if not self.config:
+            return channels
+
+        def key(channel):
+            state = self.state(channel)
+            if state == OPEN:
+                return 2
+            return 1 if state == CLOSED and self._degraded(channel) else 0
+
+        return tuple(sorted(channels, key=key))
+
+    def allow(self, channel: str) -> float:
+        """Return 0 if the channel may be used now, else seconds until it is worth trying again."""
+        if not self.config:
+            return 0.0
+        open_until = self.states().get(channel, {}).get("open_until", 0.0)
+        now = time.time()
+        if not open_until:
+            return 0.0
+        if open_until > now:
+            return open_until - now
+        wait = self._probe(channel)
+        if wait:
+            # Someone else is probing; no need to ask again until their probe slot runs out
+            self._snapshot[channel] = {"open_until": now + wait}
+        return wait
+
+    def _probe(self, channel: str) -> float:
+        seconds = self.config["open_seconds"]
+        scripts = self._redis_scripts()
+        if scripts is not None:
+            try:
+                return float(scripts[2](keys=[f"breaker:{channel}"], args=[seconds]))
+            except Exception:  # noqa: BLE001 – Redis outage must not stop delivery
+                self._redis_failed()
+        return self._local.probe(channel, seconds)
+
+    def record(self, channel: str, failures: int = 0, calls: int = 1) -> None:
+        if not self.config or not calls:
+            return
+        config = self.config
+        previous = self.states().get(channel, {}).get("open_until", 0.0)
+        open_until = None
+        scripts = self._redis_scripts()
+        if scripts is not None:
+            try:
+                open_until = float(scripts[1](
+                    keys=[f"breaker:{channel}"],
+                    args=[
+                        calls, failures, config["failure_rate"], config["min_calls"],
+                        config["window"], config["open_seconds"],
+                    ],
+                ))
+            except Exception:  # noqa: BLE001 – Redis outage must not stop delivery
+                self._redis_failed()
+        if open_until is None:
+            open_until = self._local.record(channel, calls, failures, config)
+        if open_until != previous:
+            if open_until and not previous:
+                logger.warning("Circuit breaker for %s opened", channel)
+            elif not open_until:
+                logger.info("Circuit breaker for %s closed", channel)
+            self._snapshot[channel] = {"open_until": open_until} if open_until else {}
+
+    def is_slow(self, elapsed: float) -> bool:
+        return bool(self.config) and elapsed > self.config["slow_call_seconds"]
+
+    @contextmanager
+    def track(self, channel: str):
+        """Record the wrapped send as a success, failure or slow call.
+
+        Throttling and errors that are not provider failures (see ``is_provider_failure``)
+        are re-raised without being counted.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        except RateLimited:
+            raise
+        except Exception as exc:
+            if is_provider_failure(exc):
+                self.record(channel, failures=1)
+            raise
+        self.record(channel, failures=int(self.is_slow(time.monotonic() - started)))
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {
+            channel: {
+                "state": self.state(channel),
+                "calls": int(state.get("calls", 0)),
+                "failures": int(state.get("failures", 0)),
+            }
+            for channel, state in self.states().items()
+        }
+
+
+circuit_breaker = CircuitBreaker()
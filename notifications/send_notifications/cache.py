@@ -0,0 +1,243 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import time as dt_time
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import ChannelChoices, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL_ORDER = (ChannelChoices.EMAIL, ChannelChoices.SMS, ChannelChoices.TELEGRAM)
+VALID_CHANNELS = frozenset(ChannelChoices.values)
+USER_FIELDS = (
+    "id", "email", "phone_number", "telegram_id", "preferred_channels",
+    "timezone", "quiet_hours_start", "quiet_hours_end",
+)
+# Carried as "HH:MM:SS" strings in the Redis tier
+TIME_FIELDS = ("quiet_hours_start", "quiet_hours_end")
+
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys) -> None:
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class UserCache:
+    """Resolves users by id, email or telegram_id through a local LRU and an optional Redis tier.
+
+    Entries hold plain field values; every lookup key of a user is indexed by its pk so
+    ``invalidate`` (wired to the User post_save/post_delete signals) can drop them all,
+    including keys for an email or telegram_id the user no longer has.
+
+    Invalidation reaches the Redis tier and this process only. Local copies therefore
+    live ``NOTIFICATION_CACHE_LOCAL_TTL`` seconds, so a worker picks up a changed address
+    that soon after the save.
+    """
+
+    def __init__(self):
+        self._local = None
+        self._keys_by_pk = {}
+        self._redis = None
+        self.redis_hits = 0
+        self.redis_misses = 0
+
+    @property
+    def local(self) -> TTLCache:
+        if self._local is None:
+            self._local = TTLCache(settings.NOTIFICATION_CACHE_SIZE, settings.NOTIFICATION_CACHE_LOCAL_TTL)
+        return self._local
+
+    def _redis_client(self):
+        if self._redis is None and settings.NOTIFICATION_CACHE_REDIS_URL:
+            import redis
+            self._redis = redis.Redis.from_url(
+                settings.NOTIFICATION_CACHE_REDIS_URL,
+                socket_timeout=0.5,
+                socket_connect_timeout=0.5,
+            )
+        return self._redis
+
+    @staticmethod
+    def _build(fields: dict) -> User:
+        user = User(**fields)
+        user._state.adding = False
+        return user
+
+    def _index(self, key: str, pk: int) -> None:
+        if len(self._keys_by_pk) > 2 * self.local.maxsize:
+            # Only needed for keys a user no longer matches; TTL covers what is dropped here
+            self._keys_by_pk.clear()
+        self._keys_by_pk.setdefault(pk, set()).add(key)
+
+    def _remember(self, key: str, fields: dict) -> None:
+        self.local.set(key, fields)
+        self._index(key, fields["id"])
+        client = self._redis_client()
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline()
+            raw = json.dumps(fields, cls=DjangoJSONEncoder)
+            pipe.setex(f"notif:user:{key}", int(settings.NOTIFICATION_CACHE_TTL), raw)
+            pipe.sadd(f"notif:userkeys:{fields['id']}", key)
+            pipe.expire(f"notif:userkeys:{fields['id']}", int(settings.NOTIFICATION_CACHE_TTL))
+            pipe.execute()
+        except Exception:  # noqa: BLE001 – the Redis tier is best effort
+            logger.warning("User cache Redis tier unavailable", exc_info=True)
+
+    def _recall(self, key: str) -> Optional[dict]:
+        fields = self.local.get(key)
+        if fields is not None:
+            return fields
+        client = self._redis_client()
+        if client is None:
+            return None
+        try:
+            raw = client.get(f"notif:user:{key}")
+        except Exception:  # noqa: BLE001 – the Redis tier is best effort
+            logger.warning("User cache Redis tier unavailable", exc_info=True)
+            return None
+        if raw is None:
+            self.redis_misses += 1
+            return None
+        self.redis_hits += 1
+        fields = json.loads(raw)
+        for name in TIME_FIELDS:
+            if fields.get(name) is not None:
+                fields[name] = dt_time.fromisoformat(fields[name])
+        self.local.set(key, fields)
+        self._index(key, fields["id"])
+        return fields
+
+    def _lookup(self, key: str, **lookup) -> User:
+        fields = self._recall(key)
+        if fields is None:
+            fields = User.objects.values(*USER_FIELDS).get(**lookup)
+            self._remember(key, fields)
+        return self._build(fields)
+
+    def get_by_email(self, email: str) -> User:
+        return self._lookup(f"email:{email}", email=email)
+
+    def get_by_telegram_id(self, telegram_id: str) -> User:
+        return self._lookup(f"telegram:{telegram_id}", telegram_id=telegram_id)
+
+    def get_many(self, pks: Iterable[int]) -> Dict[int, User]:
+        users = {}
+        missing = []
+        for pk in set(pks):
+            fields = self._recall(f"pk:{pk}")
+            if fields is None:
+                missing.append(pk)
+            else:
+                users[pk] = self._build(fields)
+        if missing:
+            for fields in User.objects.filter(pk__in=missing).values(*USER_FIELDS):
+                self._remember(f"pk:{fields['id']}", fields)
+                users[fields["id"]] = self._build(fields)
+        return users
+
+    def invalidate(self, user: User) -> None:
+        self.invalidate_many([user])
+
+    def invalidate_many(self, users: Iterable[User]) -> None:
+        # For bulk writes, which bypass the post_save signal; one Redis round trip each way
+        keys = set()
+        pks = set()
+        for user in users:
+            keys |= {f"email:{user.email}", f"telegram:{user.telegram_id}"}
+            if user.pk is not None:
+                pks.add(user.pk)
+                keys |= self._keys_by_pk.pop(user.pk, set()) | {f"pk:{user.pk}"}
+        self.local.delete(*keys)
+        client = self._redis_client()
+        if client is None:
+            return
+        try:
+            pipe = client.pipeline()
+            for pk in pks:
+                pipe.smembers(f"notif:userkeys:{pk}")
+            for members in pipe.execute():
+                keys |= {key.decode() for key in members}
+            client.delete(
+                *(f"notif:userkeys:{pk}" for pk in pks),
+                *(f"notif:user:{key}" for key in keys),
+            )
+        except Exception:  # noqa: BLE001 – the Redis tier is best effort
+            logger.warning("User cache Redis tier unavailable", exc_info=True)
+
+    def clear(self) -> None:
+        self.local.clear()
+        self._keys_by_pk.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.local.stats(), "redis_hits": self.redis_hits, "redis_misses": self.redis_misses}
+
+
+@lru_cache(maxsize=1024)
+def _channel_order(preferred: Tuple[str, ...]) -> Tuple[str, ...]:
+    normalized = [c for c in dict.fromkeys(preferred) if c in VALID_CHANNELS]
+    # Append any missing defaults to ensure full fallback coverage
+    return tuple(normalized) + tuple(c for c in DEFAULT_CHANNEL_ORDER if c not in normalized)
+
+
+def channel_order(user_preferred: Optional[List[str]]) -> Tuple[str, ...]:
+    if not user_preferred:
+        return DEFAULT_CHANNEL_ORDER
+    return _channel_order(tuple(c for c in user_preferred if isinstance(c, str)))
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    info = _channel_order.cache_info()
+    return {
+        "users": user_cache.stats(),
+        "channel_orders": {"size": info.currsize, "maxsize": info.maxsize, "hits": info.hits, "misses": info.misses},
+    }
+
+
+user_cache = UserCache()
@@ -0,0 +1,150 @@
+"""Coalescing of bursts: notifications to the same user and channel within
+``NOTIFICATION_DIGEST_WINDOW`` seconds are delivered as one digest message.
+
+Eligible notifications go to the DigestBuffer instead of the outbox. Once the
+oldest one for a user and channel has waited out the window, ``flush_due`` merges
+everything buffered for that pair into a digest notification and queues it; the
+originals point at the digest and take its final status when it is delivered.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import templating
+from .cache import channel_order, user_cache
+from .models import ChannelChoices, DigestBuffer, Notification, NotificationStatus, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+DIGEST_HEADER = "You have {count} new notifications:"
+
+
+def eligible(notification: Notification) -> bool:
+    return (
+        bool(settings.NOTIFICATION_DIGEST_WINDOW)
+        and not notification.is_digest
+        and notification.priority in settings.NOTIFICATION_DIGEST_PRIORITIES
+    )
+
+
+def buffer(notifications: Iterable[Notification]) -> None:
+    """Hold notifications back for merging; call inside the transaction that created them.
+
+    Needs ``notification.user``; pairs are keyed by the user's first preferred channel.
+    """
+    release_at = timezone.now() + timedelta(seconds=settings.NOTIFICATION_DIGEST_WINDOW)
+    DigestBuffer.objects.bulk_create(
+        DigestBuffer(
+            notification=notification,
+            user_id=notification.user_id,
+            channel=channel_order(notification.user.preferred_channels)[0],
+            release_at=release_at,
+        )
+        for notification in notifications
+    )
+
+
+def _chunked(items: List[int], size: int):
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _merge(notifications: List[Notification]) -> str:
+    # Plain-text bodies (the email rendering) so channel-specific markup never mixes
+    bodies = [templating.render(notification, ChannelChoices.EMAIL).body for notification in notifications]
+    return "\n\n".join([DIGEST_HEADER.format(count=len(bodies)), *bodies])
+
+
+def flush_due(limit: Optional[int] = None) -> int:
+    """Queue buffered notifications whose window has passed, merged per user and channel.
+
+    A pair with a single notification queues it unchanged. Newer rows of a due pair
+    join its digest early rather than start a window of their own. Returns how many
+    notifications left the buffer.
+    """
+    limit = limit or settings.NOTIFICATION_OUTBOX_BATCH_SIZE
+    with transaction.atomic():
+        due = set(
+            DigestBuffer.objects.filter(release_at__lte=timezone.now())
+            .order_by("release_at")
+            .values_list("user_id", "channel")[:limit]
+        )
+        if not due:
+            return 0
+        rows = [
+            row
+            for row in DigestBuffer.objects.select_for_update(skip_locked=True)
+            .filter(user_id__in={user_id for user_id, _ in due})
+            .values_list("id", "notification_id", "user_id", "channel")
+            if (row[2], row[3]) in due
+        ]
+        if not rows:
+            return 0
+        groups = defaultdict(list)
+        for _, notification_id, user_id, channel in rows:
+            groups[(user_id, channel)].append(notification_id)
+        notifications = Notification.objects.in_bulk([row[1] for row in rows])
+        users = user_cache.get_many(user_id for user_id, _ in groups)
+
+        singles = []
+        digests = []
+        for (user_id, channel), ids in groups.items():
+            for chunk in _chunked(sorted(ids), settings.NOTIFICATION_DIGEST_MAX_ITEMS):
+                originals = [notifications[pk] for pk in chunk if pk in notifications]
+                if len(originals) < 2:
+                    singles.extend(originals)
+                    continue
+                for notification in originals:
+                    notification.user = users[user_id]
+                digest = Notification(
+                    user_id=user_id,
+                    message=_merge(originals),
+                    priority=originals[0].priority,
+                    status=NotificationStatus.IN_PROGRESS,
+                    last_channel=channel,
+                    is_digest=True,
+                )
+                digests.append((digest, originals))
+
+        Notification.objects.bulk_create([digest for digest, _ in digests])
+        merged = []
+        now = timezone.now()
+        for digest, originals in digests:
+            for notification in originals:
+                notification.digest = digest
+                notification.updated_at = now
+                merged.append(notification)
+        Notification.objects.bulk_update(merged, ["digest", "updated_at"])
+        OutboxMessage.objects.bulk_create(
+            OutboxMessage(notification=notification, priority=notification.priority)
+            for notification in [*singles, *(digest for digest, _ in digests)]
+        )
+        DigestBuffer.objects.filter(id__in=[row[0] for row in rows]).delete()
+    logger.debug("Flushed %s buffered notifications into %s digests", len(rows), len(digests))
+    return len(rows)
+
+
+def settle_merged(notifications: Iterable[Notification]) -> None:
+    """Give the notifications merged into these digests their digest's outcome.
+
+    Call in the transaction that saves the digests; non-digests cost nothing.
+    """
+    now = timezone.now()
+    outcomes = defaultdict(list)
+    for notification in notifications:
+        if notification.is_digest and notification.status in (NotificationStatus.SENT, NotificationStatus.FAILED):
+            outcomes[(notification.status, notification.last_channel)].append(notification.pk)
+    for (status, channel), digest_ids in outcomes.items():
+        fields = {"status": status, "last_channel": channel, "updated_at": now}
+        if status == NotificationStatus.SENT:
+            fields["sent_at"] = now
+        else:
+            fields["error"] = "Digest delivery failed"
+        Notification.objects.filter(digest_id__in=digest_ids).update(**fields)
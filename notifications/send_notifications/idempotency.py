@@ -0,0 +1,143 @@
+"""Duplicate suppression for the send endpoints and for delivery retries.
+
+Requests are matched by ``Idempotency-Key`` (unique on Notification, with a cached
+key -> notification lookup in front) or, within ``NOTIFICATION_DEDUPE_WINDOW``,
+by a hash of recipient, channel and content. Delivery tasks note each completed
+provider send here before persisting it, so a retry after a failed write does not
+send the message again.
+"""
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import TTLCache
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with different content."""
+
+
+def content_hash(user_id: int, channel: str, content: dict) -> str:
+    raw = json.dumps([user_id, channel, content], sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class _Store:
+    # Local LRU with an optional shared Redis tier (NOTIFICATION_CACHE_REDIS_URL), best effort:
+    # the database stays the source of truth for keys
+
+    def __init__(self):
+        self._local = None
+        self._redis = None
+
+    @property
+    def local(self) -> TTLCache:
+        if self._local is None:
+            self._local = TTLCache(settings.NOTIFICATION_CACHE_SIZE, settings.NOTIFICATION_IDEMPOTENCY_TTL)
+        return self._local
+
+    def _redis_client(self):
+        if self._redis is None and settings.NOTIFICATION_CACHE_REDIS_URL:
+            import redis
+            self._redis = redis.Redis.from_url(
+                settings.NOTIFICATION_CACHE_REDIS_URL,
+                socket_timeout=0.5,
+                socket_connect_timeout=0.5,
+            )
+        return self._redis
+
+    def set(self, key: str, value: str) -> None:
+        self.local.set(key, value)
+        client = self._redis_client()
+        if client is None:
+            return
+        try:
+            client.setex(f"notif:idem:{key}", int(settings.NOTIFICATION_IDEMPOTENCY_TTL), value)
+        except Exception:  # noqa: BLE001 – the Redis tier is best effort
+            logger.warning("Idempotency Redis tier unavailable", exc_info=True)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        client = self._redis_client()
+        if not missing or client is None:
+            return found
+        try:
+            values = client.mget([f"notif:idem:{key}" for key in missing])
+        except Exception:  # noqa: BLE001 – the Redis tier is best effort
+            logger.warning("Idempotency Redis tier unavailable", exc_info=True)
+            return found
+        for key, value in zip(missing, values):
+            if value is not None:
+                found[key] = value.decode()
+                self.local.set(key, found[key])
+        return found
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+
+_store = _Store()
+
+
+def find_original(key: str, digest: str) -> Optional[int]:
+    """Id of the notification created with ``key``; raises IdempotencyConflict if its content differs."""
+    cached = _store.get(f"key:{key}")
+    if cached is not None:
+        notification_id, original_digest = cached.split(":", 1)
+        notification_id = int(notification_id)
+    else:
+        row = Notification.objects.filter(idempotency_key=key).values_list("id", "content_hash").first()
+        if row is None:
+            return None
+        notification_id, original_digest = row
+        remember(key, notification_id, original_digest)
+    if original_digest != digest:
+        raise IdempotencyConflict(key)
+    return notification_id
+
+
+def remember(key: str, notification_id: int, digest: str) -> None:
+    _store.set(f"key:{key}", f"{notification_id}:{digest}")
+
+
+def find_duplicate(user_id: int, digest: str) -> Optional[int]:
+    """Newest notification to the same user with the same content inside the dedupe window."""
+    window = settings.NOTIFICATION_DEDUPE_WINDOW
+    if not window:
+        return None
+    # Range scan on notification_user_hist_idx over the user's last few seconds of rows
+    return (
+        Notification.objects.filter(
+            user_id=user_id,
+            created_at__gte=timezone.now() - timedelta(seconds=window),
+            content_hash=digest,
+        )
+        .order_by("-created_at", "-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+
+
+def mark_sent(notification_id: int, channel: str) -> None:
+    _store.set(f"sent:{notification_id}", channel)
+
+
+def sent_channels(notification_ids: Iterable[int]) -> Dict[int, str]:
+    """Channels that already delivered these notifications, for sends whose result was never saved."""
+    found = _store.get_many(f"sent:{notification_id}" for notification_id in notification_ids)
+    return {int(key.split(":", 1)[1]): channel for key, channel in found.items()}
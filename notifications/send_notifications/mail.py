@@ -0,0 +1,134 @@
+import smtplib
+import threading
+import time
+from typing import List, Optional
+
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+
+class _PooledConnection:
+    def __init__(self, backend):
+        self.backend = backend
+        self.sent = 0
+        self.last_used = time.monotonic()
+        # Set once the current message reaches DATA: a drop after that may follow the
+        # server accepting it, so the send must not be repeated
+        self.handed_over = False
+        smtp = getattr(backend, "connection", None)
+        if smtp is not None:
+            data = smtp.data
+
+            def tracked_data(msg):
+                self.handed_over = True
+                return data(msg)
+
+            smtp.data = tracked_data
+
+
+class SMTPConnectionPool:
+    """Keeps one open mail backend connection per thread and backend configuration.
+
+    Connections are recycled after ``NOTIFICATION_SMTP_MAX_MESSAGES_PER_CONNECTION``
+    messages, checked with NOOP when idle for longer than
+    ``NOTIFICATION_SMTP_HEALTHCHECK_INTERVAL`` seconds and reopened once when the
+    server turns out to have dropped them before the message was handed over.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _connections(self):
+        if not hasattr(self._local, "connections"):
+            self._local.connections = {}
+        return self._local.connections
+
+    @staticmethod
+    def _key():
+        return (
+            settings.EMAIL_BACKEND,
+            settings.EMAIL_HOST,
+            settings.EMAIL_PORT,
+            settings.EMAIL_HOST_USER,
+            settings.EMAIL_USE_TLS,
+            settings.EMAIL_USE_SSL,
+        )
+
+    @staticmethod
+    def _is_healthy(entry: _PooledConnection) -> bool:
+        smtp = getattr(entry.backend, "connection", None)
+        if smtp is None:
+            # Non-SMTP backends (console, locmem) have nothing to check
+            return True
+        if time.monotonic() - entry.last_used < settings.NOTIFICATION_SMTP_HEALTHCHECK_INTERVAL:
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _acquire(self, key) -> _PooledConnection:
+        connections = self._connections()
+        entry = connections.get(key)
+        if entry is not None and (
+            entry.sent >= settings.NOTIFICATION_SMTP_MAX_MESSAGES_PER_CONNECTION
+            or not self._is_healthy(entry)
+        ):
+            self._discard(key)
+            entry = None
+        if entry is None:
+            backend = get_connection(fail_silently=False)
+            backend.open()
+            entry = connections[key] = _PooledConnection(backend)
+        return entry
+
+    def _discard(self, key) -> None:
+        entry = self._connections().pop(key, None)
+        if entry is None:
+            return
+        try:
+            entry.backend.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def _send_one(self, key, message: EmailMessage) -> None:
+        entry = self._acquire(key)
+        entry.handed_over = False
+        try:
+            entry.backend.send_messages([message])
+        except smtplib.SMTPServerDisconnected:
+            self._discard(key)
+            if entry.handed_over:
+                raise
+            entry = self._acquire(key)
+            entry.backend.send_messages([message])
+        entry.sent += 1
+        entry.last_used = time.monotonic()
+
+    def send(self, message: EmailMessage) -> None:
+        self._send_one(self._key(), message)
+
+    def send_messages(self, messages: List[EmailMessage]) -> List[Optional[Exception]]:
+        # Every message goes over the same connection; failures are reported per message
+        key = self._key()
+        errors = []
+        for message in messages:
+            try:
+                self._send_one(key, message)
+                errors.append(None)
+            except Exception as exc:  # noqa: BLE001 – reported back per message
+                errors.append(exc)
+        return errors
+
+    def close_all(self) -> None:
+        for key in list(self._connections()):
+            self._discard(key)
+
+
+smtp_pool = SMTPConnectionPool()
+
+
+@worker_process_shutdown.connect
+def _close_smtp_pool(**kwargs):
+    smtp_pool.close_all()
@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from send_notifications import partitioning, retention
+from send_notifications.models import DeliveryAttempt, Notification
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive notifications and delivery attempts older than their retention period "
+        "(NOTIFICATION_RETENTION_DAYS, NOTIFICATION_ATTEMPT_RETENTION_DAYS) to compressed files "
+        "and delete them in batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output-dir", help="Archive directory, defaults to NOTIFICATION_ARCHIVE_DIR")
+        parser.add_argument("--format", choices=sorted(retention.WRITERS), help="Defaults to NOTIFICATION_ARCHIVE_FORMAT")
+        parser.add_argument("--batch-size", type=int, default=None, help="Rows per delete transaction")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Seconds to pause between batches")
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many rows would be removed")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"] or settings.NOTIFICATION_RETENTION_BATCH_SIZE
+        now = timezone.now()
+        plan = [
+            (status, now - timedelta(days=days))
+            for status, days in settings.NOTIFICATION_RETENTION_DAYS.items()
+            if days
+        ]
+        attempt_days = settings.NOTIFICATION_ATTEMPT_RETENTION_DAYS
+        attempt_cutoff = now - timedelta(days=attempt_days) if attempt_days else None
+
+        if options["dry_run"]:
+            for status, cutoff in plan:
+                count = retention.count_expired(Notification, cutoff, status)
+                self.stdout.write(f"{status}: {count} notifications created before {cutoff:%Y-%m-%d %H:%M}")
+            if attempt_cutoff:
+                count = retention.count_expired(DeliveryAttempt, attempt_cutoff)
+                self.stdout.write(f"attempts: {count} created before {attempt_cutoff:%Y-%m-%d %H:%M}")
+            return
+
+        try:
+            archive = retention.Archive(
+                options["output_dir"] or settings.NOTIFICATION_ARCHIVE_DIR,
+                options["format"] or settings.NOTIFICATION_ARCHIVE_FORMAT,
+            )
+        except ImproperlyConfigured as exc:
+            raise CommandError(str(exc))
+        started = time.perf_counter()
+        try:
+            for status, cutoff in plan:
+                count = retention.expire_notifications(status, cutoff, archive, batch_size, options["sleep"])
+                self.stdout.write(f"{status}: archived and deleted {count} notifications")
+            if attempt_cutoff:
+                count = 0
+                if partitioning.is_partitioned():
+                    count += retention.drop_expired_partitions(attempt_cutoff, archive, batch_size)
+                count += retention.expire_attempts(attempt_cutoff, archive, batch_size, options["sleep"])
+                self.stdout.write(f"attempts: archived and deleted {count}")
+        finally:
+            archive.close()
+
+        elapsed = time.perf_counter() - started
+        rows = sum(archive.rows.values())
+        self.stdout.write(f"{rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)")
+        for table, path in archive.paths.items():
+            self.stdout.write(self.style.SUCCESS(f"{table}: {archive.rows[table]} rows written to {path}"))
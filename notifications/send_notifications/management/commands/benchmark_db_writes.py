@@ -0,0 +1,151 @@
+import json
+import multiprocessing
+import queue
+import time
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from send_notifications.benchmarking import benchmark_database, compare, results_document, save_results, summarize
+
+# Models are imported inside functions: spawned workers import this module before django.setup()
+
+# SQLite as configured before WAL and IMMEDIATE transactions, as a baseline
+LEGACY_SQLITE_OPTIONS = {"timeout": 5, "init_command": "PRAGMA journal_mode=DELETE"}
+
+WORKER_SETTINGS = {
+    "EMAIL_BACKEND": "django.core.mail.backends.locmem.EmailBackend",
+    "NOTIFICATION_RATE_LIMITS": {},
+    "NOTIFICATION_RATE_LIMIT_REDIS_URL": None,
+    "NOTIFICATION_CIRCUIT_BREAKER_REDIS_URL": None,
+    "NOTIFICATION_CACHE_REDIS_URL": None,
+}
+
+
+def _worker(database, notification_ids, barrier, results):
+    # Runs in a spawned process, like a prefork Celery child with its own connection
+    django.setup()
+    from django.conf import settings
+    from send_notifications.tasks import send_notification_task
+
+    for name, value in WORKER_SETTINGS.items():
+        setattr(settings, name, value)
+    connection.settings_dict.update(database)
+    connection.ensure_connection()
+    latencies = []
+    errors = []
+    barrier.wait()
+    for notification_id in notification_ids:
+        started = time.perf_counter()
+        try:
+            send_notification_task.run(notification_id)
+        except Exception as exc:  # noqa: BLE001 – counted, e.g. "database is locked"
+            errors.append(f"{exc.__class__.__name__}: {exc}")
+        latencies.append(time.perf_counter() - started)
+    connection.close()
+    results.put((latencies, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure concurrent send_notification_task writes from several processes against the "
+        "configured database; on SQLite also against the old rollback-journal settings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+        parser.add_argument("--notifications", type=int, default=2000)
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--output", help="Results file, defaults to benchmarks/db_writes-<timestamp>.json")
+        parser.add_argument("--compare", help="Previous results file, e.g. from a run with another DB_ENGINE")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["notifications"] < 1 or options["users"] < 1:
+            raise CommandError("--workers, --notifications and --users must be positive")
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as fh:
+                baseline = json.load(fh)
+
+        variants = {"configured": None}
+        if connection.vendor == "sqlite":
+            variants = {"sqlite-legacy": LEGACY_SQLITE_OPTIONS, **variants}
+
+        results = {}
+        for name, db_options in variants.items():
+            with benchmark_database(db_options) as database:
+                ids = self._seed(options["users"], options["notifications"])
+                connections.close_all()
+                results[name] = self._run(database, ids, options["workers"])
+                results[name]["sent"] = self._sent()
+
+        document = results_document(
+            "db_writes",
+            {key: options[key] for key in ("workers", "notifications", "users")},
+            engine=connection.settings_dict["ENGINE"],
+            variants=results,
+        )
+        for name, summary in results.items():
+            self.stdout.write(
+                f"{name:>14}: {summary['per_second']:8.1f} notifications/s  p50 {summary['p50_ms']:.2f}ms  "
+                f"p95 {summary['p95_ms']:.2f}ms  p99 {summary['p99_ms']:.2f}ms  "
+                f"{summary['sent']}/{summary['count']} sent, {summary['errors']} errors"
+            )
+            for error in summary["sample_errors"]:
+                self.stdout.write(f"                {error}")
+            changes = compare(summary, (baseline or {}).get("variants", {}).get(name))
+            if changes:
+                self.stdout.write(f"                vs {baseline['engine']}: {changes}")
+        output = save_results(document, options["output"])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+    @staticmethod
+    def _seed(users, notifications):
+        from send_notifications.models import ChannelChoices, Notification, User
+
+        created = User.objects.bulk_create(
+            User(email=f"user{i}@example.com", phone_number=str(i), telegram_id=str(i),
+                 preferred_channels=[ChannelChoices.EMAIL])
+            for i in range(users)
+        )
+        Notification.objects.bulk_create(
+            Notification(user=created[i % users], message="benchmark") for i in range(notifications)
+        )
+        return list(Notification.objects.order_by("id").values_list("id", flat=True))
+
+    @staticmethod
+    def _sent():
+        from send_notifications.models import Notification, NotificationStatus
+        return Notification.objects.filter(status=NotificationStatus.SENT).count()
+
+    @staticmethod
+    def _run(database, ids, workers):
+        context = multiprocessing.get_context("spawn")
+        barrier = context.Barrier(workers + 1)
+        results = context.Queue()
+        processes = [
+            context.Process(target=_worker, args=(database, ids[index::workers], barrier, results))
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        # Timing starts once every worker has set up Django and connected
+        barrier.wait()
+        started = time.perf_counter()
+        latencies = []
+        errors = []
+        for _ in processes:
+            try:
+                worker_latencies, worker_errors = results.get(timeout=600)
+            except queue.Empty:
+                raise CommandError("Benchmark worker did not finish")
+            latencies.extend(worker_latencies)
+            errors.extend(worker_errors)
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+        summary = summarize(len(ids), elapsed, latencies)
+        summary["errors"] = len(errors)
+        summary["sample_errors"] = sorted(set(errors))[:3]
+        return summary
@@ -0,0 +1,263 @@
+import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from send_notifications import telegram
+from send_notifications.backends import FakeBackend
+from send_notifications.benchmarking import benchmark_database, compare, results_document, save_results, summarize
+from send_notifications.mail import smtp_pool
+from send_notifications.models import ChannelChoices, Notification, NotificationStatus, OutboxMessage, User
+from send_notifications.outbox import relay_batch
+from send_notifications.stubs import StubSMTPServer, StubTelegramServer, serve_in_process
+from send_notifications.tasks import send_notification_task
+
+USER_CHANNELS = {
+    "email": [[ChannelChoices.EMAIL]],
+    "telegram": [[ChannelChoices.TELEGRAM]],
+    "mixed": [[ChannelChoices.EMAIL], [ChannelChoices.TELEGRAM]],
+}
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _run_concurrently(func, items, concurrency):
+    # Each thread gets its own DB connection (closed at the end) and query counter
+    work = queue.SimpleQueue()
+    for item in items:
+        work.put(item)
+    latencies = []
+    queries = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        counter = _QueryCounter()
+        timings = []
+        try:
+            with connection.execute_wrapper(counter):
+                while True:
+                    try:
+                        item = work.get_nowait()
+                    except queue.Empty:
+                        break
+                    started = time.perf_counter()
+                    func(item)
+                    timings.append(time.perf_counter() - started)
+        except Exception as exc:  # noqa: BLE001 – re-raised in the calling thread
+            errors.append(exc)
+        finally:
+            connection.close()
+            with lock:
+                latencies.extend(timings)
+                queries.append(counter.count)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        raise errors[0]
+    return elapsed, latencies, sum(queries)
+
+
+@contextmanager
+def _eager_celery():
+    # Tasks run inline in the calling thread; the in-memory broker is never actually used
+    # (the app reads CELERY_-namespaced settings, so overrides need the prefixed keys)
+    conf = send_notification_task.app.conf
+    saved = {
+        "CELERY_TASK_ALWAYS_EAGER": conf.task_always_eager,
+        "CELERY_TASK_EAGER_PROPAGATES": conf.task_eager_propagates,
+        "CELERY_BROKER_URL": conf.broker_url,
+    }
+    conf.update(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True, CELERY_BROKER_URL="memory://")
+    try:
+        yield
+    finally:
+        conf.update(saved)
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the send API and delivery tasks against local stub Telegram/SMTP servers with "
+        "eager Celery and a seeded test database; report throughput, latency percentiles and "
+        "queries per notification, and save the results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000, help="Users to seed")
+        parser.add_argument("--requests", type=int, default=2000, help="API requests / single-task deliveries")
+        parser.add_argument("--concurrency", type=int, default=8, help="Client threads for the API and task phases")
+        parser.add_argument("--channel", choices=list(USER_CHANNELS), default="mixed", help="Preferred channel of seeded users")
+        parser.add_argument("--latency", type=float, default=0.0, help="Stub provider latency per message, seconds")
+        parser.add_argument("--async-delivery", action="store_true", help="Use the async engine in the batch phase")
+        parser.add_argument(
+            "--fake-backends",
+            action="store_true",
+            help="Deliver through the in-memory FakeBackend instead of the stub servers, to measure the service alone",
+        )
+        parser.add_argument("--output", help="Results file, defaults to benchmarks/delivery-<timestamp>.json")
+        parser.add_argument("--compare", help="Previous results file to print the change against")
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1 or options["requests"] < 1 or options["users"] < 1:
+            raise CommandError("--users, --requests and --concurrency must be positive")
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as fh:
+                baseline = json.load(fh)
+
+        with benchmark_database(), \
+                serve_in_process(StubTelegramServer, latency=options["latency"]) as telegram_server, \
+                serve_in_process(StubSMTPServer, latency=options["latency"]) as smtp_server:
+            smtp = urlsplit(smtp_server.url)
+            with _eager_celery(), override_settings(
+                DEBUG=False,
+                TELEGRAM_API_URL=telegram_server.url,
+                TELEGRAM_BOT_TOKEN="benchmark",
+                TELEGRAM_POOL_SIZE=options["concurrency"],
+                EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+                EMAIL_HOST=smtp.hostname,
+                EMAIL_PORT=smtp.port,
+                EMAIL_HOST_USER="",
+                EMAIL_HOST_PASSWORD="",
+                EMAIL_USE_TLS=False,
+                EMAIL_USE_SSL=False,
+                NOTIFICATION_RATE_LIMITS={},
+                NOTIFICATION_RATE_LIMIT_REDIS_URL=None,
+                NOTIFICATION_CIRCUIT_BREAKER_REDIS_URL=None,
+                NOTIFICATION_CACHE_REDIS_URL=None,
+                NOTIFICATION_ASYNC_DELIVERY=options["async_delivery"],
+                NOTIFICATION_BULK_MAX_RECIPIENTS=max(options["users"], 1),
+                NOTIFICATION_CHANNEL_BACKENDS=self._backends(options),
+            ):
+                try:
+                    emails = self._seed(options["users"], options["channel"])
+                    phases = {
+                        "api": self._api_phase(emails, options["requests"], options["concurrency"]),
+                        "task": self._task_phase(options["concurrency"]),
+                        "batch": self._batch_phase(emails),
+                    }
+                finally:
+                    telegram.close_session()
+                    smtp_pool.close_all()
+
+        results = results_document(
+            "delivery",
+            {
+                key: options[key]
+                for key in ("users", "requests", "concurrency", "channel", "latency", "async_delivery", "fake_backends")
+            },
+            phases=phases,
+            providers={
+                "telegram_messages": telegram_server.count,
+                "telegram_connections": telegram_server.connections,
+                "smtp_messages": smtp_server.count,
+                "smtp_connections": smtp_server.connections,
+                "fake_messages": len(FakeBackend.outbox),
+            },
+        )
+        self._report(results, baseline)
+        output = save_results(results, options["output"])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+    @staticmethod
+    def _backends(options):
+        if not options["fake_backends"]:
+            return settings.NOTIFICATION_CHANNEL_BACKENDS
+        FakeBackend.outbox.clear()
+        fake = {"BACKEND": "send_notifications.backends.FakeBackend", "OPTIONS": {"latency": options["latency"]}}
+        return {channel: fake for channel in ChannelChoices.values}
+
+    def _seed(self, users, channel):
+        preferences = USER_CHANNELS[channel]
+        User.objects.bulk_create(
+            User(
+                email=f"user{i}@example.com",
+                phone_number=str(i),
+                telegram_id=str(i),
+                preferred_channels=preferences[i % len(preferences)],
+            )
+            for i in range(users)
+        )
+        return [f"user{i}@example.com" for i in range(users)]
+
+    def _api_phase(self, emails, requests, concurrency):
+        clients = threading.local()
+
+        def post(index):
+            if not hasattr(clients, "client"):
+                clients.client = Client()
+            response = clients.client.post(
+                "/api/send_notification/",
+                {"user_email": emails[index % len(emails)], "message": "benchmark"},
+                content_type="application/json",
+            )
+            if response.status_code != 202:
+                raise CommandError(f"API returned {response.status_code}: {response.content[:200]!r}")
+
+        elapsed, latencies, queries = _run_concurrently(post, range(requests), concurrency)
+        return summarize(requests, elapsed, latencies, queries)
+
+    def _task_phase(self, concurrency):
+        # Deliver what the API phase queued, one send_notification_task per notification
+        OutboxMessage.objects.all().delete()
+        ids = list(Notification.objects.values_list("id", flat=True))
+        elapsed, latencies, queries = _run_concurrently(
+            lambda pk: send_notification_task.apply((pk,)).get(), ids, concurrency
+        )
+        result = summarize(len(ids), elapsed, latencies, queries)
+        result["sent"] = Notification.objects.filter(status=NotificationStatus.SENT).count()
+        return result
+
+    def _batch_phase(self, emails):
+        # One bulk request, then the outbox relay publishing batch tasks that run inline:
+        # roughly one worker process draining the queue
+        Notification.objects.all().delete()
+        response = Client().post(
+            "/api/send_notification/bulk/",
+            {"user_emails": emails, "message": "benchmark $email"},
+            content_type="application/json",
+        )
+        if response.status_code != 202:
+            raise CommandError(f"Bulk API returned {response.status_code}: {response.content[:200]!r}")
+        counter = _QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            while relay_batch():
+                pass
+        elapsed = time.perf_counter() - started
+        result = summarize(len(emails), elapsed, queries=counter.count)
+        result["sent"] = Notification.objects.filter(status=NotificationStatus.SENT).count()
+        return result
+
+    def _report(self, results, baseline):
+        for phase, summary in results["phases"].items():
+            line = f"{phase:>6}: {summary['per_second']:10.1f}/s  {summary['queries_per_item']:6.2f} queries/item"
+            if "p50_ms" in summary:
+                line += f"  p50 {summary['p50_ms']:.2f}ms  p95 {summary['p95_ms']:.2f}ms  p99 {summary['p99_ms']:.2f}ms"
+            if "sent" in summary:
+                line += f"  ({summary['sent']}/{summary['count']} sent)"
+            self.stdout.write(line)
+            changes = compare(summary, (baseline or {}).get("phases", {}).get(phase))
+            if changes:
+                self.stdout.write(f"        vs baseline: {changes}")
+        self.stdout.write(f"providers: {results['providers']}")
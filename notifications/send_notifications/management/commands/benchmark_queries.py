@@ -0,0 +1,161 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from send_notifications.models import (
+    AttemptStatus,
+    ChannelChoices,
+    DeliveryAttempt,
+    Notification,
+    NotificationStatus,
+    User,
+)
+
+STATUS_WEIGHTS = {
+    NotificationStatus.SENT: 90,
+    NotificationStatus.FAILED: 5,
+    NotificationStatus.IN_PROGRESS: 3,
+    NotificationStatus.PENDING: 2,
+}
+
+
+@contextmanager
+def _explicit_timestamps(*models):
+    # bulk_create would otherwise stamp every seeded row with "now"
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with N notifications and report timings and "
+        "EXPLAIN output for the status, history and failure-rate queries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000, help="Number of notifications to seed")
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=20, help="Runs per query, the mean is reported")
+        parser.add_argument(
+            "--without-indexes",
+            action="store_true",
+            help="Drop the Notification/DeliveryAttempt Meta indexes first, for comparison",
+        )
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            if options["without_indexes"]:
+                self._drop_indexes()
+            self._seed(options["rows"], options["users"])
+            self._report(options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    @staticmethod
+    def _drop_indexes():
+        with connection.schema_editor() as editor:
+            for model in (Notification, DeliveryAttempt):
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+
+    def _seed(self, rows, users):
+        started = time.perf_counter()
+        rng = random.Random(42)
+        now = timezone.now()
+        User.objects.bulk_create(
+            User(email=f"user{i}@example.com", phone_number=str(i), telegram_id=str(i))
+            for i in range(users)
+        )
+        user_ids = list(User.objects.values_list("id", flat=True))
+        statuses = list(STATUS_WEIGHTS)
+        weights = list(STATUS_WEIGHTS.values())
+        channels = list(ChannelChoices.values)
+        batch = 5000
+
+        with _explicit_timestamps(Notification, DeliveryAttempt):
+            for offset in range(0, rows, batch):
+                notifications = []
+                for _ in range(min(batch, rows - offset)):
+                    created_at = now - timedelta(seconds=rng.randint(0, 30 * 24 * 3600))
+                    notifications.append(Notification(
+                        user_id=rng.choice(user_ids),
+                        message="benchmark",
+                        status=rng.choices(statuses, weights)[0],
+                        created_at=created_at,
+                        updated_at=created_at + timedelta(seconds=rng.randint(0, 600)),
+                    ))
+                Notification.objects.bulk_create(notifications)
+                attempts = []
+                for notification in notifications:
+                    for _ in range(rng.randint(1, 3)):
+                        attempts.append(DeliveryAttempt(
+                            notification_id=notification.pk,
+                            channel=rng.choice(channels),
+                            status=rng.choice([AttemptStatus.SUCCESS, AttemptStatus.FAILURE]),
+                            created_at=notification.created_at,
+                        ))
+                DeliveryAttempt.objects.bulk_create(attempts)
+
+        with connection.cursor() as cursor:
+            # Fresh planner statistics, otherwise the first plans reflect an empty table
+            cursor.execute("ANALYZE")
+        self.stdout.write(
+            f"Seeded {rows} notifications, {DeliveryAttempt.objects.count()} attempts "
+            f"in {time.perf_counter() - started:.1f}s ({connection.vendor})"
+        )
+
+    def _queries(self):
+        now = timezone.now()
+        user_id = User.objects.order_by("pk").values_list("pk", flat=True).first()
+        notification_id = Notification.objects.order_by("-pk").values_list("pk", flat=True).first()
+        return {
+            "stale pending sweep": Notification.objects.filter(
+                status__in=[NotificationStatus.PENDING, NotificationStatus.IN_PROGRESS],
+                updated_at__lt=now - timedelta(minutes=15),
+            ).order_by("updated_at")[:500],
+            "failed sweep": Notification.objects.filter(
+                status=NotificationStatus.FAILED,
+                updated_at__gte=now - timedelta(days=1),
+            ).order_by("updated_at")[:500],
+            "status count last day": Notification.objects.filter(
+                status=NotificationStatus.SENT,
+                created_at__gte=now - timedelta(days=1),
+            ).values("status").annotate(total=Count("id")),
+            "user history": Notification.objects.filter(user_id=user_id).order_by("-created_at", "-id")[:50],
+            "notification attempts": DeliveryAttempt.objects.filter(
+                notification_id=notification_id,
+            ).order_by("created_at"),
+            "channel failure rate": DeliveryAttempt.objects.filter(
+                channel=ChannelChoices.TELEGRAM,
+                status=AttemptStatus.FAILURE,
+                created_at__gte=now - timedelta(hours=1),
+            ).values("channel").annotate(total=Count("id")),
+        }
+
+    def _report(self, repeat):
+        for name, queryset in self._queries().items():
+            started = time.perf_counter()
+            for _ in range(repeat):
+                list(queryset.all())
+            elapsed_ms = (time.perf_counter() - started) * 1000 / repeat
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{name}: {elapsed_ms:.2f} ms"))
+            for line in queryset.explain().splitlines():
+                self.stdout.write(f"    {line}")
@@ -0,0 +1,117 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from send_notifications.benchmarking import compare, results_document, save_results
+
+# What each container does before it can take its first request or task
+PROFILES = {
+    "web": (
+        "notifications.settings",
+        "from django.core.wsgi import get_wsgi_application\n"
+        "get_wsgi_application()\n"
+        "from django.urls import get_resolver\n"
+        "get_resolver().url_patterns\n",
+    ),
+    "worker": (
+        "notifications.settings_worker",
+        "from notifications.celery import app\n"
+        "app.loader.import_default_modules()\n",
+    ),
+}
+
+
+def parse_importtime(stderr: str):
+    """Total import time in ms, and per module (self µs, cumulative µs, depth), from ``-X importtime`` output."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # the header line
+        # Nesting shows as two more spaces of indentation per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(own), int(cumulative), depth)
+    total_ms = sum(own for own, _, _ in modules.values()) / 1000
+    return total_ms, modules
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold start of the web and worker processes: wall time to a ready WSGI app or "
+        "Celery app with its tasks loaded, and import time from python -X importtime"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profile", choices=list(PROFILES), action="append", help="Defaults to all")
+        parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per profile, the median is reported")
+        parser.add_argument("--top", type=int, default=10, help="Slowest top-level imports to list")
+        parser.add_argument("--output", help="Results file, defaults to benchmarks/startup-<timestamp>.json")
+        parser.add_argument("--compare", help="Previous results file to print the change against")
+
+    def handle(self, *args, **options):
+        if options["runs"] < 1:
+            raise CommandError("--runs must be positive")
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as fh:
+                baseline = json.load(fh)
+
+        phases = {
+            profile: self._measure(profile, options["runs"], options["top"])
+            for profile in options["profile"] or PROFILES
+        }
+        results = results_document("startup", {"runs": options["runs"]}, phases=phases)
+        for profile, summary in phases.items():
+            self.stdout.write(
+                f"{profile:>6}: {summary['wall_ms']:8.1f}ms wall  {summary['import_ms']:8.1f}ms importing "
+                f"{summary['modules']} modules"
+            )
+            changes = compare(summary, (baseline or {}).get("phases", {}).get(profile))
+            if changes:
+                self.stdout.write(f"        vs baseline: {changes}")
+            for name, cumulative_ms in summary["top_imports"]:
+                self.stdout.write(f"        {cumulative_ms:8.1f}ms  {name}")
+        output = save_results(results, options["output"])
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+    def _measure(self, profile, runs, top):
+        settings_module, code = PROFILES[profile]
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings_module}
+        walls = []
+        imports = []
+        modules = {}
+        for _ in range(runs):
+            started = time.perf_counter()
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", code],
+                cwd=settings.BASE_DIR,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            walls.append(time.perf_counter() - started)
+            if proc.returncode:
+                raise CommandError(f"{profile} start failed:\n{proc.stderr[-2000:]}")
+            total_ms, modules = parse_importtime(proc.stderr)
+            imports.append(total_ms)
+        # Top-level entries only, so a package is not listed again under each of its importers
+        slowest = sorted(
+            ((name, cumulative) for name, (_, cumulative, depth) in modules.items() if depth == 0),
+            key=lambda item: item[1],
+            reverse=True,
+        )[:top]
+        return {
+            "count": runs,
+            "wall_ms": round(statistics.median(walls) * 1000, 1),
+            "import_ms": round(statistics.median(imports), 1),
+            "modules": len(modules),
+            "top_imports": [(name, round(cumulative / 1000, 1)) for name, cumulative in slowest],
+        }
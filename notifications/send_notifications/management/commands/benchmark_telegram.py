@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from send_notifications import telegram
+from send_notifications.models import ChannelChoices, Notification, User
+from send_notifications.stubs import StubTelegramServer, serve_in_process
+from send_notifications.tasks import _deliver_grouped
+
+
+def _send_oneshot(chat_id, text):
+    # Previous behaviour: bare requests.post, new connection per message
+    url = f"{settings.TELEGRAM_API_URL}/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
+    resp = requests.post(url, json={"chat_id": chat_id, "text": text}, timeout=10)
+    if not resp.json().get("ok"):
+        raise RuntimeError(resp.text)
+
+
+def _threaded(sender):
+    def run(messages, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(sender, str(i), "benchmark") for i in range(messages)]:
+                future.result()
+    return run
+
+
+def _notifications(messages):
+    # Unsaved rows are enough: delivery only reads the user's channel fields
+    return [
+        Notification(
+            pk=i,
+            user=User(pk=i, telegram_id=str(i), preferred_channels=[ChannelChoices.TELEGRAM]),
+            message="benchmark",
+        )
+        for i in range(1, messages + 1)
+    ]
+
+
+def _batch_sync(messages, concurrency):
+    # One prefork worker process running the batch task's sync path
+    _deliver_grouped(_notifications(messages))
+
+
+def _batch_async(messages, concurrency):
+    from send_notifications.async_delivery import deliver_concurrently
+    with override_settings(NOTIFICATION_ASYNC_CONCURRENCY={
+        **settings.NOTIFICATION_ASYNC_CONCURRENCY,
+        ChannelChoices.TELEGRAM: concurrency,
+    }):
+        deliver_concurrently(_notifications(messages))
+
+
+MODES = {
+    "oneshot": _threaded(_send_oneshot),
+    "session": _threaded(telegram.send_message),
+    "batch-sync": _batch_sync,
+    "batch-async": _batch_async,
+}
+
+
+class Command(BaseCommand):
+    help = "Measure Telegram channel throughput against a local stub Bot API server"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--latency", type=float, default=0.0, help="Stub server latency per request, seconds")
+        parser.add_argument("--mode", choices=list(MODES), action="append", help="Defaults to all modes")
+
+    def handle(self, *args, **options):
+        for mode in options["mode"] or list(MODES):
+            with serve_in_process(StubTelegramServer, latency=options["latency"]) as server:
+                with override_settings(
+                    TELEGRAM_API_URL=server.url,
+                    TELEGRAM_BOT_TOKEN="benchmark",
+                    TELEGRAM_POOL_SIZE=options["concurrency"],
+                    NOTIFICATION_RATE_LIMITS={},
+                ):
+                    telegram.close_session()
+                    started = time.perf_counter()
+                    MODES[mode](options["messages"], options["concurrency"])
+                    elapsed = time.perf_counter() - started
+                    telegram.close_session()
+            self.stdout.write(
+                f"{mode:>11}: {options['messages'] / elapsed:10.1f} msg/s "
+                f"({elapsed:.2f}s, {server.connections} connections)"
+            )
@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from send_notifications import importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update users by email from a CSV or NDJSON export "
+        "(email, phone_number, telegram_id, preferred_channels), streamed in batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, - for stdin")
+        parser.add_argument(
+            "--format",
+            choices=importer.FORMATS,
+            default=None,
+            help="Defaults to ndjson for .ndjson/.jsonl files, csv otherwise",
+        )
+        parser.add_argument("--batch-size", type=int, default=None, help="Rows per upsert statement")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or importer.format_for(path)
+        stream = sys.stdin if path == "-" else open(path, encoding="utf-8-sig", newline="")
+        try:
+            result = importer.import_users(stream, fmt, options["batch_size"], progress=self._progress)
+        except importer.ImportFileError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for line, error in result.errors:
+            self.stderr.write(f"line {line}: {error}")
+        if result.invalid > len(result.errors):
+            self.stderr.write(f"... and {result.invalid - len(result.errors)} more invalid rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.imported} users from {result.rows} rows, {result.invalid} invalid, "
+            f"in {result.seconds:.1f}s ({result.rows_per_second:.0f} rows/s)"
+        ))
+
+    def _progress(self, result):
+        self.stdout.write(f"{result.rows} rows, {result.imported} imported ({result.rows_per_second:.0f} rows/s)")
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from send_notifications import partitioning
+
+
+class Command(BaseCommand):
+    help = (
+        "PostgreSQL only: create upcoming monthly partitions of the delivery attempt table, "
+        "or convert it to a partitioned table once with --convert"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert",
+            action="store_true",
+            help="Rebuild the table as a partitioned table; locks it for the duration of the copy",
+        )
+        parser.add_argument(
+            "--experimental",
+            action="store_true",
+            help="Confirm running --convert, which has not been proven on production data yet",
+        )
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=None,
+            help="Future months to create partitions for, defaults to NOTIFICATION_ATTEMPT_PARTITION_MONTHS_AHEAD",
+        )
+
+    def handle(self, *args, **options):
+        months_ahead = options["months_ahead"]
+        if months_ahead is None:
+            months_ahead = settings.NOTIFICATION_ATTEMPT_PARTITION_MONTHS_AHEAD
+        if options["convert"] and not options["experimental"]:
+            raise CommandError(
+                "--convert is experimental: back up the database, then pass --experimental to run it"
+            )
+        try:
+            if options["convert"]:
+                copied = partitioning.convert(months_ahead)
+                self.stdout.write(f"Converted {partitioning.TABLE}, copied {copied} rows")
+            created = partitioning.ensure_partitions(months_ahead)
+        except partitioning.PartitioningError as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"Partitions up to {created[-1]} are in place"))
@@ -0,0 +1,52 @@
+import logging
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from send_notifications.sweeper import sweep_stale
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Requeue pending or in-progress notifications that no worker has touched for a while"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Notifications claimed per transaction")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=None,
+            help="Seconds to sleep when nothing is stale",
+        )
+        parser.add_argument("--once", action="store_true", help="Sweep until nothing is stale and exit")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"] or settings.NOTIFICATION_SWEEP_BATCH_SIZE
+        interval = options["interval"] if options["interval"] is not None else settings.NOTIFICATION_SWEEP_INTERVAL
+        self._running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        requeued = abandoned = 0
+        while self._running:
+            try:
+                swept = sweep_stale(batch_size)
+            except Exception:  # noqa: BLE001 – DB outage, stale rows stay where they are
+                logger.exception("Sweep failed, retrying in %ss", interval)
+                if options["once"]:
+                    raise
+                time.sleep(interval)
+                continue
+            requeued += swept[0]
+            abandoned += swept[1]
+            if sum(swept) < batch_size:
+                if options["once"]:
+                    break
+                time.sleep(interval)
+        self.stdout.write(f"Requeued {requeued} notifications, abandoned {abandoned}")
+
+    def _stop(self, signum, frame):
+        self._running = False
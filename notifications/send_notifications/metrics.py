@@ -0,0 +1,142 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown, worker_ready
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, multiprocess, start_http_server
+
+from .ratelimit import RateLimited
+
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+SEND_SECONDS = Histogram(
+    "notification_send_seconds",
+    "Time spent in a channel sender per message",
+    ["channel", "result"],
+)
+DELIVERY_ATTEMPTS = Counter(
+    "notification_delivery_attempts",
+    "Delivery attempts by channel and outcome",
+    ["channel", "status"],
+)
+QUEUE_LAG_SECONDS = Histogram(
+    "notification_queue_lag_seconds",
+    "Time from notification creation, or its scheduled time, to its first delivery attempt",
+    buckets=LAG_BUCKETS,
+)
+TASK_SECONDS = Histogram(
+    "notification_task_seconds",
+    "Celery task run time, end to end",
+    ["task", "state"],
+    buckets=LAG_BUCKETS,
+)
+TASK_DB_SECONDS = Histogram(
+    "notification_task_db_seconds",
+    "Time a Celery task spent executing SQL",
+    ["task"],
+)
+TASKS = Counter(
+    "notification_tasks",
+    "Celery task runs by final state (SUCCESS, RETRY, FAILURE)",
+    ["task", "state"],
+)
+SWEPT = Counter(
+    "notification_swept",
+    "Stale notifications found by the sweeper, requeued or abandoned",
+    ["result"],
+)
+
+
+def registry() -> CollectorRegistry:
+    # With several processes (prefork workers, gunicorn) each writes its samples to
+    # PROMETHEUS_MULTIPROC_DIR and the exporter aggregates them at scrape time
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
+
+
+@contextmanager
+def time_send(channel: str):
+    started = time.perf_counter()
+    result = "success"
+    try:
+        yield
+    except RateLimited:
+        result = "rate_limited"
+        raise
+    except Exception:
+        result = "failure"
+        raise
+    finally:
+        SEND_SECONDS.labels(channel, result).observe(time.perf_counter() - started)
+
+
+def observe_batch_send(channel: str, elapsed: float, errors) -> None:
+    # Batch senders report one error slot per message; spread the call time over them
+    per_message = elapsed / max(len(errors), 1)
+    for error in errors:
+        SEND_SECONDS.labels(channel, "success" if error is None else "failure").observe(per_message)
+
+
+def observe_queue_lag(notification) -> None:
+    # From when the notification became due, so a scheduled_at or quiet-hours delay is not lag
+    due = notification.scheduled_at or notification.created_at
+    if due is not None and not notification.attempts:
+        QUEUE_LAG_SECONDS.observe(max((timezone.now() - due).total_seconds(), 0))
+
+
+_task_state = threading.local()
+
+
+def _time_queries(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        _task_state.db_seconds += time.perf_counter() - started
+
+
+@task_prerun.connect
+def _task_started(task_id=None, task=None, **kwargs):
+    _task_state.started = time.perf_counter()
+    _task_state.db_seconds = 0.0
+    connection.execute_wrappers.append(_time_queries)
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    started = getattr(_task_state, "started", None)
+    if started is None:
+        return
+    _task_state.started = None
+    if _time_queries in connection.execute_wrappers:
+        connection.execute_wrappers.remove(_time_queries)
+    name = task.name if task is not None else "unknown"
+    state = state or "UNKNOWN"
+    TASK_SECONDS.labels(name, state).observe(time.perf_counter() - started)
+    TASK_DB_SECONDS.labels(name).observe(_task_state.db_seconds)
+    TASKS.labels(name, state).inc()
+
+
+@worker_ready.connect
+def _start_worker_exporter(**kwargs):
+    port = settings.NOTIFICATION_METRICS_WORKER_PORT
+    if not port:
+        return
+    start_http_server(port, registry=registry())
+    logger.info("Serving worker metrics on :%s/metrics", port)
+
+
+@worker_process_shutdown.connect
+def _mark_process_dead(**kwargs):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
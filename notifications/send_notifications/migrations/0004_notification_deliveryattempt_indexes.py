@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('send_notifications', '0003_alter_user_preferred_channels'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='deliveryattempt',
+            index=models.Index(fields=['notification', 'created_at'], name='attempt_notification_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryattempt',
+            index=models.Index(fields=['channel', 'status', 'created_at'], name='attempt_channel_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['created_at'], name='notification_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['status', 'created_at'], name='notification_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='notification_user_hist_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'in_progress'])), fields=['updated_at'], name='notification_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('status', 'failed')), fields=['updated_at'], name='notification_failed_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('send_notifications', '0006_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.SlugField(max_length=100, unique=True)),
+                ('subject', models.CharField(default='Notification', help_text='Email subject', max_length=255)),
+                ('body', models.TextField()),
+                ('telegram_body', models.TextField(blank=True, default='', help_text='Telegram MarkdownV2, defaults to body')),
+                ('sms_body', models.TextField(blank=True, default='', help_text='Defaults to body, truncated to the SMS limit')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='context',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='template',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='notifications', to='send_notifications.notificationtemplate'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('send_notifications', '0007_notificationtemplate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='priority',
+            field=models.CharField(choices=[('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], default='normal', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='priority',
+            field=models.CharField(choices=[('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], default='normal', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['priority', 'id'], name='outbox_priority_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('send_notifications', '0009_notification_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='digest',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='merged', to='send_notifications.notification'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='is_digest',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='DigestBuffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(choices=[('email', 'Email'), ('sms', 'SMS'), ('telegram', 'Telegram')], max_length=20)),
+                ('release_at', models.DateTimeField()),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='digest_buffer', to='send_notifications.notification')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='send_notifications.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['release_at'], name='digest_release_idx'), models.Index(fields=['user', 'channel'], name='digest_user_channel_idx')],
+            },
+        ),
+    ]
@@ -9,11 +9,18 @@ class ChannelChoices(models.TextChoices):
 
 class NotificationStatus(models.TextChoices):
     PENDING = 'pending', 'Pending'
+    SCHEDULED = 'scheduled', 'Scheduled'
     IN_PROGRESS = 'in_progress', 'In progress'
     SENT = 'sent', 'Sent'
     FAILED = 'failed', 'Failed'
 
 
+class NotificationPriority(models.TextChoices):
+    HIGH = 'high', 'High'
+    NORMAL = 'normal', 'Normal'
+    LOW = 'low', 'Low'
+
+
 class AttemptStatus(models.TextChoices):
     SUCCESS = 'success', 'Success'
     FAILURE = 'failure', 'Failure'
@@ -29,14 +36,47 @@ class User(models.Model):
         null=True,
         help_text='List of preferred channels in priority order'
     )
+    # Non-urgent notifications falling between start and end (local time) wait until end
+    timezone = models.CharField(max_length=64, blank=True, default='', help_text='IANA name, e.g. Europe/Berlin')
+    quiet_hours_start = models.TimeField(null=True, blank=True)
+    quiet_hours_end = models.TimeField(null=True, blank=True)
 
     def __str__(self):
         return self.email
 
 
+class NotificationTemplate(models.Model):
+    """Message shared by many notifications, rendered per recipient and channel at send time.
+
+    Placeholders use ``$name`` / ``${name}``: ``email``, ``phone_number`` and
+    ``telegram_id`` come from the recipient, anything else from the notification's
+    ``context``. Channel-specific bodies fall back to ``body``; ``telegram_body``
+    is sent as Telegram MarkdownV2.
+    """
+    name = models.SlugField(max_length=100, unique=True)
+    subject = models.CharField(max_length=255, default='Notification', help_text='Email subject')
+    body = models.TextField()
+    telegram_body = models.TextField(blank=True, default='', help_text='Telegram MarkdownV2, defaults to body')
+    sms_body = models.TextField(blank=True, default='', help_text='Defaults to body, truncated to the SMS limit')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    # Empty for templated notifications, which store only their own variables in context
     message = models.TextField()
+    template = models.ForeignKey(
+        NotificationTemplate,
+        on_delete=models.PROTECT,
+        related_name='notifications',
+        null=True,
+        blank=True,
+    )
+    context = models.JSONField(null=True, blank=True)
     status = models.CharField(
         max_length=20,
         choices=NotificationStatus.choices,
@@ -48,11 +88,60 @@ class Notification(models.Model):
         null=True,
         blank=True,
     )
+    priority = models.CharField(
+        max_length=10,
+        choices=NotificationPriority.choices,
+        default=NotificationPriority.NORMAL,
+    )
     attempts = models.PositiveIntegerField(default=0)
     error = models.TextField(blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
     sent_at = models.DateTimeField(null=True, blank=True)
+    # Queued by the dispatcher at this time; status is SCHEDULED until then
+    scheduled_at = models.DateTimeField(null=True, blank=True)
+    # Digests merge several notifications to one user; the merged ones point at their digest
+    is_digest = models.BooleanField(default=False, editable=False)
+    digest = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        related_name='merged',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+    # Client-supplied Idempotency-Key header and a hash of recipient, channel and content
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    # Set by the worker currently delivering this notification; expired claims may be taken over
+    claim_token = models.UUIDField(null=True, blank=True, editable=False)
+    claimed_until = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='notification_created_idx'),
+            models.Index(fields=['status', 'created_at'], name='notification_status_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='notification_user_hist_idx'),
+            # Newest change per user, for history ETags
+            models.Index(fields=['user', 'updated_at'], name='notification_user_upd_idx'),
+            # Sweepers only ever look at the small set of unfinished or failed rows
+            models.Index(
+                fields=['updated_at'],
+                name='notification_active_idx',
+                condition=models.Q(status__in=[NotificationStatus.PENDING, NotificationStatus.IN_PROGRESS]),
+            ),
+            models.Index(
+                fields=['updated_at'],
+                name='notification_failed_idx',
+                condition=models.Q(status=NotificationStatus.FAILED),
+            ),
+            # Time-ordered queue of scheduled notifications for the dispatcher
+            models.Index(
+                fields=['scheduled_at'],
+                name='notification_scheduled_idx',
+                condition=models.Q(status=NotificationStatus.SCHEDULED),
+            ),
+        ]
 
     def __str__(self):
         return f"Notification #{self.pk} to {self.user.email} ({self.status})"
@@ -65,5 +154,56 @@ class DeliveryAttempt(models.Model):
     error = models.TextField(blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['notification', 'created_at'], name='attempt_notification_idx'),
+            models.Index(fields=['channel', 'status', 'created_at'], name='attempt_channel_status_idx'),
+        ]
+
     def __str__(self):
         return f"Attempt {self.channel} for Notification #{self.notification_id}: {self.status}"
+
+
+class OutboxMessage(models.Model):
+    """Notification waiting to be published to the broker.
+
+    Written in the same transaction as the notification; the ``relay_outbox``
+    command publishes pending rows in batches and deletes them.
+    """
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='outbox')
+    # Copied from the notification so the relay can publish urgent rows first
+    priority = models.CharField(
+        max_length=10,
+        choices=NotificationPriority.choices,
+        default=NotificationPriority.NORMAL,
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['priority', 'id'], name='outbox_priority_idx'),
+        ]
+
+    def __str__(self):
+        return f"Outbox entry for Notification #{self.notification_id}"
+
+
+class DigestBuffer(models.Model):
+    """Notification held back so it can be merged with others to the same user and channel.
+
+    ``digest.flush_due`` (run by ``relay_outbox``) moves rows past ``release_at``
+    into the outbox, merged into digest notifications where there are several.
+    """
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='digest_buffer')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', db_index=False)
+    channel = models.CharField(max_length=20, choices=ChannelChoices.choices)
+    release_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['release_at'], name='digest_release_idx'),
+            models.Index(fields=['user', 'channel'], name='digest_user_channel_idx'),
+        ]
+
+    def __str__(self):
+        return f"Digest buffer entry for Notification #{self.notification_id}"
@@ -0,0 +1,66 @@
+import logging
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from . import digest
+from .models import Notification, NotificationPriority, NotificationStatus, OutboxMessage
+from .routing import queue_for
+from .tasks import dispatch_notification_batches
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(notifications: Iterable[Notification]) -> None:
+    """Record notifications for publishing; call inside the transaction that created them.
+
+    Notifications eligible for a digest wait in the digest buffer instead, and
+    scheduled ones are left to ``scheduling.dispatch_due``.
+    """
+    queued = []
+    buffered = []
+    for notification in notifications:
+        if notification.status == NotificationStatus.SCHEDULED:
+            continue
+        (buffered if digest.eligible(notification) else queued).append(notification)
+    if buffered:
+        digest.buffer(buffered)
+    OutboxMessage.objects.bulk_create(
+        OutboxMessage(notification=notification, priority=notification.priority) for notification in queued
+    )
+
+
+def relay_batch(limit: Optional[int] = None) -> int:
+    """Publish up to ``limit`` pending outbox rows and delete them, returning how many were sent.
+
+    Higher priorities go first, so a bulk backlog does not hold up urgent rows.
+    Each notification is published to the queue of its priority and first channel.
+    Rows stay locked (SKIP LOCKED, so several relays can run side by side) until
+    the publish has gone through; a broker error rolls back and leaves them for the
+    next pass. A crash between publish and commit re-publishes the batch, which the
+    delivery claim turns into a no-op for rows already sent.
+    """
+    limit = limit or settings.NOTIFICATION_OUTBOX_BATCH_SIZE
+    with transaction.atomic():
+        rows = []
+        for priority in NotificationPriority.values:
+            pending = (
+                OutboxMessage.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(priority=priority)
+                .order_by("id")
+                .values_list("id", "notification_id", "priority", "notification__user__preferred_channels")
+            )
+            rows += pending[:limit - len(rows)]
+            if len(rows) >= limit:
+                break
+        if not rows:
+            return 0
+        queues = defaultdict(list)
+        for _, notification_id, priority, preferred_channels in rows:
+            queues[queue_for(priority, preferred_channels)].append(notification_id)
+        batches = sum(dispatch_notification_batches(ids, queue=queue) for queue, ids in queues.items())
+        OutboxMessage.objects.filter(id__in=[row[0] for row in rows]).delete()
+    logger.debug("Relayed %s notifications in %s batches", len(rows), batches)
+    return len(rows)
@@ -0,0 +1,176 @@
+"""Monthly range partitioning of the DeliveryAttempt table on PostgreSQL.
+
+The table is converted once (``manage.py partition_attempts --convert --experimental``,
+only covered by the PostgreSQL-only tests so far); after that
+partitions are named ``<table>_pYYYYMM`` and cover one calendar month of
+``created_at`` in UTC. Expired months are archived and dropped whole by the
+retention command instead of being deleted row by row.
+"""
+import logging
+import re
+from datetime import date, datetime, timezone
+from typing import Iterator, List, Tuple
+
+from django.db import connection, transaction
+
+from .models import DeliveryAttempt, Notification
+
+logger = logging.getLogger(__name__)
+
+TABLE = DeliveryAttempt._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+_PARTITION_NAME = re.compile(rf"^{re.escape(TABLE)}_p(\d{{4}})(\d{{2}})$")
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def _next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _months(first: date, last: date) -> Iterator[date]:
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = _next_month(month)
+
+
+def _horizon(months_ahead: int) -> Tuple[date, date]:
+    today = datetime.now(timezone.utc).date()
+    last = today
+    for _ in range(months_ahead):
+        last = _next_month(last.replace(day=1))
+    return today, last
+
+
+def _bound(month: date) -> str:
+    return f"'{month.isoformat()} 00:00:00+00'"
+
+
+def _check_vendor() -> None:
+    if connection.vendor != "postgresql":
+        raise PartitioningError(f"Partitioning needs PostgreSQL, not {connection.vendor}")
+
+
+def is_partitioned() -> bool:
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def partitions() -> List[Tuple[str, date, date]]:
+    """Monthly partitions as (name, first day, first day of the next month), oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [TABLE],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    result = []
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            result.append((name, month, _next_month(month)))
+    return sorted(result, key=lambda item: item[1])
+
+
+def _create_partition(cursor, month: date) -> str:
+    quote = connection.ops.quote_name
+    name = f"{TABLE}_p{month:%Y%m}"
+    bounds = f"FOR VALUES FROM ({_bound(month)}) TO ({_bound(_next_month(month))})"
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+    if cursor.fetchone()[0]:
+        return name
+    in_month = f"created_at >= {_bound(month)} AND created_at < {_bound(_next_month(month))}"
+    # Blocks inserts routed to the default partition until the new partition is attached
+    cursor.execute(f"LOCK TABLE {quote(DEFAULT_PARTITION)} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {quote(DEFAULT_PARTITION)} WHERE {in_month})")
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"CREATE TABLE {quote(name)} PARTITION OF {quote(TABLE)} {bounds}")
+        return name
+    # PostgreSQL refuses to add a partition while the default one holds rows for its
+    # range, so those rows are moved into the new table before it is attached
+    cursor.execute(f"CREATE TABLE {quote(name)} (LIKE {quote(TABLE)} INCLUDING DEFAULTS)")
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} WHERE {in_month} RETURNING *) "
+        f"INSERT INTO {quote(name)} SELECT * FROM moved"
+    )
+    logger.info("Moved %s rows from %s to %s", cursor.rowcount, DEFAULT_PARTITION, name)
+    cursor.execute(f"ALTER TABLE {quote(TABLE)} ATTACH PARTITION {quote(name)} {bounds}")
+    return name
+
+
+def ensure_partitions(months_ahead: int) -> List[str]:
+    """Create the partitions for this month and the next ``months_ahead``; returns their names.
+
+    Rows for months without a partition land in the default partition. They are
+    moved into the month's partition when it is created, which locks the default
+    partition while it copies, so run this ahead of time (e.g. monthly) to keep
+    that partition empty.
+    """
+    _check_vendor()
+    if not is_partitioned():
+        raise PartitioningError(f"{TABLE} is not partitioned yet, run partition_attempts --convert")
+    today, last = _horizon(months_ahead)
+    with transaction.atomic(), connection.cursor() as cursor:
+        return [_create_partition(cursor, month) for month in _months(today, last)]
+
+
+def convert(months_ahead: int) -> int:
+    """Rebuild the DeliveryAttempt table as a partitioned table and copy its rows over.
+
+    Runs in one transaction holding an exclusive lock on the table for the whole
+    copy, so schedule it in a maintenance window. The primary key becomes
+    (id, created_at), as PostgreSQL requires the partition key in it; ids keep
+    coming from a sequence. Returns the number of rows copied.
+    """
+    _check_vendor()
+    if is_partitioned():
+        raise PartitioningError(f"{TABLE} is already partitioned")
+    quote = connection.ops.quote_name
+    table = quote(TABLE)
+    legacy = quote(f"{TABLE}_legacy")
+    sequence = f"{TABLE}_pid_seq"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(f"SELECT MIN(created_at) FROM {table}")
+        oldest = cursor.fetchone()[0]
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        cursor.execute(f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)")
+        cursor.execute(f"CREATE SEQUENCE {quote(sequence)} OWNED BY {table}.id")
+        cursor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        cursor.execute(f"CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {table} DEFAULT")
+        today, last = _horizon(months_ahead)
+        first = oldest.astimezone(timezone.utc).date() if oldest else today
+        for month in _months(first, last):
+            _create_partition(cursor, month)
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+        copied = cursor.rowcount
+        cursor.execute(f"SELECT setval('{sequence}', COALESCE((SELECT MAX(id) FROM {legacy}), 0) + 1, false)")
+        # Constraint and index names are schema-wide, so they can only be reused once the old table is gone
+        cursor.execute(f"DROP TABLE {legacy}")
+        cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+        cursor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {quote(TABLE + '_notification_fk')} "
+            f"FOREIGN KEY (notification_id) REFERENCES {quote(Notification._meta.db_table)} (id) "
+            "DEFERRABLE INITIALLY DEFERRED"
+        )
+        for index in DeliveryAttempt._meta.indexes:
+            columns = ", ".join(DeliveryAttempt._meta.get_field(field).column for field in index.fields)
+            cursor.execute(f"CREATE INDEX {quote(index.name)} ON {table} ({columns})")
+    logger.info("Partitioned %s, copied %s rows", TABLE, copied)
+    return copied
+
+
+def drop_partition(name: str) -> None:
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"ALTER TABLE {connection.ops.quote_name(TABLE)} DETACH PARTITION {connection.ops.quote_name(name)}"
+        )
+        cursor.execute(f"DROP TABLE {connection.ops.quote_name(name)}")
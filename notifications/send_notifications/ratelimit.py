@@ -0,0 +1,188 @@
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Checks every bucket and only takes a token from all of them when each has one,
+# so a denied recipient never burns channel capacity. Returns the wait in seconds.
+_TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wait = 0
+local states = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts', 'blocked')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    local blocked = tonumber(state[3]) or 0
+    tokens = math.min(burst, tokens + (now - ts) * rate)
+    states[i] = tokens
+    if blocked > now then
+        wait = math.max(wait, blocked - now)
+    elseif tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+end
+if wait == 0 then
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[i * 2 - 1])
+        local burst = tonumber(ARGV[i * 2])
+        redis.call('HSET', key, 'tokens', states[i] - 1, 'ts', now)
+        redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+    end
+end
+return tostring(wait)
+"""
+
+_BLOCK_SCRIPT = """
+local t = redis.call('TIME')
+local until_ts = tonumber(t[1]) + tonumber(t[2]) / 1000000 + tonumber(ARGV[1])
+local blocked = tonumber(redis.call('HGET', KEYS[1], 'blocked')) or 0
+if until_ts > blocked then
+    redis.call('HSET', KEYS[1], 'blocked', until_ts)
+    redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[1])) + 1)
+end
+return 1
+"""
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"Rate limited, retry after {retry_after:.2f}s")
+
+
+class _LocalBuckets:
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._blocked = {}
+
+    def reserve(self, buckets: List[Tuple[str, float, float]]) -> float:
+        now = time.monotonic()
+        with self._lock:
+            wait = 0.0
+            levels = []
+            for key, rate, burst in buckets:
+                tokens, ts = self._tokens.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - ts) * rate)
+                levels.append(tokens)
+                blocked = self._blocked.get(key, 0.0)
+                if blocked > now:
+                    wait = max(wait, blocked - now)
+                elif tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+            if wait == 0:
+                for (key, rate, burst), tokens in zip(buckets, levels):
+                    self._tokens[key] = (tokens - 1, now)
+                if len(self._tokens) > self.MAX_KEYS:
+                    self._prune(now)
+            return wait
+
+    def _prune(self, now: float) -> None:
+        # Per-recipient buckets untouched for a minute have long refilled
+        self._tokens = {key: state for key, state in self._tokens.items() if now - state[1] < 60}
+        self._blocked = {key: until for key, until in self._blocked.items() if until > now}
+
+    def block(self, key: str, seconds: float) -> None:
+        with self._lock:
+            self._blocked[key] = max(self._blocked.get(key, 0.0), time.monotonic() + seconds)
+
+
+REDIS_RETRY_INTERVAL = 30
+
+
+class RateLimiter:
+    """Token buckets per channel and per (channel, recipient).
+
+    Limits come from ``NOTIFICATION_RATE_LIMITS``. Buckets live in Redis when
+    ``NOTIFICATION_RATE_LIMIT_REDIS_URL`` is set, so all workers share them, and
+    fall back to process-local buckets when Redis is not configured or unreachable.
+    """
+
+    def __init__(self):
+        self._local = _LocalBuckets()
+        self._scripts = None
+        self._redis_down_until = 0.0
+
+    def _redis_scripts(self):
+        if time.monotonic() < self._redis_down_until:
+            return None
+        if self._scripts is None and settings.NOTIFICATION_RATE_LIMIT_REDIS_URL:
+            import redis
+            client = redis.Redis.from_url(
+                settings.NOTIFICATION_RATE_LIMIT_REDIS_URL,
+                socket_timeout=0.5,
+                socket_connect_timeout=0.5,
+            )
+            self._scripts = (
+                client.register_script(_TOKEN_BUCKET_SCRIPT),
+                client.register_script(_BLOCK_SCRIPT),
+            )
+        return self._scripts
+
+    def _redis_failed(self) -> None:
+        logger.warning(
+            "Rate limiter Redis unavailable, using local buckets for %ss", REDIS_RETRY_INTERVAL, exc_info=True
+        )
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_INTERVAL
+
+    @staticmethod
+    def _buckets(channel: str, recipient: Optional[str]) -> List[Tuple[str, float, float]]:
+        limits = settings.NOTIFICATION_RATE_LIMITS.get(channel)
+        if not limits:
+            return []
+        buckets = []
+        if limits.get("rate"):
+            buckets.append((f"ratelimit:{channel}", limits["rate"], limits.get("burst") or limits["rate"]))
+        if recipient and limits.get("per_recipient_rate"):
+            buckets.append((
+                f"ratelimit:{channel}:{recipient}",
+                limits["per_recipient_rate"],
+                limits.get("per_recipient_burst") or 1,
+            ))
+        return buckets
+
+    def reserve(self, channel: str, recipient: Optional[str] = None) -> float:
+        """Take a token and return 0, or return how long to wait without taking one."""
+        buckets = self._buckets(channel, recipient)
+        if not buckets:
+            return 0.0
+        scripts = self._redis_scripts()
+        if scripts is not None:
+            try:
+                args = [value for _, rate, burst in buckets for value in (rate, burst)]
+                return float(scripts[0](keys=[key for key, _, _ in buckets], args=args))
+            except Exception:  # noqa: BLE001 – Redis outage must not stop delivery
+                self._redis_failed()
+        return self._local.reserve(buckets)
+
+    def wait(self, channel: str, recipient: Optional[str] = None) -> None:
+        """Block until a token is available, or raise RateLimited if that takes too long."""
+        while (delay := self.reserve(channel, recipient)) > 0:
+            if delay > settings.NOTIFICATION_RATE_LIMIT_MAX_WAIT:
+                raise RateLimited(delay)
+            time.sleep(delay)
+
+    def block(self, channel: str, seconds: float, recipient: Optional[str] = None) -> None:
+        """Stop handing out tokens for a while, e.g. after a provider returned retry_after."""
+        key = f"ratelimit:{channel}:{recipient}" if recipient else f"ratelimit:{channel}"
+        scripts = self._redis_scripts()
+        if scripts is not None:
+            try:
+                scripts[1](keys=[key], args=[seconds])
+                return
+            except Exception:  # noqa: BLE001 – Redis outage must not stop delivery
+                self._redis_failed()
+        self._local.block(key, seconds)
+
+
+rate_limiter = RateLimiter()
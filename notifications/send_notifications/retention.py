@@ -0,0 +1,231 @@
+"""Archive expired notifications and delivery attempts to files and delete them in bounded batches.
+
+Every batch is written to the archive before its delete commits, so a crash can
+archive a few rows twice but never drops rows without archiving them.
+"""
+import gzip
+import importlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from itertools import takewhile
+from typing import Dict, List, Optional
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from . import partitioning
+from .models import DeliveryAttempt, Notification
+
+logger = logging.getLogger(__name__)
+
+
+def _columns(model) -> List[str]:
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+class _JSONLWriter:
+    suffix = ".jsonl.gz"
+
+    def __init__(self, path: str, model):
+        self._fh = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, rows: List[dict]) -> None:
+        for row in rows:
+            self._fh.write(json.dumps(row, cls=DjangoJSONEncoder))
+            self._fh.write("\n")
+        # Sync flush: everything written so far can be read back even if the run dies later
+        self._fh.flush()
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class _ParquetWriter:
+    # A directory of part files, one per batch. Parquet metadata sits in a footer written
+    # when a file is closed, so each batch's file is complete before its rows are deleted.
+    # pyarrow reads the directory back as one dataset.
+    suffix = ".parquet"
+    INTEGER_FIELDS = {"AutoField", "BigAutoField", "ForeignKey", "IntegerField", "PositiveIntegerField"}
+
+    def __init__(self, path: str, model):
+        try:
+            self._pa = importlib.import_module("pyarrow")
+            parquet = importlib.import_module("pyarrow.parquet")
+        except ImportError as exc:
+            raise ImproperlyConfigured("Parquet archives require the 'pyarrow' package") from exc
+        fields = model._meta.concrete_fields
+        self._timestamps = {field.attname for field in fields if field.get_internal_type() == "DateTimeField"}
+        self._integers = {field.attname for field in fields if field.get_internal_type() in self.INTEGER_FIELDS}
+        self._schema = self._pa.schema([(field.attname, self._type(field.attname)) for field in fields])
+        self._parquet = parquet
+        self._path = path
+        self._parts = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _type(self, column: str):
+        if column in self._timestamps:
+            return self._pa.timestamp("us", tz="UTC")
+        return self._pa.int64() if column in self._integers else self._pa.string()
+
+    def write(self, rows: List[dict]) -> None:
+        # UUIDs and other values without an Arrow type are stored as text
+        converted = [
+            {
+                column: value if value is None or column in self._timestamps or column in self._integers else str(value)
+                for column, value in row.items()
+            }
+            for row in rows
+        ]
+        part = os.path.join(self._path, f"part-{self._parts:05d}.parquet")
+        self._parquet.write_table(self._pa.Table.from_pylist(converted, schema=self._schema), part, compression="zstd")
+        self._parts += 1
+
+    def close(self) -> None:
+        pass
+
+
+WRITERS = {"jsonl": _JSONLWriter, "parquet": _ParquetWriter}
+
+
+class Archive:
+    """One file per table and run, ``<directory>/<table>-<timestamp><suffix>``, opened on first write.
+
+    For Parquet that path is a directory holding one file per batch.
+    """
+
+    def __init__(self, directory: str, fmt: str = "jsonl"):
+        if fmt not in WRITERS:
+            raise ImproperlyConfigured(f"Unknown archive format {fmt!r}, expected one of {sorted(WRITERS)}")
+        self.directory = directory
+        self.writer_class = WRITERS[fmt]
+        self.stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self.paths: Dict[str, str] = {}
+        self.rows: Dict[str, int] = {}
+        self._writers = {}
+
+    def write(self, model, rows: List[dict]) -> None:
+        if not rows:
+            return
+        table = model._meta.db_table
+        writer = self._writers.get(table)
+        if writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{table}-{self.stamp}{self.writer_class.suffix}")
+            writer = self._writers[table] = self.writer_class(path, model)
+            self.paths[table] = path
+        writer.write(rows)
+        self.rows[table] = self.rows.get(table, 0) + len(rows)
+
+    def close(self) -> None:
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+def _pause(sleep: float) -> None:
+    # Gives replication and other writers room between batches
+    if sleep:
+        time.sleep(sleep)
+
+
+def expire_notifications(status: str, cutoff: datetime, archive: Archive, batch_size: int,
+                         sleep: float = 0.0) -> int:
+    """Archive and delete notifications in ``status`` created before ``cutoff``, with their attempts.
+
+    Walks the (status, created_at) index oldest first. Each batch is locked with
+    SKIP LOCKED and deleted in its own short transaction, so workers touching
+    other rows are never blocked for long.
+    """
+    total = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Notification.objects.select_for_update(skip_locked=True)
+                .filter(status=status, created_at__lt=cutoff)
+                .order_by("created_at", "id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                return total
+            archive.write(Notification, list(Notification.objects.filter(id__in=ids).values(*_columns(Notification))))
+            archive.write(
+                DeliveryAttempt,
+                list(DeliveryAttempt.objects.filter(notification_id__in=ids).values(*_columns(DeliveryAttempt))),
+            )
+            Notification.objects.filter(id__in=ids).delete()
+        total += len(ids)
+        logger.debug("Expired %s %s notifications", total, status)
+        _pause(sleep)
+
+
+def expire_attempts(cutoff: datetime, archive: Archive, batch_size: int, sleep: float = 0.0) -> int:
+    """Archive and delete delivery attempts created before ``cutoff``.
+
+    Attempts are only ever appended, so ids follow created_at: walking the primary
+    key from the start and stopping at the first newer row never scans the live
+    part of the table.
+    """
+    total = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                DeliveryAttempt.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values(*_columns(DeliveryAttempt))[:batch_size]
+            )
+            expired = list(takewhile(lambda row: row["created_at"] < cutoff, rows))
+            if not expired:
+                return total
+            archive.write(DeliveryAttempt, expired)
+            DeliveryAttempt.objects.filter(id__in=[row["id"] for row in expired]).delete()
+        total += len(expired)
+        last_id = expired[-1]["id"]
+        logger.debug("Expired %s delivery attempts", total)
+        if len(expired) < len(rows):
+            return total
+        _pause(sleep)
+
+
+def _archive_table(name: str, model, archive: Archive, batch_size: int) -> int:
+    quote = connection.ops.quote_name
+    columns = _columns(model)
+    sql = (
+        f"SELECT {', '.join(quote(column) for column in columns)} FROM {quote(name)} "
+        "WHERE id > %s ORDER BY id LIMIT %s"
+    )
+    total = 0
+    last_id = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [last_id, batch_size])
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        if not rows:
+            return total
+        archive.write(model, rows)
+        total += len(rows)
+        last_id = rows[-1]["id"]
+
+
+def drop_expired_partitions(cutoff: datetime, archive: Archive, batch_size: int) -> int:
+    """Archive and drop the DeliveryAttempt partitions that end before ``cutoff``; returns rows archived."""
+    total = 0
+    for name, _, end in partitioning.partitions():
+        if end > cutoff.date():
+            break
+        total += _archive_table(name, DeliveryAttempt, archive, batch_size)
+        partitioning.drop_partition(name)
+        logger.info("Dropped partition %s", name)
+    return total
+
+
+def count_expired(model, cutoff: datetime, status: Optional[str] = None) -> int:
+    """Rows a run would remove, for dry runs."""
+    queryset = model.objects.filter(created_at__lt=cutoff)
+    if status is not None:
+        queryset = queryset.filter(status=status)
+    return queryset.count()
@@ -0,0 +1,27 @@
+from typing import List, Optional
+
+from django.conf import settings
+
+from .breaker import circuit_breaker
+from .cache import channel_order
+
+
+def queue_name(channel: str, priority: str) -> str:
+    return f"{channel}.{priority}"
+
+
+def queue_for(priority: str, preferred_channels: Optional[List[str]]) -> Optional[str]:
+    """Celery queue for a notification: ``<first channel>.<priority>``, e.g. ``telegram.high``.
+
+    The first channel is the one the task will try first, so each channel's worker
+    pool mostly talks to its own provider; fallbacks run in the same task. Returns
+    None (the default queue) when ``NOTIFICATION_QUEUE_ROUTING`` is off.
+    """
+    if not settings.NOTIFICATION_QUEUE_ROUTING:
+        return None
+    return queue_name(circuit_breaker.order(channel_order(preferred_channels))[0], priority)
+
+
+def current_queue(task) -> Optional[str]:
+    # Where the running task came from, so reschedules stay in the same queue
+    return (task.request.delivery_info or {}).get("routing_key")
@@ -0,0 +1,84 @@
+"""Delayed delivery: ``scheduled_at`` from the request and per-user quiet hours.
+
+A notification that should not go out yet is stored with status SCHEDULED and
+no outbox row, so nothing waits in the broker as a countdown task. The partial
+``notification_scheduled_idx`` keeps those rows ordered by due time, and
+``dispatch_due`` (run by ``relay_outbox``) moves the due ones to the outbox in
+batches.
+"""
+import logging
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import outbox
+from .models import Notification, NotificationStatus, User
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=512)
+def _zone(name: str):
+    try:
+        return ZoneInfo(name) if name else timezone.get_default_timezone()
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning("Unknown timezone %r, using %s", name, settings.TIME_ZONE)
+        return timezone.get_default_timezone()
+
+
+def quiet_until(user: User, when: datetime) -> Optional[datetime]:
+    """End of the user's quiet hours if ``when`` falls inside them, else None.
+
+    Hours are in the user's own timezone and may wrap midnight (22:00-07:00).
+    """
+    start, end = user.quiet_hours_start, user.quiet_hours_end
+    if start is None or end is None or start == end:
+        return None
+    zone = _zone(user.timezone)
+    local = when.astimezone(zone)
+    now = local.time()
+    if start < end:
+        inside = start <= now < end
+    else:
+        inside = now >= start or now < end
+    if not inside:
+        return None
+    day = local.date() if now < end else local.date() + timedelta(days=1)
+    return datetime.combine(day, end, tzinfo=zone)
+
+
+def deliver_at(user: User, priority: str, requested: Optional[datetime] = None) -> Optional[datetime]:
+    """When a new notification should be queued, or None for right away."""
+    now = timezone.now()
+    when = max(requested, now) if requested else now
+    if priority in settings.NOTIFICATION_QUIET_HOURS_PRIORITIES:
+        when = quiet_until(user, when) or when
+    return when if when > now else None
+
+
+def dispatch_due(limit: Optional[int] = None) -> int:
+    """Move up to ``limit`` scheduled notifications that are due to the outbox.
+
+    Rows are taken oldest due time first with SKIP LOCKED, so several relays can
+    dispatch side by side. Returns how many were queued.
+    """
+    limit = limit or settings.NOTIFICATION_OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Notification.objects.select_for_update(skip_locked=True)
+            .filter(status=NotificationStatus.SCHEDULED, scheduled_at__lte=now)
+            .order_by("scheduled_at")
+            .values_list("id", flat=True)[:limit]
+        )
+        if not ids:
+            return 0
+        Notification.objects.filter(pk__in=ids).update(status=NotificationStatus.IN_PROGRESS, updated_at=now)
+        outbox.enqueue(Notification.objects.filter(pk__in=ids).select_related("user"))
+    logger.debug("Dispatched %s scheduled notifications", len(ids))
+    return len(ids)
@@ -1,11 +1,151 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
 
+from .models import DeliveryAttempt, Notification, NotificationPriority, NotificationTemplate
+from .templating import template_cache
+
+
+def _context_field(**kwargs):
+    return serializers.DictField(child=serializers.CharField(max_length=1000, allow_blank=True), **kwargs)
+
+
+def _validate_scheduled_at(value):
+    if value > timezone.now() + timedelta(days=settings.NOTIFICATION_SCHEDULE_MAX_DAYS):
+        raise serializers.ValidationError(f'At most {settings.NOTIFICATION_SCHEDULE_MAX_DAYS} days ahead')
+
+
+def _scheduled_at_field():
+    # Past times send right away; naive times are in TIME_ZONE
+    return serializers.DateTimeField(required=False, allow_null=True, validators=[_validate_scheduled_at])
+
+
+def _validate_content(attrs, recipients=()):
+    # Either a literal message or a template name plus the variables it needs;
+    # a valid template is replaced by template_id
+    if ('message' in attrs) == ('template' in attrs):
+        raise serializers.ValidationError('Provide either message or template')
+    if 'template' not in attrs:
+        if 'context' in attrs or 'contexts' in attrs:
+            raise serializers.ValidationError('context is only used with template')
+        return attrs
+    try:
+        attrs['template_id'], compiled = template_cache.get_by_name(attrs.pop('template'))
+    except NotificationTemplate.DoesNotExist:
+        raise serializers.ValidationError({'template': 'Template does not exist'})
+    missing = compiled.required - set(attrs.get('context', {}))
+    if not missing:
+        return attrs
+    contexts = attrs.get('contexts', {})
+    if not recipients:
+        raise serializers.ValidationError({'context': f"Missing variables: {', '.join(sorted(missing))}"})
+    lacking = [recipient for recipient in recipients if missing - set(contexts.get(recipient, {}))]
+    if lacking:
+        raise serializers.ValidationError(
+            {'contexts': f"Missing variables {', '.join(sorted(missing))} for {', '.join(lacking[:10])}"}
+        )
+    return attrs
+
 
 class SendEmailSerializer(serializers.Serializer):
     user_email = serializers.EmailField()
-    message = serializers.CharField(max_length=5000)
+    message = serializers.CharField(max_length=5000, required=False)
+    template = serializers.SlugField(max_length=100, required=False)
+    context = _context_field(required=False)
+    priority = serializers.ChoiceField(choices=NotificationPriority.choices, default=NotificationPriority.NORMAL)
+    scheduled_at = _scheduled_at_field()
+
+    def validate(self, attrs):
+        return _validate_content(attrs)
 
 
 class SendTelegramSerializer(serializers.Serializer):
     telegram_id = serializers.CharField(max_length=128)
-    message = serializers.CharField(max_length=4096)
+    message = serializers.CharField(max_length=4096, required=False)
+    template = serializers.SlugField(max_length=100, required=False)
+    context = _context_field(required=False)
+    priority = serializers.ChoiceField(choices=NotificationPriority.choices, default=NotificationPriority.NORMAL)
+    scheduled_at = _scheduled_at_field()
+
+    def validate(self, attrs):
+        return _validate_content(attrs)
+
+
+class BulkSendSerializer(serializers.Serializer):
+    user_emails = serializers.ListField(
+        child=serializers.EmailField(),
+        required=False,
+        allow_empty=False,
+        max_length=settings.NOTIFICATION_BULK_MAX_RECIPIENTS,
+    )
+    user_id_from = serializers.IntegerField(required=False, min_value=1)
+    user_id_to = serializers.IntegerField(required=False, min_value=1)
+    message = serializers.CharField(max_length=5000, required=False)
+    template = serializers.SlugField(max_length=100, required=False)
+    # Shared by all recipients; contexts adds per-recipient variables by email
+    context = _context_field(required=False)
+    contexts = serializers.DictField(child=_context_field(), required=False)
+    # Campaigns default to low so they never hold up one-off alerts
+    priority = serializers.ChoiceField(choices=NotificationPriority.choices, default=NotificationPriority.LOW)
+    scheduled_at = _scheduled_at_field()
+
+    def validate(self, attrs):
+        has_emails = 'user_emails' in attrs
+        has_range = 'user_id_from' in attrs or 'user_id_to' in attrs
+        if has_emails == has_range:
+            raise serializers.ValidationError('Provide either user_emails or user_id_from/user_id_to')
+        if has_range:
+            if 'user_id_from' not in attrs or 'user_id_to' not in attrs:
+                raise serializers.ValidationError('Both user_id_from and user_id_to are required')
+            if attrs['user_id_from'] > attrs['user_id_to']:
+                raise serializers.ValidationError('user_id_from must not exceed user_id_to')
+            if attrs['user_id_to'] - attrs['user_id_from'] >= settings.NOTIFICATION_BULK_MAX_RECIPIENTS:
+                raise serializers.ValidationError(
+                    f'A user id range may span at most {settings.NOTIFICATION_BULK_MAX_RECIPIENTS} ids'
+                )
+            if 'contexts' in attrs:
+                raise serializers.ValidationError('contexts needs user_emails')
+        return _validate_content(attrs, attrs.get('user_emails', ()))
+
+
+class StatusLookupSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.NOTIFICATION_STATUS_MAX_IDS,
+    )
+
+
+class UserImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    format = serializers.ChoiceField(choices=['csv', 'ndjson'], required=False)
+
+
+class DeliveryAttemptSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeliveryAttempt
+        fields = ['channel', 'status', 'error', 'created_at']
+
+
+class NotificationStatusSerializer(serializers.ModelSerializer):
+    delivery_attempts = DeliveryAttemptSummarySerializer(source='attempts_log', many=True, read_only=True)
+
+    class Meta:
+        model = Notification
+        fields = [
+            'id',
+            'user_id',
+            'status',
+            'priority',
+            'last_channel',
+            'attempts',
+            'error',
+            'created_at',
+            'updated_at',
+            'scheduled_at',
+            'sent_at',
+            'digest_id',
+            'delivery_attempts',
+        ]
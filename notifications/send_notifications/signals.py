@@ -0,0 +1,26 @@
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .backends import backends
+from .cache import user_cache
+from .models import NotificationTemplate, User
+from .templating import template_cache
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    user_cache.invalidate(instance)
+
+
+@receiver(post_save, sender=NotificationTemplate)
+@receiver(post_delete, sender=NotificationTemplate)
+def invalidate_template_cache(sender, instance, **kwargs):
+    template_cache.invalidate(instance)
+
+
+@receiver(setting_changed)
+def reset_channel_backends(sender, setting, **kwargs):
+    if setting == 'NOTIFICATION_CHANNEL_BACKENDS':
+        backends.clear()
@@ -0,0 +1,141 @@
+import json
+import multiprocessing
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+
+class _TelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.record(payload)
+        body = json.dumps({"ok": True, "result": {"message_id": self.server.count}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StubServer:
+    # Shared by the stub servers: request counting and running in a background thread
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, host, port, handler, latency):
+        super().__init__((host, port), handler)
+        self.latency = latency
+        self.count = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, payload):
+        with self._lock:
+            self.count += 1
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class StubTelegramServer(_StubServer, ThreadingHTTPServer):
+    """Local stand-in for the Bot API ``sendMessage`` method.
+
+    Use as a context manager and point ``TELEGRAM_API_URL`` at ``server.url``.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__(host, port, _TelegramHandler, latency)
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    # Just enough SMTP for smtplib: every command is accepted, messages are counted and dropped
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 stub ESMTP")
+        while line := self.rfile.readline():
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.reply("250-stub")
+                self.reply("250 8BITMIME")
+            elif command == b"DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                self.server.record(None)
+                self.reply(f"250 OK queued as {self.server.count}")
+            elif command == b"QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class StubSMTPServer(_StubServer, socketserver.ThreadingTCPServer):
+    """Local SMTP sink; point ``EMAIL_HOST``/``EMAIL_PORT`` at the host and port of ``server.url``."""
+
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        super().__init__(host, port, _SMTPHandler, latency)
+
+
+def _serve(server_cls, kwargs, conn):
+    with server_cls(**kwargs) as server:
+        conn.send(server.url)
+        conn.recv()
+        conn.send({"count": server.count, "connections": server.connections})
+
+
+@contextmanager
+def serve_in_process(server_cls, **kwargs):
+    """Run a stub server in a child process so it does not compete for the GIL.
+
+    Yields a namespace with ``url``; ``count`` and ``connections`` are filled in on exit.
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(server_cls, kwargs, child), daemon=True)
+    process.start()
+    handle = SimpleNamespace(url=parent.recv(), count=None, connections=None)
+    try:
+        yield handle
+    finally:
+        parent.send("stop")
+        stats = parent.recv()
+        handle.count = stats["count"]
+        handle.connections = stats["connections"]
+        process.join()
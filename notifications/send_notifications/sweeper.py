@@ -0,0 +1,90 @@
+"""Re-drive of notifications that no worker finished.
+
+A notification stays pending or in progress if its task message is lost or the
+worker dies mid-delivery. ``sweep_stale`` finds the ones not updated for
+``NOTIFICATION_SWEEP_STALE_AFTER`` seconds whose claim has expired and puts them
+back in the outbox. Ones due (scheduled, or else created) more than
+``NOTIFICATION_SWEEP_MAX_AGE`` seconds ago are failed instead of retried forever.
+"""
+import logging
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import metrics
+from .models import DigestBuffer, Notification, NotificationStatus, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+ABANDONED_ERROR = "Not delivered within NOTIFICATION_SWEEP_MAX_AGE"
+
+
+def stale(now=None):
+    """Unfinished notifications nobody is working on or waiting to publish."""
+    now = now or timezone.now()
+    # Range scan on the partial notification_active_idx, which only holds unfinished rows
+    return (
+        Notification.objects.filter(
+            status__in=[NotificationStatus.PENDING, NotificationStatus.IN_PROGRESS],
+            updated_at__lt=now - timedelta(seconds=settings.NOTIFICATION_SWEEP_STALE_AFTER),
+            # Merged into a digest: settled together with it
+            digest__isnull=True,
+        )
+        .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+        .exclude(Exists(OutboxMessage.objects.filter(notification=OuterRef("pk"))))
+        .exclude(Exists(DigestBuffer.objects.filter(notification=OuterRef("pk"))))
+    )
+
+
+def sweep_stale(limit: Optional[int] = None) -> Tuple[int, int]:
+    """Requeue up to ``limit`` of the oldest stale notifications; returns (requeued, abandoned).
+
+    Rows are locked with SKIP LOCKED and touched in the same transaction, so
+    sweepers running side by side never pick the same notification. A requeued
+    notification whose original task turns up after all is still sent once: the
+    delivery claim lets only one of the two tasks through.
+    """
+    limit = limit or settings.NOTIFICATION_SWEEP_BATCH_SIZE
+    now = timezone.now()
+    max_age = settings.NOTIFICATION_SWEEP_MAX_AGE
+    oldest = now - timedelta(seconds=max_age)
+    with transaction.atomic():
+        rows = list(
+            stale(now)
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by("updated_at")
+            # Scheduled notifications only become due at scheduled_at, so their age starts there
+            .annotate(due_at=Coalesce("scheduled_at", "created_at"))
+            .values_list("id", "priority", "due_at")[:limit]
+        )
+        if not rows:
+            return 0, 0
+        abandoned = []
+        requeued = []
+        for pk, priority, due_at in rows:
+            if max_age and due_at and due_at < oldest:
+                abandoned.append(pk)
+            else:
+                requeued.append((pk, priority))
+        if abandoned:
+            Notification.objects.filter(Q(pk__in=abandoned) | Q(digest_id__in=abandoned)).update(
+                status=NotificationStatus.FAILED,
+                error=ABANDONED_ERROR,
+                claim_token=None,
+                claimed_until=None,
+                updated_at=now,
+            )
+        if requeued:
+            Notification.objects.filter(pk__in=[pk for pk, _ in requeued]).update(updated_at=now)
+            OutboxMessage.objects.bulk_create(
+                OutboxMessage(notification_id=pk, priority=priority) for pk, priority in requeued
+            )
+    metrics.SWEPT.labels("requeued").inc(len(requeued))
+    metrics.SWEPT.labels("abandoned").inc(len(abandoned))
+    logger.info("Swept %s stale notifications: %s requeued, %s abandoned", len(rows), len(requeued), len(abandoned))
+    return len(requeued), len(abandoned)
@@ -1,118 +1,312 @@
-import os
-from typing import List
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 
-import requests
 from celery import shared_task
-from django.core.mail import send_mail
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
+from . import digest, idempotency, metrics, routing
+from .backends import backends
+from .breaker import HALF_OPEN, CircuitOpen, circuit_breaker, is_provider_failure
+from .cache import channel_order, user_cache
 from .models import (
     Notification,
     NotificationStatus,
-    ChannelChoices,
     DeliveryAttempt,
     AttemptStatus,
 )
+from .ratelimit import RateLimited, rate_limiter
 
+# Per notification id: the (channel, error) pairs tried, error None on success
+Outcomes = Dict[int, List[Tuple[str, Optional[str]]]]
 
-def _get_channel_order(user_preferred: List[str]) -> List[str]:
-    default_order = [ChannelChoices.EMAIL, ChannelChoices.SMS, ChannelChoices.TELEGRAM]
-    if not user_preferred:
-        return default_order
-    normalized = [c for c in user_preferred if c in dict(ChannelChoices.choices)]
-    # Append any missing defaults to ensure full fallback coverage
-    for channel in default_order:
-        if channel not in normalized:
-            normalized.append(channel)
-    return normalized
-
-
-def _send_via_email(notification: Notification) -> None:
-    send_mail(
-        "Notification",
-        notification.message,
-        os.getenv("DEFAULT_FROM_EMAIL") or "no-reply@example.com",
-        [notification.user.email],
-        fail_silently=False,
-    )
 
+def _get_channel_order(user_preferred: List[str]) -> Tuple[str, ...]:
+    # Channels with tripped or failing breakers move behind healthy ones
+    return circuit_breaker.order(channel_order(user_preferred))
+
+
+def _send_channel_batch(channel: str, notifications: List[Notification]) -> List[Union[None, str, RateLimited]]:
+    # One result per notification: None on success, an error message on failure,
+    # or RateLimited when the send should be rescheduled instead of failed
+    results = [None] * len(notifications)
+    backend = backends[channel]
+    if backend.batch:
+        allowed = []
+        for index, notification in enumerate(notifications):
+            try:
+                rate_limiter.wait(channel, backend.recipient(notification.user))
+                allowed.append(index)
+            except RateLimited as exc:
+                results[index] = exc
+        batch = [notifications[index] for index in allowed]
+        started = time.monotonic()
+        try:
+            errors = backend.send_batch(batch)
+            if len(errors) != len(batch):
+                raise RuntimeError(f"{channel} backend returned {len(errors)} results for {len(batch)} notifications")
+        except Exception as exc:  # noqa: BLE001 – the whole chunk is recorded as failed
+            errors = [exc] * len(batch)
+        elapsed = time.monotonic() - started
+        metrics.observe_batch_send(channel, elapsed, errors)
+        if circuit_breaker.is_slow(elapsed / max(len(batch), 1)):
+            failures = len(batch)
+        else:
+            # Plain messages carry no detail to classify and count as provider failures
+            failures = sum(
+                isinstance(error, str) or (error is not None and is_provider_failure(error)) for error in errors
+            )
+        circuit_breaker.record(channel, failures=failures, calls=len(batch))
+        for index, error in zip(allowed, errors):
+            if isinstance(error, Exception):
+                error = str(error) or error.__class__.__name__
+            results[index] = error
+        return results
 
-def _send_via_sms(notification: Notification) -> None:
-    # Placeholder: integrate real SMS provider (Twilio) here
-    if not notification.user.phone_number:
-        raise RuntimeError("Phone number not set for user")
-    # Simulate success path without external call
-    return None
+    for index, notification in enumerate(notifications):
+        try:
+            rate_limiter.wait(channel, backend.recipient(notification.user))
+            with circuit_breaker.track(channel), metrics.time_send(channel):
+                backend.send(notification)
+        except RateLimited as exc:
+            results[index] = exc
+        except Exception as exc:  # noqa: BLE001 – recorded as failure attempt
+            results[index] = str(exc) or exc.__class__.__name__
+    return results
 
 
-def _send_via_telegram(notification: Notification) -> None:
-    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not bot_token:
-        raise RuntimeError("Bot token not configured")
-    send_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-    payload = {"chat_id": notification.user.telegram_id, "text": notification.message}
-    resp = requests.post(send_url, json=payload, timeout=10)
-    data = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {}
-    if not (resp.status_code == 200 and isinstance(data, dict) and data.get("ok")):
-        error_text = data.get("description") if isinstance(data, dict) else resp.text
-        raise RuntimeError(error_text or f"HTTP {resp.status_code}")
+def _send_guarded_batch(channel: str, notifications: List[Notification]) -> List[Union[None, str, RateLimited, CircuitOpen]]:
+    # An open breaker skips the whole batch; a half-open one lets a single probe through
+    # and only sends the rest once that probe has closed it again
+    results = []
+    remaining = notifications
+    while remaining:
+        wait = circuit_breaker.allow(channel)
+        if wait:
+            results.extend(CircuitOpen(wait) for _ in remaining)
+            break
+        chunk = remaining[:1] if circuit_breaker.state(channel) == HALF_OPEN else remaining
+        results.extend(_send_channel_batch(channel, chunk))
+        remaining = remaining[len(chunk):]
+    return results
 
 
-CHANNEL_SENDER = {
-    ChannelChoices.EMAIL: _send_via_email,
-    ChannelChoices.SMS: _send_via_sms,
-    ChannelChoices.TELEGRAM: _send_via_telegram,
-}
+# Everything a delivery writes back, flushed in one UPDATE together with its attempt rows
+PERSISTED_FIELDS = ["status", "sent_at", "attempts", "error", "last_channel", "claim_token", "claimed_until", "updated_at"]
 
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=2, retry_kwargs={"max_retries": 3})
-def send_notification_task(self, notification_id: int) -> str:
-    notification = Notification.objects.select_related("user").get(pk=notification_id)
-    if notification.status == NotificationStatus.SENT:
-        return "already_sent"
+def _claim(queryset, token: uuid.UUID) -> int:
+    # Atomic test-and-set: only one worker can hold an unexpired claim on a row
+    now = timezone.now()
+    return (
+        queryset.exclude(status=NotificationStatus.SENT)
+        .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+        .update(
+            status=NotificationStatus.IN_PROGRESS,
+            claim_token=token,
+            claimed_until=now + timedelta(seconds=settings.NOTIFICATION_CLAIM_TIMEOUT),
+            updated_at=now,
+        )
+    )
 
-    channel_order = _get_channel_order(notification.user.preferred_channels or [])
-    last_error = ""
 
-    # Mark as in progress
-    Notification.objects.filter(pk=notification.pk).update(
-        status=NotificationStatus.IN_PROGRESS,
-        updated_at=timezone.now(),
+def _record_attempt(notification: Notification, channel: str, error: Optional[str]) -> DeliveryAttempt:
+    status = AttemptStatus.SUCCESS if error is None else AttemptStatus.FAILURE
+    metrics.DELIVERY_ATTEMPTS.labels(channel, status).inc()
+    notification.attempts = notification.attempts + 1
+    notification.last_channel = channel
+    if error is None:
+        notification.status = NotificationStatus.SENT
+        notification.sent_at = timezone.now()
+        notification.error = ""
+    else:
+        notification.error = error
+    return DeliveryAttempt(
+        notification=notification,
+        channel=channel,
+        status=status,
+        error=error or "",
     )
 
-    for channel in channel_order:
-        Notification.objects.filter(pk=notification.pk).update(last_channel=channel)
+
+def _release(notification: Notification, attempts: List[DeliveryAttempt]) -> None:
+    notification.claim_token = None
+    notification.claimed_until = None
+    with transaction.atomic():
+        DeliveryAttempt.objects.bulk_create(attempts)
+        notification.save(update_fields=PERSISTED_FIELDS)
+        digest.settle_merged([notification])
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=2, retry_kwargs={"max_retries": 3})
+def send_notification_task(self, notification_id: int) -> str:
+    if not _claim(Notification.objects.filter(pk=notification_id), uuid.uuid4()):
+        status = Notification.objects.filter(pk=notification_id).values_list("status", flat=True).first()
+        if status is None:
+            raise Notification.DoesNotExist(f"Notification {notification_id} does not exist")
+        return "already_sent" if status == NotificationStatus.SENT else "claimed"
+    notification = Notification.objects.get(pk=notification_id)
+    already_sent = idempotency.sent_channels([notification.pk]).get(notification.pk)
+    if already_sent:
+        # Delivered by an earlier run whose write failed: save the result, do not send again
+        _release(notification, [_record_attempt(notification, already_sent, None)])
+        return "sent"
+    notification.user = user_cache.get_many([notification.user_id])[notification.user_id]
+    metrics.observe_queue_lag(notification)
+
+    attempts = []
+    retry_after = None
+    for channel in _get_channel_order(notification.user.preferred_channels or []):
+        wait = circuit_breaker.allow(channel)
+        if wait:
+            # Breaker open: skip straight to the next channel instead of waiting out timeouts
+            retry_after = wait if retry_after is None else min(retry_after, wait)
+            continue
+        backend = backends[channel]
         try:
-            CHANNEL_SENDER[channel](notification)
-            DeliveryAttempt.objects.create(
-                notification=notification,
-                channel=channel,
-                status=AttemptStatus.SUCCESS,
+            rate_limiter.wait(channel, backend.recipient(notification.user))
+            with circuit_breaker.track(channel), metrics.time_send(channel):
+                backend.send(notification)
+        except RateLimited as exc:
+            # Throttled, not failed: come back later without spending a retry
+            _release(notification, attempts)
+            send_notification_task.apply_async(
+                (notification.pk,), countdown=exc.retry_after, queue=routing.current_queue(self)
             )
-            notification.status = NotificationStatus.SENT
-            notification.sent_at = timezone.now()
-            notification.attempts = notification.attempts + 1
-            notification.error = ""
-            notification.last_channel = channel
-            notification.save(update_fields=["status", "sent_at", "attempts", "error", "last_channel", "updated_at"])
-            return "sent"
+            return "rate_limited"
         except Exception as exc:  # noqa: BLE001 – we log as failure attempt
-            last_error = str(exc)
-            DeliveryAttempt.objects.create(
-                notification=notification,
-                channel=channel,
-                status=AttemptStatus.FAILURE,
-                error=last_error,
-            )
-            notification.attempts = notification.attempts + 1
-            notification.error = last_error
-            notification.last_channel = channel
-            notification.save(update_fields=["attempts", "error", "last_channel", "updated_at"])
+            attempts.append(_record_attempt(notification, channel, str(exc) or exc.__class__.__name__))
+        else:
+            idempotency.mark_sent(notification.pk, channel)
+            attempts.append(_record_attempt(notification, channel, None))
+            _release(notification, attempts)
+            return "sent"
+
+    if retry_after is not None:
+        # Nothing delivered, but skipped channels may recover: wait for their breakers
+        _release(notification, attempts)
+        send_notification_task.apply_async(
+            (notification.pk,), countdown=retry_after, queue=routing.current_queue(self)
+        )
+        return "circuit_open"
 
     # If all channels failed
-    Notification.objects.filter(pk=notification.pk).update(
-        status=NotificationStatus.FAILED,
-        error=last_error,
-        updated_at=timezone.now(),
-    )
-    raise RuntimeError(last_error or "All channels failed")
+    notification.status = NotificationStatus.FAILED
+    _release(notification, attempts)
+    raise RuntimeError(notification.error or "All channels failed")
+
+
+def _deliver_grouped(notifications: List[Notification]) -> Tuple[Outcomes, Dict[int, float]]:
+    # Notifications sharing a channel order walk the fallback chain together,
+    # so each channel sees one batch per group
+    groups = defaultdict(list)
+    for notification in notifications:
+        groups[tuple(_get_channel_order(notification.user.preferred_channels or []))].append(notification)
+
+    outcomes = defaultdict(list)
+    deferred = {}
+    skipped = {}
+    for channels, pending in groups.items():
+        for channel in channels:
+            if not pending:
+                break
+            results = _send_guarded_batch(channel, pending)
+            still_pending = []
+            for notification, result in zip(pending, results):
+                if isinstance(result, RateLimited):
+                    deferred[notification.pk] = result.retry_after
+                    continue
+                if isinstance(result, CircuitOpen):
+                    skipped[notification.pk] = min(skipped.get(notification.pk, result.retry_after), result.retry_after)
+                    still_pending.append(notification)
+                    continue
+                outcomes[notification.pk].append((channel, result))
+                if result is not None:
+                    still_pending.append(notification)
+            pending = still_pending
+        # Undelivered only because a breaker was open: retry once it half-opens
+        for notification in pending:
+            if notification.pk in skipped:
+                deferred[notification.pk] = skipped[notification.pk]
+    return outcomes, deferred
+
+
+@shared_task(bind=True, max_retries=3)
+def send_notification_batch_task(self, notification_ids: List[int]) -> Dict[str, int]:
+    token = uuid.uuid4()
+    if not _claim(Notification.objects.filter(pk__in=notification_ids), token):
+        return {"sent": 0, "failed": 0, "deferred": 0}
+    # The pk list keeps the lookup on the primary key; the token keeps only rows this run claimed
+    notifications = list(Notification.objects.filter(pk__in=notification_ids, claim_token=token))
+    users = user_cache.get_many(notification.user_id for notification in notifications)
+    for notification in notifications:
+        notification.user = users[notification.user_id]
+        metrics.observe_queue_lag(notification)
+
+    already_sent = idempotency.sent_channels(notification.pk for notification in notifications)
+    pending = [notification for notification in notifications if notification.pk not in already_sent]
+    if settings.NOTIFICATION_ASYNC_DELIVERY:
+        from .async_delivery import deliver_concurrently
+        outcomes, deferred = deliver_concurrently(pending)
+    else:
+        outcomes, deferred = _deliver_grouped(pending)
+    for pk, outcome in outcomes.items():
+        for channel, error in outcome:
+            if error is None:
+                idempotency.mark_sent(pk, channel)
+    # Delivered by an earlier run whose write failed: only the result is saved
+    for pk, channel in already_sent.items():
+        outcomes[pk] = [(channel, None)]
+
+    now = timezone.now()
+    attempts = []
+    failed = []
+    for notification in notifications:
+        for channel, error in outcomes[notification.pk]:
+            attempts.append(_record_attempt(notification, channel, error))
+        if notification.pk not in deferred and notification.status != NotificationStatus.SENT:
+            notification.status = NotificationStatus.FAILED
+            failed.append(notification)
+        notification.claim_token = None
+        notification.claimed_until = None
+        notification.updated_at = now
+
+    with transaction.atomic():
+        DeliveryAttempt.objects.bulk_create(attempts)
+        Notification.objects.bulk_update(notifications, PERSISTED_FIELDS)
+        digest.settle_merged(notifications)
+
+    if deferred:
+        # Throttled sends are rescheduled as a fresh batch and do not count as retries
+        send_notification_batch_task.apply_async(
+            (list(deferred),), countdown=max(deferred.values()), queue=routing.current_queue(self)
+        )
+    if failed and self.request.retries < self.max_retries:
+        countdown = get_exponential_backoff_interval(
+            factor=2, retries=self.request.retries, maximum=600, full_jitter=True
+        )
+        raise self.retry(args=([n.pk for n in failed],), countdown=countdown)
+    return {
+        "sent": len(notifications) - len(failed) - len(deferred),
+        "failed": len(failed),
+        "deferred": len(deferred),
+    }
+
+
+def dispatch_notification_batches(notification_ids: Iterable[int], batch_size: Optional[int] = None,
+                                  queue: Optional[str] = None) -> int:
+    batch_size = batch_size or settings.NOTIFICATION_BATCH_SIZE
+    iterator = iter(notification_ids)
+    batches = 0
+    with send_notification_batch_task.app.producer_or_acquire() as producer:
+        while batch := list(islice(iterator, batch_size)):
+            send_notification_batch_task.apply_async((batch,), producer=producer, queue=queue)
+            batches += 1
+    return batches
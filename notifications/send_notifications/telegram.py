@@ -0,0 +1,89 @@
+import os
+import threading
+from typing import Optional, Tuple
+
+import requests
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .breaker import ProviderError
+from .models import ChannelChoices
+from .ratelimit import RateLimited, rate_limiter
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.TELEGRAM_POOL_SIZE,
+        pool_block=True,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    # One keep-alive session per worker process, shared by its threads (urllib3 pools are
+    # thread-safe); rebuilt after fork so children never share sockets with the parent
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = _build_session()
+                _session_pid = os.getpid()
+    return _session
+
+
+def close_session() -> None:
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+@worker_process_shutdown.connect
+def _close_session(**kwargs):
+    close_session()
+
+
+def send_url() -> str:
+    bot_token = settings.TELEGRAM_BOT_TOKEN
+    if not bot_token:
+        raise RuntimeError("Bot token not configured")
+    return f"{settings.TELEGRAM_API_URL}/bot{bot_token}/sendMessage"
+
+
+def timeout() -> Tuple[float, float]:
+    return settings.TELEGRAM_CONNECT_TIMEOUT, settings.TELEGRAM_READ_TIMEOUT
+
+
+def raise_for_result(status_code: int, data, text: str) -> None:
+    if status_code == 429:
+        parameters = data.get("parameters") if isinstance(data, dict) else None
+        retry_after = float((parameters or {}).get("retry_after") or 1)
+        rate_limiter.block(ChannelChoices.TELEGRAM, retry_after)
+        raise RateLimited(retry_after)
+    if not (status_code == 200 and isinstance(data, dict) and data.get("ok")):
+        error_text = data.get("description") if isinstance(data, dict) else text
+        # 4xx is about this chat or message ("chat not found", bot blocked), 5xx about Telegram
+        error = ProviderError if status_code >= 500 else RuntimeError
+        raise error(error_text or f"HTTP {status_code}")
+
+
+def payload(chat_id: str, text: str, parse_mode: Optional[str] = None) -> dict:
+    data = {"chat_id": chat_id, "text": text}
+    if parse_mode:
+        data["parse_mode"] = parse_mode
+    return data
+
+
+def send_message(chat_id: str, text: str, parse_mode: Optional[str] = None) -> None:
+    resp = get_session().post(send_url(), json=payload(chat_id, text, parse_mode), timeout=timeout())
+    data = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else {}
+    raise_for_result(resp.status_code, data, resp.text)
@@ -0,0 +1,165 @@
+import re
+from string import Template
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from .cache import TTLCache
+from .models import ChannelChoices, Notification, NotificationTemplate
+
+DEFAULT_SUBJECT = "Notification"
+# Filled from the recipient, so templated notifications never store them
+RECIPIENT_VARIABLES = frozenset({"email", "phone_number", "telegram_id"})
+
+_MARKDOWN_SPECIAL = re.compile(r"([_*\[\]()~`>#+\-=|{}.!\\])")
+
+
+class Rendered(NamedTuple):
+    subject: str
+    body: str
+    parse_mode: Optional[str] = None
+
+
+def _compile(text: str) -> Tuple[str, ...]:
+    # Literal and placeholder parts alternate, starting and ending with a literal.
+    # Same syntax as string.Template, parsed once instead of on every substitution.
+    parts = []
+    literal = []
+    position = 0
+    for match in Template.pattern.finditer(text):
+        literal.append(text[position:match.start()])
+        position = match.end()
+        name = match.group("named") or match.group("braced")
+        if name:
+            parts.append("".join(literal))
+            parts.append(name)
+            literal = []
+        elif match.group("escaped") is not None:
+            literal.append("$")
+        else:
+            literal.append(match.group())
+    literal.append(text[position:])
+    parts.append("".join(literal))
+    return tuple(parts)
+
+
+def _substitute(parts: Tuple[str, ...], context: dict, escape=None) -> str:
+    # Unknown placeholders stay in the text, like Template.safe_substitute
+    out = [parts[0]]
+    for index in range(1, len(parts), 2):
+        value = context.get(parts[index])
+        if value is None:
+            out.append(f"${{{parts[index]}}}")
+        else:
+            out.append(escape(str(value)) if escape else str(value))
+        out.append(parts[index + 1])
+    return "".join(out)
+
+
+def escape_markdown(text: str) -> str:
+    return _MARKDOWN_SPECIAL.sub(r"\\\1", text)
+
+
+def truncate_sms(text: str) -> str:
+    limit = settings.NOTIFICATION_SMS_MAX_LENGTH
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class CompiledTemplate:
+    def __init__(self, template: NotificationTemplate):
+        self.subject = _compile(template.subject)
+        self.body = _compile(template.body)
+        self.telegram = _compile(template.telegram_body or template.body)
+        self.telegram_markdown = bool(template.telegram_body)
+        self.sms = _compile(template.sms_body or template.body)
+        self.variables: FrozenSet[str] = frozenset(
+            name for parts in (self.subject, self.body, self.telegram, self.sms) for name in parts[1::2]
+        )
+
+    @property
+    def required(self) -> FrozenSet[str]:
+        """Variables the notification context has to provide."""
+        return self.variables - RECIPIENT_VARIABLES
+
+    def render(self, channel: str, context: dict) -> Rendered:
+        subject = _substitute(self.subject, context)
+        if channel == ChannelChoices.TELEGRAM and self.telegram_markdown:
+            return Rendered(subject, _substitute(self.telegram, context, escape_markdown), "MarkdownV2")
+        if channel == ChannelChoices.TELEGRAM:
+            return Rendered(subject, _substitute(self.telegram, context))
+        if channel == ChannelChoices.SMS:
+            return Rendered(subject, truncate_sms(_substitute(self.sms, context)))
+        return Rendered(subject, _substitute(self.body, context))
+
+
+class TemplateCache:
+    """Compiled templates per worker process, by id and by name.
+
+    Saving or deleting a template invalidates it in this process (signals.py);
+    other processes pick the change up after ``NOTIFICATION_TEMPLATE_CACHE_TTL``.
+    """
+
+    def __init__(self):
+        self._local = None
+
+    @property
+    def local(self) -> TTLCache:
+        if self._local is None:
+            self._local = TTLCache(settings.NOTIFICATION_TEMPLATE_CACHE_SIZE, settings.NOTIFICATION_TEMPLATE_CACHE_TTL)
+        return self._local
+
+    def _store(self, template: NotificationTemplate) -> Tuple[int, CompiledTemplate]:
+        entry = (template.pk, CompiledTemplate(template))
+        self.local.set(f"pk:{template.pk}", entry)
+        self.local.set(f"name:{template.name}", entry)
+        return entry
+
+    def _lookup(self, key: str, **lookup) -> Tuple[int, CompiledTemplate]:
+        entry = self.local.get(key)
+        if entry is None:
+            entry = self._store(NotificationTemplate.objects.get(**lookup))
+        return entry
+
+    def is_cached(self, template_id: int) -> bool:
+        return self.local.get(f"pk:{template_id}") is not None
+
+    def warm(self, template_ids: Iterable[Optional[int]]) -> None:
+        """Load the templates among ``template_ids`` that are not cached yet, in one query."""
+        missing = {pk for pk in template_ids if pk is not None and not self.is_cached(pk)}
+        if missing:
+            for template in NotificationTemplate.objects.filter(pk__in=missing):
+                self._store(template)
+
+    def get(self, template_id: int) -> CompiledTemplate:
+        return self._lookup(f"pk:{template_id}", pk=template_id)[1]
+
+    def get_by_name(self, name: str) -> Tuple[int, CompiledTemplate]:
+        """Return (template id, compiled template); raises NotificationTemplate.DoesNotExist."""
+        return self._lookup(f"name:{name}", name=name)
+
+    def invalidate(self, template: NotificationTemplate) -> None:
+        self.local.delete(f"pk:{template.pk}", f"name:{template.name}")
+
+    def stats(self) -> Dict[str, int]:
+        return self.local.stats()
+
+
+template_cache = TemplateCache()
+
+
+def render(notification: Notification, channel: str) -> Rendered:
+    """Subject, body and Telegram parse mode of ``notification`` for ``channel``.
+
+    Needs ``notification.user`` for templated notifications.
+    """
+    if notification.template_id is None:
+        body = truncate_sms(notification.message) if channel == ChannelChoices.SMS else notification.message
+        return Rendered(DEFAULT_SUBJECT, body)
+    user = notification.user
+    context = {
+        "email": user.email,
+        "phone_number": user.phone_number,
+        "telegram_id": user.telegram_id,
+        **(notification.context or {}),
+    }
+    return template_cache.get(notification.template_id).render(channel, context)
@@ -1,3 +1,1014 @@
-from django.test import TestCase
+import asyncio
+import copy
+import importlib.util
+import io
+import os
+import shutil
+import smtplib
+import socket
+import tempfile
+import time
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import aiosmtplib
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:  # Test-only dependency: pip install aiosmtpd
+    Controller = None
+
+from . import (
+    benchmarking,
+    digest,
+    idempotency,
+    metrics,
+    outbox,
+    partitioning,
+    retention,
+    routing,
+    scheduling,
+    stubs,
+    sweeper,
+    templating,
+)
+from .async_delivery import _AsyncSMTPPool
+from .backends import FakeBackend, StubSMSBackend, backends, build_email
+from .breaker import CLOSED, OPEN, ProviderError, _LocalBreakers, circuit_breaker
+from .cache import user_cache
+from .importer import import_users
+from .mail import SMTPConnectionPool
+from .models import (
+    AttemptStatus,
+    ChannelChoices,
+    DeliveryAttempt,
+    DigestBuffer,
+    Notification,
+    NotificationPriority,
+    NotificationStatus,
+    NotificationTemplate,
+    OutboxMessage,
+    User,
+)
+from .tasks import send_notification_batch_task, send_notification_task
+
+FAKE_BACKENDS = {channel: {'BACKEND': 'send_notifications.backends.FakeBackend'} for channel in ChannelChoices.values}
+
+
+class FailingBatchBackend(FakeBackend):
+    def send_batch(self, notifications):
+        raise RuntimeError('provider down')
+
+
+class ShortBatchBackend(FakeBackend):
+    def send_batch(self, notifications):
+        return ['boom']
+
+
+@override_settings(
+    NOTIFICATION_CHANNEL_BACKENDS=FAKE_BACKENDS,
+    NOTIFICATION_RATE_LIMITS={},
+    NOTIFICATION_RATE_LIMIT_REDIS_URL=None,
+    NOTIFICATION_CIRCUIT_BREAKER_REDIS_URL=None,
+    NOTIFICATION_CACHE_REDIS_URL=None,
+    NOTIFICATION_ASYNC_DELIVERY=False,
+    NOTIFICATION_DIGEST_WINDOW=0,
+)
+class DeliveryTestCase(TestCase):
+    """Delivery through in-memory backends, with fresh breaker and cache state per test."""
+
+    def setUp(self):
+        FakeBackend.outbox.clear()
+        user_cache.clear()
+        idempotency._store.local.clear()
+        for name, value in (('_local', _LocalBreakers()), ('_snapshot', {}), ('_snapshot_at', 0.0)):
+            patcher = mock.patch.object(circuit_breaker, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def create_user(self, email='user@example.com', **fields):
+        fields.setdefault('phone_number', '+10000000000')
+        fields.setdefault('telegram_id', '100')
+        fields.setdefault('preferred_channels', [ChannelChoices.EMAIL])
+        return User.objects.create(email=email, **fields)
+
+    def create_notification(self, user, **fields):
+        fields.setdefault('status', NotificationStatus.IN_PROGRESS)
+        return Notification.objects.create(user=user, message=fields.pop('message', 'Hello'), **fields)
+
+    def attempts(self, notification):
+        return list(
+            DeliveryAttempt.objects.filter(notification=notification).order_by('id').values_list('channel', 'status')
+        )
+
+
+class BatchBackendErrorTests(DeliveryTestCase):
+    def backends_with_email(self, backend):
+        return {**FAKE_BACKENDS, 'email': {'BACKEND': f'send_notifications.tests.{backend}'}}
+
+    def test_exception_fails_the_chunk_and_falls_back(self):
+        users = [self.create_user(f'user{i}@example.com') for i in range(2)]
+        notifications = [self.create_notification(user) for user in users]
+        with self.settings(NOTIFICATION_CHANNEL_BACKENDS=self.backends_with_email('FailingBatchBackend')):
+            result = send_notification_batch_task.run([n.pk for n in notifications])
+
+        self.assertEqual(result, {'sent': 2, 'failed': 0, 'deferred': 0})
+        for notification in notifications:
+            notification.refresh_from_db()
+            self.assertEqual(notification.status, NotificationStatus.SENT)
+            self.assertIsNone(notification.claim_token)
+            self.assertEqual(self.attempts(notification), [
+                (ChannelChoices.EMAIL, AttemptStatus.FAILURE),
+                (ChannelChoices.SMS, AttemptStatus.SUCCESS),
+            ])
+
+    def test_short_result_list_is_not_taken_as_success(self):
+        users = [self.create_user(f'user{i}@example.com') for i in range(2)]
+        notifications = [self.create_notification(user) for user in users]
+        with self.settings(NOTIFICATION_CHANNEL_BACKENDS=self.backends_with_email('ShortBatchBackend')):
+            send_notification_batch_task.run([n.pk for n in notifications])
+
+        for notification in notifications:
+            self.assertEqual(self.attempts(notification)[0], (ChannelChoices.EMAIL, AttemptStatus.FAILURE))
+
+
+class QueryCountTests(DeliveryTestCase):
+    # Pinned counts include the SAVEPOINT/RELEASE pair TestCase turns the write transaction into;
+    # in production that is BEGIN/COMMIT, which is not counted
+
+    def test_single_send(self):
+        user = self.create_user()
+        user_cache.get_many([user.pk])
+        notification = self.create_notification(user)
+        # Claim UPDATE, notification SELECT, then attempt INSERT and notification UPDATE
+        with self.assertNumQueries(6):
+            self.assertEqual(send_notification_task.run(notification.pk), 'sent')
+
+    def test_single_send_with_cold_user_cache(self):
+        notification = self.create_notification(self.create_user())
+        user_cache.clear()
+        with self.assertNumQueries(7):
+            send_notification_task.run(notification.pk)
+
+    def test_batch_does_not_grow_with_its_size(self):
+        notifications = [self.create_notification(self.create_user(f'user{i}@example.com')) for i in range(5)]
+        user_cache.clear()
+        # Claim UPDATE, notification SELECT, user SELECT, then attempts INSERT and one bulk UPDATE
+        with self.assertNumQueries(7):
+            result = send_notification_batch_task.run([n.pk for n in notifications])
+        self.assertEqual(result['sent'], 5)
+
+    def test_batch_with_a_digest(self):
+        user = self.create_user()
+        summary = self.create_notification(user, is_digest=True)
+        merged = self.create_notification(user, status=NotificationStatus.PENDING, digest=summary)
+        user_cache.clear()
+        # Plus the UPDATE that settles the merged notifications
+        with self.assertNumQueries(8):
+            send_notification_batch_task.run([summary.pk])
+        merged.refresh_from_db()
+        self.assertEqual(merged.status, NotificationStatus.SENT)
+
+    def test_batch_loads_claimed_rows_by_primary_key(self):
+        notifications = [self.create_notification(self.create_user(f'user{i}@example.com')) for i in range(2)]
+        with CaptureQueriesContext(connection) as queries:
+            send_notification_batch_task.run([n.pk for n in notifications])
+        # claim_token has no index: the lookup must not filter on it alone
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'claim_token' in q['sql']]
+        self.assertEqual(len(selects), 1)
+        self.assertIn('"send_notifications_notification"."id" IN', selects[0])
+
+
+class CircuitBreakerTests(DeliveryTestCase):
+    def send_failures(self, channel, exc, times):
+        for _ in range(times):
+            with self.assertRaises(type(exc)), circuit_breaker.track(channel):
+                raise exc
+
+    def test_provider_failures_open_the_breaker(self):
+        self.send_failures(ChannelChoices.TELEGRAM, ProviderError('Bad Gateway'), 25)
+        self.assertEqual(circuit_breaker.state(ChannelChoices.TELEGRAM), OPEN)
+
+    def test_recipient_errors_are_not_counted(self):
+        self.send_failures(ChannelChoices.TELEGRAM, RuntimeError('Bad Request: chat not found'), 25)
+        self.assertEqual(circuit_breaker.state(ChannelChoices.TELEGRAM), CLOSED)
+
+    def test_users_without_phone_numbers_do_not_reroute_sms(self):
+        sms_backends = {**FAKE_BACKENDS, 'sms': {'BACKEND': 'send_notifications.backends.StubSMSBackend'}}
+        with self.settings(NOTIFICATION_CHANNEL_BACKENDS=sms_backends):
+            for i in range(25):
+                user = self.create_user(f'user{i}@example.com', phone_number='', preferred_channels=['sms'])
+                send_notification_task.run(self.create_notification(user).pk)
+            notification = self.create_notification(self.create_user(preferred_channels=['sms']))
+            send_notification_task.run(notification.pk)
+
+        self.assertEqual(circuit_breaker.state(ChannelChoices.SMS), CLOSED)
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.last_channel), (NotificationStatus.SENT, 'sms'))
+
+
+class RecordingSMTPHandler:
+    """aiosmtpd handler counting connections (each one greets with EHLO), messages and NOOPs."""
+
+    def __init__(self):
+        self.connections = 0
+        self.messages = 0
+        self.noops = 0
+        self.noop_status = '250 OK'
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_NOOP(self, server, session, envelope, arg):
+        self.noops += 1
+        return self.noop_status
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages += 1
+        return '250 Message accepted for delivery'
+
+
+def start_smtp_server(test):
+    """Run an aiosmtpd server for ``test`` and point the SMTP settings at it; returns its handler."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    handler = RecordingSMTPHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    test.addCleanup(controller.stop)
+    settings_override = override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1',
+        EMAIL_PORT=port,
+        EMAIL_HOST_USER='',
+        EMAIL_USE_TLS=False,
+        EMAIL_USE_SSL=False,
+        NOTIFICATION_SMTP_MAX_MESSAGES_PER_CONNECTION=100,
+        NOTIFICATION_SMTP_HEALTHCHECK_INTERVAL=30,
+    )
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+    return handler
+
+
+@skipUnless(Controller, 'needs aiosmtpd')
+class SMTPConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.handler = start_smtp_server(self)
+        self.pool = SMTPConnectionPool()
+        self.addCleanup(self.pool.close_all)
+
+    def messages(self, count):
+        return [EmailMessage('Hi', f'Message {i}', 'from@example.com', [f'to{i}@example.com']) for i in range(count)]
+
+    def delivered(self):
+        return self.handler.messages, self.handler.connections
+
+    def test_batch_goes_over_one_connection(self):
+        self.assertEqual(self.pool.send_messages(self.messages(3)), [None, None, None])
+        self.pool.send(self.messages(1)[0])
+        self.assertEqual(self.delivered(), (4, 1))
+
+    def test_connection_is_recycled_at_the_message_cap(self):
+        with self.settings(NOTIFICATION_SMTP_MAX_MESSAGES_PER_CONNECTION=2):
+            self.pool.send_messages(self.messages(5))
+        self.assertEqual(self.delivered(), (5, 3))
+
+    def test_idle_connection_failing_noop_is_replaced(self):
+        with self.settings(NOTIFICATION_SMTP_HEALTHCHECK_INTERVAL=0):
+            self.pool.send(self.messages(1)[0])
+            self.pool.send(self.messages(1)[0])
+            self.assertEqual((self.handler.noops, self.handler.connections), (1, 1))
+            self.handler.noop_status = '421 Closing connection'
+            self.pool.send(self.messages(1)[0])
+        self.assertEqual((self.handler.noops, *self.delivered()), (2, 3, 2))
+
+    def test_send_is_retried_once_on_a_dropped_connection(self):
+        self.pool.send(self.messages(1)[0])
+        # The server went away while the connection sat in the pool
+        entry = next(iter(self.pool._connections().values()))
+        entry.backend.connection.sock.shutdown(socket.SHUT_RDWR)
+
+        self.pool.send(self.messages(1)[0])
+
+        self.assertEqual(self.delivered(), (2, 2))
+
+    def test_second_disconnect_is_raised(self):
+        with mock.patch(
+            'django.core.mail.backends.smtp.EmailBackend.send_messages',
+            side_effect=smtplib.SMTPServerDisconnected('Connection unexpectedly closed'),
+        ) as send_messages:
+            errors = self.pool.send_messages(self.messages(1))
+        self.assertIsInstance(errors[0], smtplib.SMTPServerDisconnected)
+        self.assertEqual(send_messages.call_count, 2)
+
+    def test_disconnect_after_the_message_was_handed_over_is_not_retried(self):
+        with mock.patch.object(
+            smtplib.SMTP, 'data', side_effect=smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        ):
+            errors = self.pool.send_messages(self.messages(1))
+        self.assertIsInstance(errors[0], smtplib.SMTPServerDisconnected)
+        self.assertEqual(self.handler.connections, 1)
+
+    @override_settings(DEFAULT_FROM_EMAIL='alerts@example.com')
+    def test_sender_comes_from_settings(self):
+        notification = Notification(message='Hello', user=User(email='ann@example.com'))
+        self.assertEqual(build_email(notification).from_email, 'alerts@example.com')
+
+
+@skipUnless(Controller, 'needs aiosmtpd')
+class AsyncSMTPPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.handler = start_smtp_server(self)
+        self.message = EmailMessage('Hi', 'Hello', 'from@example.com', ['to@example.com']).message()
+
+    def send(self, *steps):
+        async def run():
+            pool = _AsyncSMTPPool()
+            try:
+                for step in steps:
+                    await step(pool)
+            finally:
+                await pool.close()
+        asyncio.run(run())
+
+    async def send_one(self, pool):
+        await pool.send(self.message, 'from@example.com', ['to@example.com'])
+
+    async def drop_idle(self, pool):
+        pool._idle[0].close()
+
+    def test_messages_share_a_connection(self):
+        self.send(self.send_one, self.send_one)
+        self.assertEqual((self.handler.messages, self.handler.connections), (2, 1))
+
+    def test_closed_idle_connection_is_replaced_before_sending(self):
+        self.send(self.send_one, self.drop_idle, self.send_one)
+        self.assertEqual((self.handler.messages, self.handler.connections), (2, 2))
+
+    def test_disconnect_during_a_send_is_not_retried(self):
+        async def disconnect(*args, **kwargs):
+            raise aiosmtplib.SMTPServerDisconnected('Connection lost')
+
+        async def failing_send(pool):
+            with mock.patch.object(aiosmtplib.SMTP, 'send_message', disconnect):
+                with self.assertRaises(aiosmtplib.SMTPServerDisconnected):
+                    await self.send_one(pool)
+            self.assertEqual(pool._idle, [])
+
+        self.send(failing_send, self.send_one)
+        self.assertEqual(self.handler.messages, 1)
+
+
+@skipUnless(Controller, 'needs aiosmtpd')
+@override_settings(NOTIFICATION_ASYNC_DELIVERY=True)
+class AsyncDeliveryTests(DeliveryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.handler = start_smtp_server(self)
+        patcher = mock.patch.object(templating.template_cache, '_local', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_templated_notification_with_a_cold_template_cache(self):
+        template = NotificationTemplate.objects.create(name='welcome', subject='Hi', body='Welcome, $name')
+        user = self.create_user()
+        notification = self.create_notification(user, message='', template=template, context={'name': 'Ann'})
+        email_backends = {**FAKE_BACKENDS, 'email': {'BACKEND': 'send_notifications.backends.EmailBackend'}}
+
+        with self.settings(NOTIFICATION_CHANNEL_BACKENDS=email_backends):
+            result = send_notification_batch_task.run([notification.pk])
+
+        self.assertEqual(result, {'sent': 1, 'failed': 0, 'deferred': 0})
+        self.assertEqual(self.attempts(notification), [(ChannelChoices.EMAIL, AttemptStatus.SUCCESS)])
+        self.assertEqual(self.handler.messages, 1)
+
+
+@override_settings(NOTIFICATION_CACHE_REDIS_URL=None, NOTIFICATION_CACHE_LOCAL_TTL=5)
+class UserCacheTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(user_cache, '_local', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_copies_missed_by_invalidation_expire_after_the_local_ttl(self):
+        user = User.objects.create(email='old@example.com', phone_number='1', telegram_id='t1')
+        self.assertEqual(user_cache.get_many([user.pk])[user.pk].email, 'old@example.com')
+        # Saved by another process: this one's copy is not invalidated
+        User.objects.filter(pk=user.pk).update(email='new@example.com')
+        self.assertEqual(user_cache.get_many([user.pk])[user.pk].email, 'old@example.com')
+
+        later = time.monotonic() + 6
+        with mock.patch('send_notifications.cache.time.monotonic', return_value=later):
+            self.assertEqual(user_cache.get_many([user.pk])[user.pk].email, 'new@example.com')
+
+    def test_save_invalidates_this_process(self):
+        user = User.objects.create(email='old@example.com', phone_number='1', telegram_id='t1')
+        user_cache.get_many([user.pk])
+        user.email = 'new@example.com'
+        user.save()
+        self.assertEqual(user_cache.get_many([user.pk])[user.pk].email, 'new@example.com')
+
+
+@override_settings(NOTIFICATION_CACHE_REDIS_URL=None)
+class ImportUsersTests(TestCase):
+    def test_columns_missing_from_the_file_keep_stored_values(self):
+        User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1', preferred_channels=['sms'])
+        csv_file = io.StringIO('email,preferred_channels\nann@example.com,telegram\nbob@example.com,email\n')
+
+        result = import_users(csv_file, 'csv')
+
+        self.assertEqual((result.imported, result.invalid), (2, 0))
+        ann = User.objects.get(email='ann@example.com')
+        self.assertEqual((ann.phone_number, ann.telegram_id, ann.preferred_channels), ('1', 't1', ['telegram']))
+        bob = User.objects.get(email='bob@example.com')
+        self.assertEqual((bob.phone_number, bob.telegram_id, bob.preferred_channels), ('', '', ['email']))
+
+    def test_blank_values_keep_stored_values(self):
+        User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1', preferred_channels=['sms'])
+        ndjson = io.StringIO('{"email": "ann@example.com", "phone_number": "", "telegram_id": "t2"}\n')
+
+        import_users(ndjson, 'ndjson')
+
+        ann = User.objects.get(email='ann@example.com')
+        self.assertEqual((ann.phone_number, ann.telegram_id, ann.preferred_channels), ('1', 't2', ['sms']))
+
+    def test_whitespace_only_values_keep_stored_values(self):
+        User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1', preferred_channels=['sms'])
+        csv_file = io.StringIO('email,phone_number,telegram_id\nann@example.com,  ,t2\n')
+
+        import_users(csv_file, 'csv')
+
+        ann = User.objects.get(email='ann@example.com')
+        self.assertEqual((ann.phone_number, ann.telegram_id), ('1', 't2'))
+
+    def test_email_only_rows_for_existing_users_are_not_counted(self):
+        User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1')
+        csv_file = io.StringIO('email\nann@example.com\nbob@example.com\n')
+
+        result = import_users(csv_file, 'csv')
+
+        self.assertEqual((result.rows, result.imported, result.invalid), (2, 1, 0))
+        self.assertTrue(User.objects.filter(email='bob@example.com').exists())
+
+    def test_non_string_channel_is_a_row_error(self):
+        ndjson = io.StringIO(
+            '{"email": "ann@example.com", "preferred_channels": [{"a": 1}]}\n'
+            '{"email": "bob@example.com", "preferred_channels": ["sms"]}\n'
+        )
+
+        result = import_users(ndjson, 'ndjson')
+
+        self.assertEqual((result.imported, result.invalid), (1, 1))
+        self.assertEqual(result.errors[0][0], 1)
+        self.assertTrue(User.objects.filter(email='bob@example.com').exists())
+
+
+@override_settings(NOTIFICATION_CACHE_REDIS_URL=None, NOTIFICATION_DIGEST_WINDOW=0, NOTIFICATION_BULK_MAX_RECIPIENTS=10)
+class BulkSendTests(TestCase):
+    def test_id_range_is_limited(self):
+        response = self.client.post(
+            reverse('send_notification_bulk'),
+            {'user_id_from': 1, 'user_id_to': 11, 'message': 'Hello'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_id_range_reports_a_count(self):
+        users = [User.objects.create(email=f'user{i}@example.com', phone_number='1', telegram_id=str(i)) for i in range(3)]
+        response = self.client.post(
+            reverse('send_notification_bulk'),
+            {'user_id_from': users[0].pk, 'user_id_to': users[0].pk + 9, 'message': 'Hello $email'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'detail': 'Notifications queued', 'queued': 3})
+        self.assertEqual(OutboxMessage.objects.count(), 3)
+
+    def test_placeholders_are_rendered_from_one_stored_template(self):
+        ann = User.objects.create(
+            email='ann@example.com', phone_number='1', telegram_id='t1', preferred_channels=['telegram']
+        )
+        User.objects.create(email='bob@example.com', phone_number='2', telegram_id='t2')
+        for _ in range(2):
+            self.client.post(
+                reverse('send_notification_bulk'),
+                {'user_emails': ['ann@example.com', 'bob@example.com'], 'message': 'Hello $email'},
+                content_type='application/json',
+            )
+
+        template = NotificationTemplate.objects.get()
+        notifications = Notification.objects.filter(user=ann)
+        self.assertEqual(
+            {(n.message, n.template_id, n.last_channel) for n in notifications}, {('', template.pk, 'telegram')}
+        )
+        notification = notifications.first()
+        self.assertEqual(templating.render(notification, ChannelChoices.EMAIL).body, 'Hello ann@example.com')
+        self.assertEqual(
+            set(Notification.objects.exclude(user=ann).values_list('last_channel', flat=True)), {ChannelChoices.EMAIL}
+        )
+
+
+class QueueLagTests(TestCase):
+    def test_lag_of_a_scheduled_notification_starts_at_its_scheduled_time(self):
+        now = timezone.now()
+        notification = Notification(created_at=now - timedelta(hours=2), scheduled_at=now - timedelta(seconds=3))
+        with mock.patch.object(metrics.QUEUE_LAG_SECONDS, 'observe') as observe:
+            metrics.observe_queue_lag(notification)
+        self.assertLess(observe.call_args.args[0], 60)
+
+    def test_lag_of_an_immediate_notification_starts_at_creation(self):
+        notification = Notification(created_at=timezone.now() - timedelta(minutes=5))
+        with mock.patch.object(metrics.QUEUE_LAG_SECONDS, 'observe') as observe:
+            metrics.observe_queue_lag(notification)
+        self.assertGreaterEqual(observe.call_args.args[0], 300)
+
+
+@skipUnless(importlib.util.find_spec('pyarrow'), 'needs pyarrow')
+class ParquetArchiveTests(TestCase):
+    def test_batches_deleted_before_a_crash_stay_readable(self):
+        import pyarrow.parquet
+
+        user = User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1')
+        Notification.objects.bulk_create(
+            Notification(user=user, message=f'Message {i}', status=NotificationStatus.SENT) for i in range(3)
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        archive = retention.Archive(directory, 'parquet')
+        original_write = retention.Archive.write
+        written = []
+
+        def crash_on_the_second_batch(archive, model, rows):
+            if model is Notification and written:
+                raise KeyboardInterrupt
+            written.append(len(rows))
+            original_write(archive, model, rows)
+
+        with mock.patch.object(retention.Archive, 'write', crash_on_the_second_batch):
+            with self.assertRaises(KeyboardInterrupt):
+                retention.expire_notifications(NotificationStatus.SENT, timezone.now(), archive, batch_size=2)
+
+        # No close(): the run died, yet the first batch's file is complete
+        table = pyarrow.parquet.read_table(archive.paths[Notification._meta.db_table])
+        self.assertEqual(sorted(table.column('message').to_pylist()), ['Message 0', 'Message 1'])
+        self.assertEqual(list(Notification.objects.values_list('message', flat=True)), ['Message 2'])
+
+
+class PartitioningTests(TestCase):
+    def test_convert_needs_the_experimental_flag(self):
+        with self.assertRaisesMessage(CommandError, '--experimental'):
+            call_command('partition_attempts', convert=True)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitioning needs PostgreSQL')
+    def test_convert_keeps_rows_and_partitions_new_ones_by_month(self):
+        user = User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1')
+        notification = Notification.objects.create(user=user, message='Hello')
+        old = DeliveryAttempt.objects.create(
+            notification=notification, channel=ChannelChoices.EMAIL, status=AttemptStatus.FAILURE
+        )
+
+        self.assertEqual(partitioning.convert(months_ahead=1), 1)
+
+        self.assertTrue(partitioning.is_partitioned())
+        names = [name for name, _, _ in partitioning.partitions()]
+        self.assertIn(f'{partitioning.TABLE}_p{timezone.now():%Y%m}', names)
+        new = DeliveryAttempt.objects.create(
+            notification=notification, channel=ChannelChoices.SMS, status=AttemptStatus.SUCCESS
+        )
+        self.assertGreater(new.pk, old.pk)
+        channels = DeliveryAttempt.objects.filter(notification=notification).order_by('pk').values_list('channel', flat=True)
+        self.assertEqual(list(channels), [ChannelChoices.EMAIL, ChannelChoices.SMS])
+        with self.assertRaises(partitioning.PartitioningError):
+            partitioning.convert(months_ahead=1)
+
+    @skipUnless(connection.vendor == 'postgresql', 'Partitioning needs PostgreSQL')
+    def test_new_partition_takes_over_rows_from_the_default_partition(self):
+        user = User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1')
+        notification = Notification.objects.create(user=user, message='Hello')
+        partitioning.convert(months_ahead=0)
+        later = timezone.now() + timedelta(days=62)
+        attempt = DeliveryAttempt.objects.create(
+            notification=notification, channel=ChannelChoices.EMAIL, status=AttemptStatus.SUCCESS
+        )
+        DeliveryAttempt.objects.filter(pk=attempt.pk).update(created_at=later)
+
+        names = partitioning.ensure_partitions(months_ahead=3)
+
+        name = f'{partitioning.TABLE}_p{later:%Y%m}'
+        self.assertIn(name, names)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {connection.ops.quote_name(name)}')
+            self.assertEqual(cursor.fetchall(), [(attempt.pk,)])
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(partitioning.DEFAULT_PARTITION)}')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class StatusEndpointTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1')
+
+    def test_etag_answers_304_until_the_notification_changes(self):
+        notification = Notification.objects.create(user=self.user, message='Hello')
+        url = reverse('notification_status', args=[notification.pk])
+        etag = self.client.get(url)['ETag']
+
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        notification.status = NotificationStatus.SENT
+        notification.save()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], NotificationStatus.SENT)
+
+    def test_bulk_lookup_reports_missing_ids(self):
+        notification = Notification.objects.create(user=self.user, message='Hello')
+        response = self.client.get(reverse('notification_status_lookup'), {'ids': f'{notification.pk},999999'})
+        self.assertEqual([item['id'] for item in response.json()['results']], [notification.pk])
+        self.assertEqual(response.json()['not_found'], [999999])
+
+    def test_history_pages_with_a_keyset_cursor(self):
+        ids = [Notification.objects.create(user=self.user, message=f'Message {i}').pk for i in range(5)]
+        url = reverse('user_notification_history', args=[self.user.pk])
+        seen = []
+        params = {'limit': 2}
+        while True:
+            page = self.client.get(url, params).json()
+            seen += [item['id'] for item in page['results']]
+            if not page['next_cursor']:
+                break
+            params['cursor'] = page['next_cursor']
+        self.assertEqual(seen, ids[::-1])
+
+    def test_history_etag_covers_the_requested_page(self):
+        notifications = [Notification.objects.create(user=self.user, message=f'Message {i}') for i in range(3)]
+        url = reverse('user_notification_history', args=[self.user.pk])
+        etag = self.client.get(url, {'limit': 2})['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'limit': 2}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+        notifications[-1].status = NotificationStatus.SENT
+        notifications[-1].save()
+        self.assertEqual(self.client.get(url, {'limit': 2}, headers={'If-None-Match': etag}).status_code, 200)
+
+
+class OutboxRelayTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1')
+
+    def test_relay_publishes_higher_priorities_first_and_deletes_rows(self):
+        low = Notification.objects.create(user=self.user, message='Low', priority=NotificationPriority.LOW)
+        high = Notification.objects.create(user=self.user, message='High', priority=NotificationPriority.HIGH)
+        outbox.enqueue([low, high])
+
+        with mock.patch.object(outbox, 'dispatch_notification_batches', return_value=1) as dispatch:
+            self.assertEqual(outbox.relay_batch(limit=1), 1)
+            self.assertEqual(list(dispatch.call_args.args[0]), [high.pk])
+            self.assertEqual(outbox.relay_batch(), 1)
+            self.assertEqual(outbox.relay_batch(), 0)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_broker_error_keeps_the_rows(self):
+        outbox.enqueue([Notification.objects.create(user=self.user, message='Hello')])
+        with mock.patch.object(outbox, 'dispatch_notification_batches', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                outbox.relay_batch()
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    @override_settings(NOTIFICATION_CACHE_REDIS_URL=None, NOTIFICATION_DIGEST_WINDOW=0, NOTIFICATION_DEDUPE_WINDOW=0)
+    def test_send_endpoint_does_not_wait_for_the_broker(self):
+        user_cache.clear()
+        with mock.patch.object(send_notification_batch_task, 'apply_async', side_effect=ConnectionError) as publish:
+            response = self.client.post(
+                reverse('send_notification'), {'user_email': 'ann@example.com', 'message': 'Hello'},
+                content_type='application/json',
+            )
+
+        self.assertEqual(response.status_code, 202)
+        publish.assert_not_called()
+        self.assertEqual(OutboxMessage.objects.get().notification_id, response.json()['notification_id'])
+
+
+class BenchmarkHelperTests(SimpleTestCase):
+    def test_summary_reports_throughput_and_percentiles(self):
+        latencies = [ms / 1000 for ms in range(1, 101)]
+        summary = benchmarking.summarize(100, 2.0, latencies, queries=400)
+        self.assertEqual(
+            summary,
+            {'count': 100, 'seconds': 2.0, 'per_second': 50.0, 'queries_per_item': 4.0,
+             'p50_ms': 50.5, 'p95_ms': 95.05, 'p99_ms': 99.01},
+        )
+
+    def test_compare_reports_relative_changes(self):
+        change = benchmarking.compare({'per_second': 150.0, 'p95_ms': 9.0}, {'per_second': 100.0, 'p95_ms': 10.0})
+        self.assertEqual(change, 'per_second +50.0%, p95_ms -10.0%')
+        self.assertIsNone(benchmarking.compare({'per_second': 1.0}, None))
+
+    def test_stub_smtp_server_accepts_messages_from_smtplib(self):
+        with stubs.StubSMTPServer() as server:
+            host, port = server.server_address[:2]
+            with smtplib.SMTP(host, port) as client:
+                for _ in range(2):
+                    client.sendmail('from@example.com', ['to@example.com'], 'Subject: Hi\r\n\r\nHello')
+        self.assertEqual((server.count, server.connections), (2, 1))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite settings')
+class SQLiteSettingsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'db.sqlite3')
+
+    def _connect(self, alias):
+        settings_dict = copy.deepcopy(connection.settings_dict)
+        settings_dict['NAME'] = self.path
+        wrapper = connections['default'].__class__(settings_dict, alias=alias)
+        connections[alias] = wrapper
+        self.addCleanup(connections.__delitem__, alias)
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def _pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_file_database_runs_in_wal_mode(self):
+        wrapper = self._connect('wal')
+        self.assertEqual(self._pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self._pragma(wrapper, 'synchronous'), 1)
+        self.assertEqual(self._pragma(wrapper, 'busy_timeout'), 20000)
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        self._connect('first')
+        self._pragma(self._connect('second'), 'busy_timeout = 0')
+        with transaction.atomic(using='first'):
+            # A deferred transaction would only lock on its first write
+            with self.assertRaisesMessage(OperationalError, 'database is locked'):
+                with transaction.atomic(using='second'):
+                    pass
+
+
+class TemplatingTests(SimpleTestCase):
+    def _compiled(self, **fields):
+        return templating.CompiledTemplate(NotificationTemplate(name='welcome', **fields))
+
+    def test_placeholders_are_filled_per_channel(self):
+        compiled = self._compiled(
+            subject='Hi $name', body='Hello ${name}, cost $$5', telegram_body='*$name*', sms_body='$name: $missing',
+        )
+        context = {'name': 'a_b'}
+        self.assertEqual(compiled.render(ChannelChoices.EMAIL, context), ('Hi a_b', 'Hello a_b, cost $5', None))
+        self.assertEqual(compiled.render(ChannelChoices.TELEGRAM, context), ('Hi a_b', '*a\\_b*', 'MarkdownV2'))
+        # Unknown placeholders are kept, like Template.safe_substitute
+        self.assertEqual(compiled.render(ChannelChoices.SMS, context).body, 'a_b: ${missing}')
+        self.assertEqual(compiled.required, {'name', 'missing'})
+
+    def test_channel_bodies_fall_back_to_the_body(self):
+        compiled = self._compiled(body='To $email')
+        self.assertEqual(compiled.render(ChannelChoices.TELEGRAM, {'email': 'a_b'}), ('Notification', 'To a_b', None))
+        self.assertEqual(compiled.required, frozenset())
+
+    @override_settings(NOTIFICATION_SMS_MAX_LENGTH=5)
+    def test_sms_is_truncated(self):
+        compiled = self._compiled(body='$word')
+        self.assertEqual(compiled.render(ChannelChoices.SMS, {'word': 'abcdefgh'}).body, 'abcd…')
+        self.assertEqual(compiled.render(ChannelChoices.EMAIL, {'word': 'abcdefgh'}).body, 'abcdefgh')
+
+
+class TemplateCacheTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(templating.template_cache, '_local', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.templates = [NotificationTemplate.objects.create(name=f't{i}', body='Body $i') for i in range(3)]
+
+    def test_warm_loads_missing_templates_in_one_query(self):
+        templating.template_cache.get(self.templates[0].pk)
+        with self.assertNumQueries(1):
+            templating.template_cache.warm([template.pk for template in self.templates] + [None])
+        with self.assertNumQueries(0):
+            for template in self.templates:
+                templating.template_cache.get(template.pk)
+            templating.template_cache.get_by_name('t2')
+
+    def test_saving_a_template_invalidates_it(self):
+        template = self.templates[0]
+        templating.template_cache.get(template.pk)
+        template.body = 'Changed $i'
+        template.save()
+        self.assertFalse(templating.template_cache.is_cached(template.pk))
+        self.assertEqual(templating.template_cache.get(template.pk).render(ChannelChoices.EMAIL, {'i': 1}).body, 'Changed 1')
+
+
+class QueueRoutingTests(DeliveryTestCase):
+    def test_queue_follows_the_first_channel_and_priority(self):
+        self.assertEqual(routing.queue_for('high', ['telegram', 'email']), 'telegram.high')
+        self.assertEqual(routing.queue_for('low', None), 'email.low')
+
+    def test_open_breaker_routes_to_the_next_channel(self):
+        for _ in range(25):
+            with self.assertRaises(ProviderError), circuit_breaker.track(ChannelChoices.TELEGRAM):
+                raise ProviderError('Bad Gateway')
+        self.assertEqual(routing.queue_for('normal', ['telegram', 'email']), 'email.normal')
+
+    @override_settings(NOTIFICATION_QUEUE_ROUTING=False)
+    def test_routing_can_be_turned_off(self):
+        self.assertIsNone(routing.queue_for('high', ['telegram']))
+
+    def test_relay_publishes_each_queue_separately(self):
+        sms = self.create_notification(self.create_user('sms@example.com', preferred_channels=['sms']))
+        email = self.create_notification(self.create_user(), priority=NotificationPriority.HIGH)
+        outbox.enqueue([sms, email])
+
+        with mock.patch.object(outbox, 'dispatch_notification_batches', return_value=1) as dispatch:
+            outbox.relay_batch()
+        self.assertEqual(
+            {call.kwargs['queue']: list(call.args[0]) for call in dispatch.call_args_list},
+            {'email.high': [email.pk], 'sms.normal': [sms.pk]},
+        )
+
+    def test_reschedules_stay_in_the_queue_the_task_came_from(self):
+        task = mock.Mock()
+        task.request.delivery_info = {'routing_key': 'sms.low'}
+        self.assertEqual(routing.current_queue(task), 'sms.low')
+        task.request.delivery_info = None
+        self.assertIsNone(routing.current_queue(task))
+
+
+@override_settings(NOTIFICATION_CACHE_REDIS_URL=None, NOTIFICATION_DIGEST_WINDOW=0, NOTIFICATION_DEDUPE_WINDOW=0)
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        idempotency._store.local.clear()
+        user_cache.clear()
+        User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1')
+
+    def send(self, message, key):
+        return self.client.post(
+            reverse('send_notification'),
+            {'user_email': 'ann@example.com', 'message': message},
+            content_type='application/json',
+            headers={'Idempotency-Key': key},
+        )
+
+    def test_retry_with_the_same_key_returns_the_original(self):
+        first = self.send('Hello', 'key-1')
+        second = self.send('Hello', 'key-1')
+
+        self.assertEqual((first.status_code, second.status_code), (202, 202))
+        self.assertEqual(first.json()['notification_id'], second.json()['notification_id'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Notification.objects.count(), 1)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_key_reused_with_different_content_is_rejected(self):
+        self.send('Hello', 'key-1')
+        self.assertEqual(self.send('Something else', 'key-1').status_code, 422)
+
+    @override_settings(NOTIFICATION_DEDUPE_WINDOW=60)
+    def test_same_content_inside_the_dedupe_window_is_not_sent_twice(self):
+        first = self.client.post(
+            reverse('send_notification'), {'user_email': 'ann@example.com', 'message': 'Hello'},
+            content_type='application/json',
+        )
+        second = self.client.post(
+            reverse('send_notification'), {'user_email': 'ann@example.com', 'message': 'Hello'},
+            content_type='application/json',
+        )
+        self.assertEqual(first.json()['notification_id'], second.json()['notification_id'])
+
+
+@override_settings(NOTIFICATION_DIGEST_WINDOW=60, NOTIFICATION_DIGEST_PRIORITIES=('normal',))
+class DigestTests(DeliveryTestCase):
+    def test_burst_is_merged_into_one_digest_that_settles_the_originals(self):
+        user = self.create_user()
+        notifications = [self.create_notification(user, message=f'Update {i}') for i in range(3)]
+        urgent = self.create_notification(user, priority=NotificationPriority.HIGH)
+        outbox.enqueue([*notifications, urgent])
+
+        self.assertEqual(DigestBuffer.objects.count(), 3)
+        self.assertEqual(list(OutboxMessage.objects.values_list('notification_id', flat=True)), [urgent.pk])
+        self.assertEqual(digest.flush_due(), 0)
+
+        DigestBuffer.objects.update(release_at=timezone.now())
+        self.assertEqual(digest.flush_due(), 3)
+        merged = Notification.objects.get(is_digest=True)
+        self.assertTrue(merged.message.startswith('You have 3 new notifications:'))
+        self.assertIn('Update 2', merged.message)
+        self.assertTrue(OutboxMessage.objects.filter(notification=merged).exists())
+
+        send_notification_batch_task.run([merged.pk])
+        self.assertEqual(
+            set(Notification.objects.filter(digest=merged).values_list('status', flat=True)), {NotificationStatus.SENT}
+        )
+        self.assertEqual(len(FakeBackend.outbox), 1)
+
+
+@override_settings(NOTIFICATION_SWEEP_STALE_AFTER=900, NOTIFICATION_SWEEP_MAX_AGE=86400)
+class SweeperTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='ann@example.com', phone_number='1', telegram_id='t1')
+
+    def create(self, age, **fields):
+        notification = Notification.objects.create(
+            user=self.user, message='Hello', status=NotificationStatus.IN_PROGRESS, **fields
+        )
+        # created_at and updated_at are set automatically, so they are backdated afterwards
+        then = timezone.now() - age
+        Notification.objects.filter(pk=notification.pk).update(created_at=then, updated_at=then)
+        return notification
+
+    def test_stale_notifications_are_requeued_or_abandoned(self):
+        stale = self.create(timedelta(hours=1))
+        ancient = self.create(timedelta(days=2))
+        fresh = self.create(timedelta(minutes=1))
+        claimed = self.create(timedelta(hours=1), claimed_until=timezone.now() + timedelta(minutes=5))
+
+        self.assertEqual(sweeper.sweep_stale(), (1, 1))
+
+        self.assertEqual(list(OutboxMessage.objects.values_list('notification_id', flat=True)), [stale.pk])
+        ancient.refresh_from_db()
+        self.assertEqual((ancient.status, ancient.error), (NotificationStatus.FAILED, sweeper.ABANDONED_ERROR))
+        for notification in (fresh, claimed):
+            notification.refresh_from_db()
+            self.assertEqual(notification.status, NotificationStatus.IN_PROGRESS)
+        # Requeued rows wait in the outbox, so the next pass leaves them alone
+        self.assertEqual(sweeper.sweep_stale(), (0, 0))
+
+    def test_age_of_a_scheduled_notification_starts_at_its_scheduled_time(self):
+        scheduled = self.create(timedelta(days=3), scheduled_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(sweeper.sweep_stale(), (1, 0))
+
+        self.assertEqual(list(OutboxMessage.objects.values_list('notification_id', flat=True)), [scheduled.pk])
+
+
+@override_settings(NOTIFICATION_CACHE_REDIS_URL=None, NOTIFICATION_QUIET_HOURS_PRIORITIES=('normal', 'low'))
+class SchedulingTests(TestCase):
+    def setUp(self):
+        self.user = User(
+            email='ann@example.com', timezone='Europe/Berlin',
+            quiet_hours_start=dt_time(22), quiet_hours_end=dt_time(7),
+        )
+
+    def test_quiet_hours_wrap_midnight_in_the_users_timezone(self):
+        # 23:30 in Berlin (UTC+1 in January)
+        night = datetime(2026, 1, 10, 22, 30, tzinfo=dt_timezone.utc)
+        self.assertEqual(scheduling.quiet_until(self.user, night), datetime(2026, 1, 11, 6, 0, tzinfo=dt_timezone.utc))
+        self.assertIsNone(scheduling.quiet_until(self.user, datetime(2026, 1, 10, 12, tzinfo=dt_timezone.utc)))
+
+    def test_high_priority_ignores_quiet_hours(self):
+        night = datetime(2026, 1, 10, 22, 30, tzinfo=dt_timezone.utc)
+        with mock.patch('send_notifications.scheduling.timezone.now', return_value=night):
+            self.assertIsNone(scheduling.deliver_at(self.user, NotificationPriority.HIGH))
+            self.assertIsNotNone(scheduling.deliver_at(self.user, NotificationPriority.NORMAL))
+
+    def test_dispatch_due_queues_only_due_notifications(self):
+        self.user.save()
+        now = timezone.now()
+        due = Notification.objects.create(
+            user=self.user, message='Due', status=NotificationStatus.SCHEDULED, scheduled_at=now - timedelta(minutes=1)
+        )
+        Notification.objects.create(
+            user=self.user, message='Later', status=NotificationStatus.SCHEDULED, scheduled_at=now + timedelta(hours=1)
+        )
+
+        self.assertEqual(scheduling.dispatch_due(), 1)
+        due.refresh_from_db()
+        self.assertEqual(due.status, NotificationStatus.IN_PROGRESS)
+        self.assertEqual(list(OutboxMessage.objects.values_list('notification_id', flat=True)), [due.pk])
+
+
+class BackendRegistryTests(SimpleTestCase):
+    def test_backends_follow_the_setting(self):
+        configured = {
+            'sms': {'BACKEND': 'send_notifications.backends.FakeBackend', 'OPTIONS': {'batch': False, 'concurrency': 3}},
+        }
+        with self.settings(NOTIFICATION_CHANNEL_BACKENDS=configured):
+            backend = backends['sms']
+            self.assertIsInstance(backend, FakeBackend)
+            self.assertEqual((backend.batch, backend.concurrency), (False, 3))
+            self.assertIs(backends['sms'], backend)
+            with self.assertRaises(ImproperlyConfigured):
+                backends['email']
+        self.assertIsInstance(backends['sms'], StubSMSBackend)
+
+    def test_unimportable_backend_is_a_configuration_error(self):
+        with self.settings(NOTIFICATION_CHANNEL_BACKENDS={'sms': {'BACKEND': 'send_notifications.backends.Missing'}}):
+            with self.assertRaises(ImproperlyConfigured):
+                backends['sms']
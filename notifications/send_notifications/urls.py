@@ -3,5 +3,11 @@ from . import views
 
 urlpatterns = [
     path('send_notification/', views.SendNotificationView.as_view(), name='send_notification'),
+    path('send_notification/bulk/', views.BulkSendNotificationView.as_view(), name='send_notification_bulk'),
     path('send_telegram/', views.SendTelegramView.as_view(), name='send_telegram'),
+    path('notifications/', views.NotificationStatusLookupView.as_view(), name='notification_status_lookup'),
+    path('notifications/<int:notification_id>/', views.NotificationStatusView.as_view(), name='notification_status'),
+    path('users/<int:user_id>/notifications/', views.UserNotificationHistoryView.as_view(), name='user_notification_history'),
+    path('users/import/', views.UserImportView.as_view(), name='user_import'),
+    path('cache/stats/', views.CacheStatsView.as_view(), name='cache_stats'),
 ]
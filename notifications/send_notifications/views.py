@@ -1,14 +1,201 @@
-from django.core.mail import send_mail
+import base64
+import hashlib
+import io
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Prefetch, Q
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_GET
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from .models import User, Notification, NotificationStatus, ChannelChoices, DeliveryAttempt, AttemptStatus
-import os
-import requests
+from .models import User, Notification, NotificationStatus, NotificationTemplate, ChannelChoices, DeliveryAttempt
+
+from . import idempotency, importer, outbox, scheduling
+from .cache import cache_stats, channel_order, user_cache
+from .metrics import registry
+from .serializers import (
+    SendEmailSerializer,
+    SendTelegramSerializer,
+    BulkSendSerializer,
+    StatusLookupSerializer,
+    NotificationStatusSerializer,
+    UserImportSerializer,
+)
+from .templating import template_cache
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _bulk_template(data):
+    # A campaign message with recipient placeholders is stored once, as a template,
+    # and rendered per recipient at send time like any other template
+    if 'template_id' in data or '$' not in data['message']:
+        return data
+    name = f"bulk-{hashlib.sha256(data['message'].encode()).hexdigest()[:32]}"
+    template, _ = NotificationTemplate.objects.get_or_create(name=name, defaults={'body': data['message']})
+    return {**data, 'template_id': template.pk}
+
+
+def _content(data, recipient=None):
+    # Templated notifications store only the variables not taken from the recipient;
+    # the text is rendered per channel at send time
+    if 'template_id' not in data:
+        return {'message': data['message']}
+    context = {**data.get('context', {}), **data.get('contexts', {}).get(recipient, {})}
+    return {'message': '', 'template_id': data['template_id'], 'context': context or None}
+
+
+def _status_queryset():
+    return Notification.objects.prefetch_related(
+        Prefetch('attempts_log', queryset=DeliveryAttempt.objects.order_by('created_at', 'id'))
+    )
+
+
+def _lookup_ids(request):
+    raw = ','.join(request.query_params.getlist('ids'))
+    serializer = StatusLookupSerializer(data={'ids': [value for value in raw.split(',') if value]})
+    serializer.is_valid(raise_exception=True)
+    return sorted(set(serializer.validated_data['ids']))
+
+
+def _etag(queryset, *parts):
+    # updated_at moves on every state change and attempts are written in the same
+    # transaction, so row count plus newest updated_at identifies the response
+    summary = queryset.aggregate(count=Count('id'), last=Max('updated_at'))
+    last = summary['last'].isoformat() if summary['last'] else ''
+    key = '|'.join(str(part) for part in (*parts, summary['count'], last))
+    return hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def _single_etag(request, notification_id):
+    return _etag(Notification.objects.filter(pk=notification_id), notification_id)
 
-from .serializers import SendEmailSerializer, SendTelegramSerializer
-from .tasks import send_notification_task
+
+def _bulk_etag(request):
+    try:
+        ids = _lookup_ids(request)
+    except ValidationError:
+        return None
+    return _etag(Notification.objects.filter(pk__in=ids), *ids)
+
+
+def _history_page(request, queryset, user_id):
+    """The page of ``queryset`` a history request asks for, plus one row to tell if more follow."""
+    try:
+        limit = min(int(request.query_params.get('limit', settings.NOTIFICATION_HISTORY_PAGE_SIZE)),
+                    settings.NOTIFICATION_HISTORY_PAGE_SIZE)
+    except ValueError:
+        raise ValidationError({'limit': 'Must be an integer'})
+    limit = max(limit, 1)
+
+    # Keyset pagination on (created_at, id): each page is an index range scan
+    # on notification_user_hist_idx, however deep the client pages
+    queryset = queryset.filter(user_id=user_id, created_at__isnull=False)
+    cursor = request.query_params.get('cursor')
+    if cursor:
+        created_at, notification_id = _decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=notification_id)
+        )
+    return queryset.order_by('-created_at', '-id')[:limit + 1], limit
+
+
+def _history_etag(request, user_id):
+    # Only the requested page's ids plus the user's newest updated_at (one probe of
+    # notification_user_upd_idx): a change on the page moves the latter, a new or
+    # removed notification the former. Changes elsewhere only cost a full response.
+    try:
+        page, limit = _history_page(request, Notification.objects.all(), user_id)
+    except ValidationError:
+        return None
+    ids = list(page.values_list('id', flat=True))
+    last = Notification.objects.filter(user_id=user_id).aggregate(last=Max('updated_at'))['last']
+    key = '|'.join(str(part) for part in (user_id, limit, *ids, last.isoformat() if last else ''))
+    return hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+def _encode_cursor(notification):
+    raw = f'{notification.created_at.isoformat()},{notification.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        created_at, notification_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit(',', 1)
+        return datetime.fromisoformat(created_at), int(notification_id)
+    except ValueError:
+        raise ValidationError({'cursor': 'Invalid cursor'})
+
+
+def _queued(notification_id, replayed=False):
+    response = Response({'detail': 'Notification queued', 'notification_id': notification_id}, status=status.HTTP_202_ACCEPTED)
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _queue_notification(request, user, data, channel):
+    # Retries with the same Idempotency-Key, or the same content inside the dedupe
+    # window, get the original notification back instead of a second message
+    key = request.headers.get('Idempotency-Key') or None
+    if key is not None and len(key) > 255:
+        raise ValidationError({'Idempotency-Key': 'At most 255 characters'})
+    content = _content(data)
+    digest = idempotency.content_hash(user.pk, channel, content)
+    try:
+        original = idempotency.find_original(key, digest) if key else None
+    except idempotency.IdempotencyConflict:
+        return Response(
+            {'detail': 'Idempotency-Key was already used with a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    original = original or idempotency.find_duplicate(user.pk, digest)
+    if original:
+        return _queued(original, replayed=True)
+
+    # The outbox row commits with the notification; relay_outbox publishes it,
+    # or queues it once it is due if it is scheduled for later
+    scheduled_at = scheduling.deliver_at(user, data['priority'], data.get('scheduled_at'))
+    try:
+        with transaction.atomic():
+            notification = Notification.objects.create(
+                user=user,
+                **content,
+                priority=data['priority'],
+                status=NotificationStatus.SCHEDULED if scheduled_at else NotificationStatus.IN_PROGRESS,
+                scheduled_at=scheduled_at,
+                last_channel=channel,
+                idempotency_key=key,
+                content_hash=digest,
+            )
+            outbox.enqueue([notification])
+    except IntegrityError:
+        # A concurrent request with the same key won the insert
+        if key is None:
+            raise
+        try:
+            original = idempotency.find_original(key, digest)
+        except idempotency.IdempotencyConflict:
+            original = None
+        if original is None:
+            raise
+        return _queued(original, replayed=True)
+    if key is not None:
+        idempotency.remember(key, notification.id, digest)
+    return _queued(notification.id)
 
 
 class SendNotificationView(APIView):
@@ -16,23 +203,13 @@ class SendNotificationView(APIView):
         serializer = SendEmailSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user_email = serializer.validated_data['user_email']
-        message = serializer.validated_data['message']
 
         try:
-            user = User.objects.get(email=user_email)
+            user = user_cache.get_by_email(user_email)
         except User.DoesNotExist:
             return Response({'detail': 'User does not exist'}, status=status.HTTP_404_NOT_FOUND)
 
-        notification = Notification.objects.create(
-            user=user,
-            message=message,
-            status=NotificationStatus.IN_PROGRESS,
-            last_channel=ChannelChoices.EMAIL,
-        )
-
-        # Enqueue async delivery with fallback across channels
-        send_notification_task.delay(notification.id)
-        return Response({'detail': 'Notification queued', 'notification_id': notification.id}, status=status.HTTP_202_ACCEPTED)
+        return _queue_notification(request, user, serializer.validated_data, ChannelChoices.EMAIL)
 
 
 class SendTelegramView(APIView):
@@ -40,25 +217,150 @@ class SendTelegramView(APIView):
         serializer = SendTelegramSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         telegram_id = serializer.validated_data['telegram_id']
-        message = serializer.validated_data['message']
 
-        bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
-        if not bot_token:
+        if not settings.TELEGRAM_BOT_TOKEN:
             return Response({'detail': 'Bot token not configured'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         # Check if user exists
         try:
-            user = User.objects.get(telegram_id=telegram_id)
+            user = user_cache.get_by_telegram_id(telegram_id)
         except User.DoesNotExist:
             return Response({'detail': 'User does not exist'}, status=status.HTTP_404_NOT_FOUND)
 
-        notification = Notification.objects.create(
-            user=user,
-            message=message,
-            status=NotificationStatus.IN_PROGRESS,
-            last_channel=ChannelChoices.TELEGRAM,
+        return _queue_notification(request, user, serializer.validated_data, ChannelChoices.TELEGRAM)
+
+
+class BulkSendNotificationView(APIView):
+    def post(self, request):
+        serializer = BulkSendSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = _bulk_template(serializer.validated_data)
+        chunk_size = settings.NOTIFICATION_BULK_CHUNK_SIZE
+
+        if 'user_id_from' in data:
+            # Ranges report counts only, so the response does not grow with the campaign
+            queued = self._send_to_range(data['user_id_from'], data['user_id_to'], data, chunk_size)
+            return Response({'detail': 'Notifications queued', 'queued': queued}, status=status.HTTP_202_ACCEPTED)
+
+        results, not_found = self._send_to_emails(data['user_emails'], data, chunk_size)
+        return Response(
+            {
+                'detail': 'Notifications queued',
+                'queued': len(results),
+                'results': results,
+                'not_found': not_found,
+            },
+            status=status.HTTP_202_ACCEPTED,
         )
 
-        # Enqueue async delivery with fallback across channels
-        send_notification_task.delay(notification.id)
-        return Response({'detail': 'Notification queued', 'notification_id': notification.id}, status=status.HTTP_202_ACCEPTED)
+    def _send_to_emails(self, emails, data, chunk_size):
+        results = []
+        not_found = []
+        # dict.fromkeys drops duplicate recipients while keeping request order
+        for chunk in _chunked(dict.fromkeys(emails), chunk_size):
+            users = {user.email: user for user in User.objects.filter(email__in=chunk)}
+            found = []
+            for email in chunk:
+                if email in users:
+                    found.append(users[email])
+                else:
+                    not_found.append(email)
+            for notification in self._create_notifications(found, data):
+                results.append({'user_email': notification.user.email, 'notification_id': notification.id})
+        return results, not_found
+
+    def _send_to_range(self, user_id_from, user_id_to, data, chunk_size):
+        queued = 0
+        last_id = user_id_from - 1
+        # Keyset pagination over the primary key keeps each chunk an index range scan
+        while True:
+            users = list(
+                User.objects.filter(pk__gt=last_id, pk__lte=user_id_to).order_by('pk')[:chunk_size]
+            )
+            if not users:
+                break
+            last_id = users[-1].pk
+            queued += len(self._create_notifications(users, data))
+        return queued
+
+    def _create_notifications(self, users, data):
+        notifications = []
+        for user in users:
+            scheduled_at = scheduling.deliver_at(user, data['priority'], data.get('scheduled_at'))
+            notifications.append(Notification(
+                user=user,
+                **_content(data, user.email),
+                priority=data['priority'],
+                status=NotificationStatus.SCHEDULED if scheduled_at else NotificationStatus.IN_PROGRESS,
+                scheduled_at=scheduled_at,
+                # The channel delivery starts with; the worker records the one that got through
+                last_channel=channel_order(user.preferred_channels)[0],
+            ))
+        with transaction.atomic():
+            Notification.objects.bulk_create(notifications)
+            outbox.enqueue(notifications)
+        return notifications
+
+
+class NotificationStatusView(APIView):
+    @method_decorator(condition(etag_func=_single_etag))
+    def get(self, request, notification_id):
+        notification = _status_queryset().filter(pk=notification_id).first()
+        if notification is None:
+            return Response({'detail': 'Notification does not exist'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(NotificationStatusSerializer(notification).data)
+
+
+class NotificationStatusLookupView(APIView):
+    @method_decorator(condition(etag_func=_bulk_etag))
+    def get(self, request):
+        ids = _lookup_ids(request)
+        notifications = list(_status_queryset().filter(pk__in=ids).order_by('id'))
+        found = {notification.id for notification in notifications}
+        return Response({
+            'results': NotificationStatusSerializer(notifications, many=True).data,
+            'not_found': [notification_id for notification_id in ids if notification_id not in found],
+        })
+
+
+class UserNotificationHistoryView(APIView):
+    @method_decorator(condition(etag_func=_history_etag))
+    def get(self, request, user_id):
+        page, limit = _history_page(request, _status_queryset(), user_id)
+        notifications = list(page)
+        next_cursor = _encode_cursor(notifications[limit - 1]) if len(notifications) > limit else None
+        return Response({
+            'results': NotificationStatusSerializer(notifications[:limit], many=True).data,
+            'next_cursor': next_cursor,
+        })
+
+
+class UserImportView(APIView):
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        serializer = UserImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.validated_data['file']
+        fmt = serializer.validated_data.get('format') or importer.format_for(upload.name)
+
+        # Uploads past FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to disk; rows are read
+        # from there one at a time, so large exports do not end up in memory
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        try:
+            result = importer.import_users(stream, fmt)
+        except (importer.ImportFileError, UnicodeDecodeError) as exc:
+            raise ValidationError({'file': str(exc)})
+        finally:
+            stream.detach()
+        return Response(result.as_dict())
+
+
+class CacheStatsView(APIView):
+    def get(self, request):
+        return Response({**cache_stats(), 'templates': template_cache.stats()})
+
+
+@require_GET
+def metrics_view(request):
+    return HttpResponse(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)